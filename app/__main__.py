@@ -0,0 +1,136 @@
+import argparse
+import time
+
+try:
+    from .des_classes1 import CI_METHODS, ENGINES, g, Scenario, Trial
+    from .snapshots import SnapshotLibrary
+except ImportError: # run from inside the app folder
+    from des_classes1 import CI_METHODS, ENGINES, g, Scenario, Trial
+    from snapshots import SnapshotLibrary
+
+# Command line entry point for running a trial without the app, e.g.
+#   python -m app --runs 20 --parallel
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Run the non-elective flow simulation and print the "
+                    "trial summary")
+    parser.add_argument("--runs", type=int, default=g.number_of_runs,
+                        help="number of runs in the trial")
+    parser.add_argument("--engine", choices=ENGINES, default="simpy",
+                        help="simulation engine")
+    parser.add_argument("--parallel", action="store_true",
+                        help="spread the runs over a pool of worker processes")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="number of worker processes (default: all CPUs)")
+    parser.add_argument("--precision", type=float, default=None,
+                        help="keep running (up to --runs runs) until the 95%% "
+                             "CIs of the key metrics are within this fraction "
+                             "of their means, e.g. 0.05")
+    parser.add_argument("--min-runs", type=int, default=5,
+                        help="fewest runs for a --precision trial")
+    parser.add_argument("--detect-warm-up", action="store_true",
+                        help="work out the warm up period from pilot runs")
+    parser.add_argument("--snapshots", default=None, metavar="PATH",
+                        help="start runs from the warmed up snapshots in this "
+                             "file (fast engine), adding any that are missing")
+    parser.add_argument("--top-up-days", type=float, default=None,
+                        help="with --snapshots, start runs with no snapshot of "
+                             "their own from the nearest one and warm up for "
+                             "this many days")
+    parser.add_argument("--seed", type=int, default=g.master_seed,
+                        help="master random seed (replays an earlier trial)")
+    parser.add_argument("--ci", choices=CI_METHODS, default="normal",
+                        help="distribution the summary's 95%% CIs are taken "
+                             "from (t is wider for a few runs)")
+    parser.add_argument("--common-random-numbers", action="store_true",
+                        help="draw each patient's length of stay as they "
+                             "arrive, so runs line up patient by patient "
+                             "with other scenarios")
+    parser.add_argument("--profile", nargs="?", const="time",
+                        choices=["time", "memory"], default=None,
+                        help="time the phases of every run and print where "
+                             "the time went (memory also measures each run's "
+                             "peak memory, but slows the runs down)")
+    parser.add_argument("--patient-results", default=None, metavar="DIR",
+                        help="write every run's patient level results to "
+                             "this folder (one Arrow file per run)")
+    parser.add_argument("--parquet", default=None, metavar="PATH",
+                        help="with --patient-results, also write them all to "
+                             "this Parquet file")
+    args = parser.parse_args(argv)
+    if args.parquet is not None and args.patient_results is None:
+        parser.error("--parquet needs --patient-results")
+
+    scenario = Scenario(number_of_runs=args.runs, master_seed=args.seed,
+                        common_random_numbers=args.common_random_numbers)
+
+    snapshots = None
+    top_up_period = None
+    if args.snapshots is not None:
+        if args.engine != "fast":
+            parser.error("--snapshots needs --engine fast")
+        snapshots = SnapshotLibrary(args.snapshots)
+        if args.top_up_days is not None:
+            top_up_period = args.top_up_days * 24 * 60
+
+    results_store = None
+    if args.patient_results is not None:
+        # pyarrow is only needed for this, so only import it when it is used
+        try:
+            from .results_store import PatientResultsStore
+        except ImportError: # run from inside the app folder
+            from results_store import PatientResultsStore
+        results_store = PatientResultsStore(args.patient_results)
+        results_store.clear()
+
+    up_to = "up to " if args.precision is not None else ""
+    print(f"Running {up_to}{scenario.number_of_runs} simulations "
+          f"(master seed {scenario.master_seed})......")
+    start_time = time.time()
+
+    # patient level rows are summarised as the runs finish rather than kept
+    trial = Trial(scenario, engine=args.engine, parallel=args.parallel,
+                  n_workers=args.workers, keep_patient_level=False,
+                  precision=args.precision, min_runs=args.min_runs,
+                  detect_warm_up=args.detect_warm_up,
+                  warm_start=snapshots is not None, snapshots=snapshots,
+                  top_up_period=top_up_period, ci_method=args.ci,
+                  profile=("memory" if args.profile == "memory"
+                           else args.profile is not None),
+                  results_store=results_store)
+    df_trial_results, _, trial_summary = trial.run_trial()
+
+    elapsed_time = time.time() - start_time
+    if snapshots is not None:
+        snapshots.save()
+    print(f"That took {round(elapsed_time)} seconds")
+    if results_store is not None:
+        print(f"Patient level results written to {args.patient_results}")
+        if args.parquet is not None:
+            results_store.to_parquet(args.parquet)
+            print(f"and to {args.parquet}")
+    if args.detect_warm_up:
+        print(f"Warm up period: "
+              f"{trial.scenario.warm_up_period / (24 * 60):g} days")
+        print(trial.warm_up_analysis.to_dataframe().to_string())
+        if trial.warm_up_analysis.warning() is not None:
+            print(f"Warning: {trial.warm_up_analysis.warning()}")
+        print()
+    if args.precision is not None:
+        print(f"Stopped after {trial.n_runs} runs")
+        print(trial.precision_df.round(3).to_string())
+        print()
+    print(trial_summary.to_string())
+    print()
+    if args.profile is not None:
+        run_profiles, trial_phases = trial.profiling_dataframe()
+        print("Profile of the runs")
+        print(run_profiles.round(3).to_string())
+        print()
+        print(trial_phases.round(3).to_string())
+        print()
+    print("Patient level queue times (hours, all runs)")
+    print(trial.patient_summary.to_dataframe().to_string())
+
+if __name__ == "__main__":
+    main()
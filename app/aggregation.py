@@ -0,0 +1,201 @@
+import math
+
+import numpy as np
+import pandas as pd
+
+# Patient level columns summarised for every run, all queue times in minutes
+SUMMARY_COLUMNS = ["Q Time Bed",
+                   "Q Time Bed|Renege",
+                   "Q Time Bed SDEC",
+                   "Q Time Bed Other"]
+
+# Online accumulators for patient level results. Each one is updated a run
+# (i.e. an array of values) at a time and can be merged with another of the
+# same kind, so runs can be summarised in worker processes and combined in
+# the trial without ever holding every patient row in memory.
+
+# Count, mean and variance (Welford's algorithm, with Chan et al's formula for
+# combining two sets of values) plus the running min and max.
+class RunningStats:
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0 # sum of squared differences from the mean
+        self.min = math.inf
+        self.max = -math.inf
+
+    def combine(self, count, mean, m2, min_value, max_value):
+        if count == 0:
+            return
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self.m2 += m2 + delta * delta * self.count * count / total
+        self.count = total
+        self.min = min(self.min, min_value)
+        self.max = max(self.max, max_value)
+
+    def update(self, values):
+        values = np.asarray(values, dtype=float)
+        if len(values) == 0:
+            return
+        mean = values.mean()
+        self.combine(len(values), mean, ((values - mean) ** 2).sum(),
+                     values.min(), values.max())
+
+    def merge(self, other):
+        self.combine(other.count, other.mean, other.m2, other.min, other.max)
+
+    # Sample variance, as pandas' .var()
+    @property
+    def variance(self):
+        return self.m2 / (self.count - 1) if self.count > 1 else np.nan
+
+    @property
+    def std(self):
+        return math.sqrt(self.variance) if self.count > 1 else np.nan
+
+
+# Mergeable quantile sketch with a relative error guarantee (the approach used
+# by DDSketch). Values are counted in logarithmically sized buckets, so any
+# quantile is returned to within relative_accuracy of the true value whatever
+# the distribution, and merging two sketches is just adding their counts.
+# Values at or below min_value (e.g. zero queue times) get their own bucket.
+class QuantileSketch:
+    def __init__(self, relative_accuracy=0.01, min_value=1e-9):
+        self.relative_accuracy = relative_accuracy
+        self.min_value = min_value
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.buckets = {}
+        self.zero_count = 0
+        self.count = 0
+
+    def update(self, values):
+        values = np.asarray(values, dtype=float)
+        is_zero = values <= self.min_value
+        self.zero_count += int(is_zero.sum())
+        self.count += len(values)
+
+        keys = np.ceil(np.log(values[~is_zero]) / self.log_gamma)
+        keys, counts = np.unique(keys.astype(np.int64), return_counts=True)
+        for key, count in zip(keys.tolist(), counts.tolist()):
+            self.buckets[key] = self.buckets.get(key, 0) + count
+
+    def merge(self, other):
+        if other.gamma != self.gamma:
+            raise ValueError("Can only merge sketches with the same accuracy")
+        self.zero_count += other.zero_count
+        self.count += other.count
+        for key, count in other.buckets.items():
+            self.buckets[key] = self.buckets.get(key, 0) + count
+
+    # Estimate of the q'th quantile (0 <= q <= 1), using the same rank as
+    # pandas' default (linear) quantile
+    def quantile(self, q):
+        if self.count == 0:
+            return np.nan
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0.0
+        for key in sorted(self.buckets):
+            seen += self.buckets[key]
+            if rank < seen:
+                # middle of the bucket (gamma^(key-1), gamma^key]
+                return 2 * self.gamma ** key / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.buckets) / (self.gamma + 1)
+
+
+# Counts of values in fixed width bins starting at origin. The bins grow to
+# fit the largest value seen. Values below origin are counted in underflow.
+class FixedHistogram:
+    def __init__(self, bin_width=1.0, origin=0.0):
+        self.bin_width = bin_width
+        self.origin = origin
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.underflow = 0
+
+    def add_counts(self, counts):
+        if len(counts) > len(self.counts):
+            counts = counts.copy()
+            counts[:len(self.counts)] += self.counts
+            self.counts = counts
+        else:
+            self.counts[:len(counts)] += counts
+
+    def update(self, values):
+        values = np.asarray(values, dtype=float)
+        bins = np.floor((values - self.origin) / self.bin_width)
+        below = bins < 0
+        self.underflow += int(below.sum())
+        self.add_counts(np.bincount(bins[~below].astype(np.int64)))
+
+    def merge(self, other):
+        if (other.bin_width, other.origin) != (self.bin_width, self.origin):
+            raise ValueError("Can only merge histograms with the same bins")
+        self.underflow += other.underflow
+        self.add_counts(other.counts)
+
+    # Bin edges, one more than the number of counts
+    @property
+    def edges(self):
+        return self.origin + self.bin_width * np.arange(len(self.counts) + 1)
+
+
+# Streaming summary of the patient level results of a trial. For each of
+# columns it keeps RunningStats, a QuantileSketch and a FixedHistogram of the
+# values in hours (bin_width is in hours too). Missing values are skipped, as
+# they are by pandas.
+class PatientSummary:
+    def __init__(self, columns=SUMMARY_COLUMNS, bin_width=1.0,
+                 relative_accuracy=0.01):
+        self.columns = list(columns)
+        self.stats = {col: RunningStats() for col in self.columns}
+        self.sketches = {col: QuantileSketch(relative_accuracy)
+                         for col in self.columns}
+        self.histograms = {col: FixedHistogram(bin_width)
+                           for col in self.columns}
+
+    # Summary of a single run's patient level results
+    @classmethod
+    def from_results(cls, results_df, **kwargs):
+        summary = cls(**kwargs)
+        summary.update(results_df)
+        return summary
+
+    def update(self, results_df):
+        for col in self.columns:
+            values = results_df[col].to_numpy(dtype=float) / 60.0
+            values = values[~np.isnan(values)]
+            self.stats[col].update(values)
+            self.sketches[col].update(values)
+            self.histograms[col].update(values)
+
+    def merge(self, other):
+        for col in self.columns:
+            self.stats[col].merge(other.stats[col])
+            self.sketches[col].merge(other.sketches[col])
+            self.histograms[col].merge(other.histograms[col])
+
+    def quantile(self, column, q):
+        return self.sketches[column].quantile(q)
+
+    # (counts, bin edges) of a column, as returned by np.histogram
+    def histogram(self, column):
+        histogram = self.histograms[column]
+        return histogram.counts, histogram.edges
+
+    # One row per column of the pooled patient level results (in hours)
+    def to_dataframe(self):
+        rows = []
+        for col in self.columns:
+            stats = self.stats[col]
+            rows.append({"Metric": col,
+                         "Count": stats.count,
+                         "Mean": stats.mean if stats.count else np.nan,
+                         "St. dev": stats.std,
+                         "Min": stats.min if stats.count else np.nan,
+                         "95th Percentile": self.quantile(col, 0.95),
+                         "Max": stats.max if stats.count else np.nan})
+        return pd.DataFrame(rows).set_index("Metric").round(2)
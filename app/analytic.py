@@ -0,0 +1,191 @@
+import argparse
+import math
+
+import numpy as np
+import pandas as pd
+
+try:
+    from .des_classes1 import Scenario, SUMMARY_METRICS, metric_values
+    from .sweep import Sweep, parse_values
+except ImportError: # imported from inside the app folder
+    from des_classes1 import Scenario, SUMMARY_METRICS, metric_values
+    from sweep import Sweep, parse_values
+
+# Metrics estimated by estimate that are also in the trial summary, so the
+# two can be compared (see validate)
+COMPARED_METRICS = ["Mean Q Time (Hrs)", "4hr DTA Performance (%)",
+                    "Mean Q Time SDEC", "Mean Q Time Other"]
+
+# Probability an arrival has to wait in an M/M/c queue with servers servers
+# and an offered load of load (arrival rate x mean service time), from the
+# Erlang B recursion, which stays accurate for hundreds of servers. 1 if the
+# load is at or over the number of servers.
+def erlang_c(servers, load):
+    if load >= servers:
+        return 1.0
+    erlang_b = 1.0
+    for k in range(1, servers + 1):
+        erlang_b = load * erlang_b / (k + load * erlang_b)
+    return erlang_b / (1 - (load / servers) * (1 - erlang_b))
+
+# ED patients queuing for a bed renege at a time drawn from U(0,
+# RENEGE_HORIZON) minutes unless they deteriorate first (at a time from the
+# same distribution) and are escalated, as in Model. Either way they leave
+# the ED queue, at a rate of about 2 / RENEGE_HORIZON a minute early on.
+RENEGE_HORIZON = 9000
+
+# Probability an arrival has to wait and their mean wait in an M/M/c+M
+# (Erlang A) queue, where those waiting give up at abandon_rate, from the
+# birth-death chain's stationary distribution (in logs, so hundreds of
+# servers don't overflow). Rates are per minute, and the wait is in minutes.
+def erlang_a(servers, arrival_rate, service_rate, abandon_rate):
+    # enough queue lengths that longer ones are vanishingly unlikely
+    max_queue = max(1000, math.ceil(20 * arrival_rate / abandon_rate))
+    n = np.arange(1, servers + max_queue + 1)
+    departure_rate = np.where(n <= servers, n * service_rate,
+                              servers * service_rate + (n - servers) * abandon_rate)
+    log_p = np.concatenate([[0.0], np.cumsum(np.log(arrival_rate / departure_rate))])
+    p = np.exp(log_p - log_p.max())
+    p /= p.sum()
+    mean_queue = (p[servers + 1:] * np.arange(1, max_queue + 1)).sum()
+    return p[servers:].sum(), mean_queue / arrival_rate
+
+# Instant estimate of a scenario's results without simulating it, from an
+# M/G/c queue for the beds with two non-preemptive priority classes: SDEC and
+# Other patients (priority 0.8) ahead of ED patients (1 or 2).
+#
+# With spare capacity (an offered load below the number of beds) the
+# probability of waiting is Erlang C and the mean wait of each class is
+# Cobham's formula for priority classes, scaled by (1 + cv^2) / 2 for the
+# lognormal length of stay (cv its coefficient of variation). That leaves out
+# reneging, which keeps waits down close to capacity, so if Erlang A (with ED
+# patients leaving the queue, see RENEGE_HORIZON) gives a shorter ED wait its
+# probability of waiting and ED wait are used instead.
+#
+# Over capacity ("Over Capacity" is True) there is no steady state without
+# reneging, so a fluid approximation is used instead: every bed is in use and
+# ED patients wait the time w at which the ones who renege before being
+# escalated or getting a bed make up the excess admissions, with SDEC, Other
+# and escalated ED patients going ahead of them. At most half of ED patients
+# can renege, so past that the waits are infinite.
+#
+# The 4hr performance takes the ED wait of those who wait to be exponential.
+# It is a guide to whether a scenario is worth running, not a replacement for
+# the model (see validate). Takes about a millisecond.
+def estimate(scenario=None):
+    scenario = scenario if scenario is not None else Scenario.from_g()
+    beds = scenario.number_of_nelbeds
+    mean_los = scenario.mean_time_in_bed
+    cv_squared = (scenario.sd_time_in_bed / mean_los) ** 2
+    # arrivals per minute
+    ed_rate = 1 / scenario.ed_inter_visit
+    sdec_other_rate = 1 / scenario.sdec_inter_visit + 1 / scenario.other_inter_visit
+    load = (ed_rate + sdec_other_rate) * mean_los
+    excess_rate = max(ed_rate + sdec_other_rate - beds / mean_los, 0)
+    # wait for the next bed to come free when they are all in use (minutes)
+    next_bed = mean_los / beds * (1 + cv_squared) / 2
+
+    if load < beds:
+        p_wait = erlang_c(beds, load)
+        sdec_other_share = sdec_other_rate * mean_los / beds
+        ed_wait = (p_wait * next_bed
+                   / ((1 - sdec_other_share) * (1 - load / beds)))
+        p_wait_reneging, ed_wait_reneging = erlang_a(
+            beds, ed_rate + sdec_other_rate, 1 / mean_los, 2 / RENEGE_HORIZON)
+        if ed_wait_reneging < ed_wait:
+            p_wait, ed_wait = p_wait_reneging, ed_wait_reneging
+    else:
+        p_wait = 1.0
+        # share of ED patients who have to renege
+        p_renege = excess_rate / ed_rate
+        if p_renege >= 0.5:
+            ed_wait = math.inf
+        else:
+            # P(renege before w) = w/T - w^2/(2T^2), solved for w
+            horizon = RENEGE_HORIZON
+            wait = horizon * (1 - math.sqrt(1 - 2 * p_renege))
+            # admitted ED patients either wait the whole w or are escalated
+            # at u (before w and before they would renege) and then admitted
+            p_full_wait = (1 - wait / horizon) ** 2
+            escalated_wait = (wait ** 2 / (2 * horizon)
+                              - wait ** 3 / (3 * horizon ** 2))
+            ed_wait = (p_full_wait * wait + escalated_wait) / (1 - p_renege)
+        # escalated ED patients (as many as renege) go ahead with SDEC and
+        # Other patients
+        sdec_other_share = min((sdec_other_rate + excess_rate) * mean_los / beds,
+                               0.99)
+    sdec_other_wait = p_wait * next_bed / (1 - sdec_other_share)
+
+    within_4hr = 1.0
+    if ed_wait > 0:
+        within_4hr = 1 - p_wait * math.exp(-240 * p_wait / ed_wait)
+    return {"Offered Load (Beds)": load,
+            "Utilisation (%)": min(load / beds, 1) * 100,
+            "Over Capacity": load >= beds,
+            "Excess Admissions per Day": excess_rate * 1440,
+            "Probability of Waiting (%)": p_wait * 100,
+            "Mean Q Time (Hrs)": ed_wait / 60,
+            "4hr DTA Performance (%)": within_4hr * 100,
+            "Mean Q Time SDEC": sdec_other_wait / 60,
+            "Mean Q Time Other": sdec_other_wait / 60}
+
+# Checks estimate against the model: runs every combination of parameters
+# (as for Sweep, e.g. {"number_of_nelbeds": [380, 434, 500]}) and returns one
+# row per scenario with the analytic and simulated (mean over the runs)
+# value of each of COMPARED_METRICS, plus the offered load and whether the
+# estimate calls the scenario over capacity.
+def validate(parameters, base_scenario=None, n_runs=5, engine="fast",
+             n_workers=None):
+    base_scenario = (base_scenario if base_scenario is not None
+                     else Scenario.from_g()).replace(number_of_runs=n_runs)
+    sweep = Sweep(parameters, base_scenario, engine=engine, n_workers=n_workers)
+    results = sweep.run()
+    swept = list(parameters)
+    simulated = metric_values(
+        results, {metric: SUMMARY_METRICS[metric] for metric in COMPARED_METRICS})
+    simulated = simulated.groupby([results[name] for name in swept]).mean()
+
+    rows = []
+    for scenario in sweep.get_scenarios():
+        analytic = estimate(scenario)
+        key = tuple(getattr(scenario, name) for name in swept)
+        row = {name: value for name, value in zip(swept, key)}
+        row["Offered Load (Beds)"] = analytic["Offered Load (Beds)"]
+        row["Over Capacity"] = analytic["Over Capacity"]
+        sim_row = simulated.loc[key if len(key) > 1 else key[0]]
+        for metric in COMPARED_METRICS:
+            row[f"{metric} Analytic"] = analytic[metric]
+            row[f"{metric} Simulated"] = sim_row[metric]
+        rows.append(row)
+    return pd.DataFrame(rows).set_index(swept)
+
+
+# Command line entry point: prints the estimate for g's scenario, or with
+# parameters compares the estimate with the model over a grid, e.g.
+#   python -m app.analytic number_of_nelbeds=380:500:20 --runs 5
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Instant analytic estimate of the model's results, and "
+                    "how it compares with the model over a grid of scenarios")
+    parser.add_argument("parameters", nargs="*", metavar="NAME=VALUES",
+                        help="scenario value and the values to compare at, as "
+                             "v1,v2,... or start:stop:step")
+    parser.add_argument("--runs", type=int, default=5,
+                        help="runs per scenario")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="number of worker processes (default: all CPUs)")
+    args = parser.parse_args(argv)
+
+    if not args.parameters:
+        print(pd.Series(estimate()).to_string())
+        return
+
+    parameters = {}
+    for parameter in args.parameters:
+        name, _, values = parameter.partition("=")
+        parameters[name] = parse_values(values)
+    comparison = validate(parameters, n_runs=args.runs, n_workers=args.workers)
+    print(comparison.round(2).to_string())
+
+if __name__ == "__main__":
+    main()
@@ -2,18 +2,145 @@ import streamlit as st
 import plotly.express as px
 import pandas as pd
 import numpy as np
-import seaborn as sns
-import matplotlib.pyplot as plt
+import os
+import uuid
 
-from des_classes1 import g, Trial
+from analytic import estimate
+from charts import (figure_png, occupancy_bands_chart, playback_animation,
+                    wait_time_histogram)
+from comparison import paired_differences
+from des_classes1 import Model, Scenario, SUMMARY_METRICS
+from event_log import EVENTS, playback_frames
+from jobs import JobQueue
+from result_cache import ResultCache
+from scenario_store import ScenarioStore
+
+# One result cache for the whole server, shared by every session
+@st.cache_resource
+def get_result_cache():
+    return ResultCache()
+
+# Every scenario run on the server is saved here, for the compare tab: the
+# file in NEL_FLOW_SCENARIO_DB if it is set, otherwise the default store in
+# the user's data folder
+@st.cache_resource
+def get_scenario_store():
+    return ScenarioStore(os.environ.get("NEL_FLOW_SCENARIO_DB"))
+
+# A page of saved scenarios: their inputs as set on the sliders and the mean
+# of every summary metric, one row per scenario. latest_id is only there so
+# the page is loaded again when a scenario is added.
+@st.cache_data(max_entries=100)
+def load_scenario_page(owner, beds, mean_los, page, page_size, latest_id):
+    scenarios = get_scenario_store().query(
+        owner=owner, limit=page_size, offset=page * page_size,
+        metrics=list(SUMMARY_METRICS),
+        number_of_nelbeds=beds,
+        mean_time_in_bed=(mean_los[0] * 60, mean_los[1] * 60))
+    inputs = pd.DataFrame({
+        'Scenario': scenarios['label'].fillna('Scenario') + " (#" + scenarios.index.astype(str) + ")",
+        'Saved': pd.to_datetime(scenarios['created'], unit='s').dt.strftime('%Y-%m-%d %H:%M'),
+        'Mean LoS': scenarios['mean_time_in_bed'] / 60,
+        'Number of beds': scenarios['number_of_nelbeds'],
+        'Admissions via ED': 1440 / scenarios['ed_inter_visit'],
+        'Admissions via SDEC': 1440 / scenarios['sdec_inter_visit'],
+        'Admissions via Other': 1440 / scenarios['other_inter_visit'],
+        'Number of runs': scenarios['n_runs']})
+    return inputs.join(scenarios[[m for m in SUMMARY_METRICS if m in scenarios]]).round(2)
+
+# Run by run results of a saved scenario (which never change)
+@st.cache_data(max_entries=200)
+def load_run_results(scenario_id):
+    return get_scenario_store().run_results(scenario_id)
+
+# The charts are drawn from the binned counts and percentile bands (charts.py)
+# and kept as images, so a rerun shows them without drawing them again
+@st.cache_data(max_entries=50)
+def wait_time_chart(counts, bin_edges, trial_summary):
+    return figure_png(wait_time_histogram(counts, bin_edges, trial_summary))
+
+@st.cache_data(max_entries=50)
+def occupancy_chart(bands, warm_up_period):
+    return figure_png(occupancy_bands_chart(bands, warm_up_period))
+
+# The first run of a scenario again, with its event log, played back as
+# frames every interval minutes through the results period. Only the frames
+# are kept, not the log.
+@st.cache_data(max_entries=20)
+def load_playback(scenario, interval):
+    model = Model(0, scenario)
+    event_log = model.enable_event_log()
+    model.run()
+    return playback_frames(event_log, interval, start=scenario.warm_up_period,
+                           end=scenario.warm_up_period + scenario.sim_duration)
+
+@st.cache_data(max_entries=20)
+def playback_chart(frames, capacity, start):
+    return playback_animation(frames, capacity, start=start)
+
+# One job queue for the whole server: every session's trials run in the
+# background on the same pool of worker processes
+@st.cache_resource
+def get_job_queue():
+    return JobQueue(get_result_cache())
 
 #Initialise session state
 if 'button_click_count' not in st.session_state:
   st.session_state.button_click_count = 0
-if 'session_results' not in st.session_state:
-    st.session_state['session_results'] = []
-if 'session_inputs' not in st.session_state:
-    st.session_state['session_inputs'] = []
+if 'session_id' not in st.session_state:
+    st.session_state['session_id'] = uuid.uuid4().hex
+# ids of the jobs that haven't been shown yet
+if 'pending_jobs' not in st.session_state:
+    st.session_state['pending_jobs'] = []
+if 'latest_trial' not in st.session_state:
+    st.session_state['latest_trial'] = None
+
+# Saves a finished trial to the scenario store so it can be compared with
+# others, and makes it the one shown
+def add_scenario(trial):
+    st.session_state.button_click_count += 1
+    get_scenario_store().add(trial, label=f"Scenario {st.session_state.button_click_count}",
+                             owner=st.session_state['session_id'])
+    st.session_state['latest_trial'] = trial
+
+# Picks up the session's jobs that have finished since the last rerun
+def collect_finished_jobs():
+    pending_jobs = st.session_state['pending_jobs']
+    for job_id in list(pending_jobs):
+        job = get_job_queue().get(job_id)
+        if job is not None and not job.finished:
+            continue
+        pending_jobs.remove(job_id)
+        if job is None:
+            continue
+        if job.status == "done":
+            add_scenario(job.trial)
+        elif job.status == "failed":
+            st.error(f"The simulation failed: {job.error}")
+        else:
+            st.info("The simulation was cancelled")
+
+# Progress of the session's jobs, refreshed every second on its own (without
+# rerunning the whole script) until one finishes
+@st.fragment(run_every=1)
+def show_job_progress():
+    job_queue = get_job_queue()
+    any_finished = False
+    for job_id in list(st.session_state['pending_jobs']):
+        job = job_queue.get(job_id)
+        if job is None or job.finished:
+            any_finished = True
+            continue
+        if job.status == "queued":
+            text = f"Waiting for {job_queue.jobs_ahead(job)} other simulations to finish"
+        else:
+            text = f"Simulating the system: {job.runs_done} of {job.total_runs} runs done"
+        progress_col, cancel_col = st.columns([4, 1])
+        progress_col.progress(job.progress, text=text)
+        if cancel_col.button("Cancel", key=f"cancel_{job_id}"):
+            job.cancel()
+    if any_finished:
+        st.rerun()
 
 st.title("Non-Elective Flow Simulation")
 
@@ -32,14 +159,56 @@ with st.sidebar:
                                     min_value=0, max_value=50, value=4)
     num_runs_slider = st. slider("Adjust the number of runs the model does",
                                  min_value=10, max_value=100, value=10)
+    stop_early_checkbox = st.checkbox("Stop once the results are precise enough "
+                                      "(the number of runs is then the most it will do)")
+    if stop_early_checkbox:
+        precision_slider = st.slider("Target precision: 95% CI within this % of the mean",
+                                     min_value=1, max_value=20, value=10)
+        precision = precision_slider / 100
+    else:
+        precision = None
+    detect_warm_up_checkbox = st.checkbox("Work out the warm up period from pilot runs "
+                                          "(up to the default 60 days)")
+    crn_checkbox = st.checkbox("Use common random numbers (the same patients in "
+                               "every scenario, for comparing scenarios)", value=True)
+    profile_checkbox = st.checkbox("Profile the runs (show where the time goes)")
+    if profile_checkbox:
+        profile_memory_checkbox = st.checkbox("Measure peak memory too (slows the runs down)")
+        profile = "memory" if profile_memory_checkbox else True
+    else:
+        profile = False
 
-g.mean_time_in_bed = (mean_los_slider * 60)
-g.sd_time_in_bed = (sd_los_slider * 60)
-g.number_of_nelbeds = num_nelbeds_slider
-g.ed_inter_visit = 1440/daily_ed_adm_slider
-g.sdec_inter_visit = 1440/daily_sdec_adm_slider
-g.other_inter_visit = 1440/daily_other_adm_slider
-g.number_of_runs = num_runs_slider
+scenario = Scenario(mean_time_in_bed = (mean_los_slider * 60),
+                    sd_time_in_bed = (sd_los_slider * 60),
+                    number_of_nelbeds = num_nelbeds_slider,
+                    ed_inter_visit = 1440/daily_ed_adm_slider,
+                    sdec_inter_visit = 1440/daily_sdec_adm_slider,
+                    other_inter_visit = 1440/daily_other_adm_slider,
+                    number_of_runs = num_runs_slider,
+                    common_random_numbers = crn_checkbox)
+
+# An instant analytic estimate (analytic.py) of the scenario on the sliders,
+# updated as they move, so scenarios that clearly can't work needn't be run
+with st.sidebar:
+    st.subheader("Quick estimate (no simulation)")
+    quick = estimate(scenario)
+    load_col, wait_prob_col = st.columns(2)
+    load_col.metric("Bed utilisation", f"{quick['Utilisation (%)']:.0f}%")
+    wait_prob_col.metric("Chance of waiting", f"{quick['Probability of Waiting (%)']:.0f}%")
+    ed_wait_col, perf_col = st.columns(2)
+    ed_wait_col.metric("Mean ED wait", "No limit" if np.isinf(quick['Mean Q Time (Hrs)'])
+                       else f"{quick['Mean Q Time (Hrs)']:.1f} hrs")
+    perf_col.metric("4hr DTA", f"{quick['4hr DTA Performance (%)']:.0f}%")
+    if np.isinf(quick['Mean Q Time (Hrs)']):
+        st.error(f"Demand needs {quick['Offered Load (Beds)']:.0f} beds, far more than the "
+                 f"{scenario.number_of_nelbeds} available: the queue would grow without limit, "
+                 "so this scenario isn't worth running")
+    elif quick['Over Capacity']:
+        st.warning(f"Demand needs {quick['Offered Load (Beds)']:.0f} beds, more than the "
+                   f"{scenario.number_of_nelbeds} available: about "
+                   f"{quick['Excess Admissions per Day']:.1f} patients a day can only leave the "
+                   "queue by reneging")
+    st.caption("Approximate (a queueing model, see analytic.py); run the simulation for the full results")
 
 tab1, tab_animate, tab2 = st.tabs(["Run the model", "Animation", "Compare scenarios"])
 
@@ -49,114 +218,108 @@ with tab1:
     button_run_pressed = st.button("Run simulation")
 
     if button_run_pressed:
-        with st.spinner("Simulating the system"):
-            df_trial_results, all_results_patient_level, trial_summary = Trial().run_trial()
-            
-            # Adding to session state objects so we can compare scenarios
-            
-            # Comparing inputs
-            st.session_state.button_click_count += 1
-            col_name = f"Scenario {st.session_state.button_click_count}"
-            # make dataframe with inputs, set an index, select as a series
-            inputs_for_state = pd.DataFrame({
-            'Input': ['Mean LoS', 'Number of beds', 'Admissions via ED', 
-                'Admissions via SDEC', 'Admissions via Other', 'Number of runs'],
-            col_name: [mean_los_slider, num_nelbeds_slider, daily_ed_adm_slider, 
-                daily_sdec_adm_slider, daily_other_adm_slider, num_runs_slider]
-            }).set_index('Input')[col_name]
-            # Append input series to the session state
-            st.session_state['session_inputs'].append(inputs_for_state)
-            
-            # Comparing results
-            results_for_state = trial_summary['Mean']
-            results_for_state.name = col_name
-            st.session_state['session_results'].append(results_for_state)
-        
-            ################
-            st.write(f"You've run {st.session_state.button_click_count} scenarios")
-            st.write("These metrics are for a 60 day period and only include those patients actually admitted")
-
-            st.dataframe(trial_summary)
-            ###################
-
-            #Convert wait times into hours
-            all_results_patient_level['q_time_bed_hours'] = all_results_patient_level['Q Time Bed'] / 60.0
-            all_results_patient_level['under4hrflag'] = np.where(all_results_patient_level['q_time_bed_hours'] < 4, 1, 0)
-            all_results_patient_level['dta12hrflag'] = np.where(all_results_patient_level['q_time_bed_hours'] > 12, 1, 0)
-            all_results_patient_level['q_time_bed_or_renege'] = all_results_patient_level['Q Time Bed|Renege'] / 60.0
-            
-            #value = trial_summary.loc["Mean Q Time (Hrs)", "Mean"]
-            #label = f'Mean Q Time: {round(trial_summary.loc["Mean Q Time (Hrs)", "Mean"])} hrs'
-            
-            #Create the histogram
-            fig = plt.figure(figsize=(8, 6))
-            sns.histplot(
-            all_results_patient_level['q_time_bed_hours'], 
-            bins=range(int(all_results_patient_level['q_time_bed_hours'].min()), 
-                    int(all_results_patient_level['q_time_bed_hours'].max()) + 1, 1), 
-            kde=False)
-
-            # # Set the boundary for the bins to start at 0
-            plt.xlim(left=0)
-
-            # Add vertical lines with labels
-            lines = [
-                {"x": trial_summary.loc["Mean Q Time (Hrs)", "Mean"], "color": "tomato", "label": f'Mean Q Time: {round(trial_summary.loc["Mean Q Time (Hrs)", "Mean"])} hrs'},
-                {"x": 4, "color": "mediumturquoise", "label": f'4 Hr DTA Performance: {round(trial_summary.loc["4hr DTA Performance (%)", "Mean"])}%'},
-                {"x": 12, "color": "royalblue", "label": f'12 Hr DTAs per day: {round(trial_summary.loc["12hr DTAs", "Mean"])} hrs'},
-                {"x": trial_summary.loc["95th Percentile Q", "Mean"], "color": "goldenrod", "label": f'95th Percentile Q Time: {round(trial_summary.loc["95th Percentile Q", "Mean"])} hrs'},
-                {"x": trial_summary.loc["Max Q Time (Hrs)", "Mean"], "color": "slategrey", "label": f'Max Q Time: {round(trial_summary.loc["Max Q Time (Hrs)", "Mean"])} hrs'},
-            ]
-
-            for line in lines:
-                # Add the vertical line
-                plt.axvline(x=line["x"], color=line["color"], linestyle='--', linewidth=1, zorder=0)
-                
-                # Add label with text
-                plt.text(line["x"] + 2, plt.ylim()[1] * 0.95, line["label"], 
-                        color=line["color"], ha='left', va='top', fontsize=10, rotation=90,
-                        bbox=dict(facecolor='white', edgecolor='none', alpha=0.3, boxstyle='round,pad=0.5'))
-
-            # Add transparent rectangles for confidence intervals
-            ci_ranges = [
-                {"lower": trial_summary.loc["Mean Q Time (Hrs)", "Lower 95% CI"], 
-                "upper": trial_summary.loc["Mean Q Time (Hrs)", "Upper 95% CI"], "color": "tomato"},
-                {"lower": trial_summary.loc["95th Percentile Q", "Lower 95% CI"], 
-                "upper": trial_summary.loc["95th Percentile Q", "Upper 95% CI"], "color": "goldenrod"},
-                {"lower": trial_summary.loc["Max Q Time (Hrs)", "Lower 95% CI"], 
-                "upper": trial_summary.loc["Max Q Time (Hrs)", "Upper 95% CI"], "color": "slategrey"},
-            ]
-
-            for ci in ci_ranges:
-
-                plt.axvspan(
-                    ci["lower"],
-                    ci["upper"],
-                    color=ci["color"],
-                    alpha=0.2,
-                    zorder=0)
-
-            # Add labels and title if necessary
-            plt.xlabel('Admission Delays (Hours)')
-            plt.title('Histogram of Admission Delays (All Runs)')
-            fig.text(0.8, 0.01, 'Boxes show 95% CI.', ha='center', fontsize=10)
-
-            # Display the plot
-            st.pyplot(fig)
-            # ###################
+        # The trial runs in the background, so changing a widget while it
+        # runs doesn't lose it. Only the streaming summary of the patient
+        # level results is needed, so the rows themselves are not kept.
+        job = get_job_queue().submit(scenario, owner=st.session_state['session_id'],
+                                     engine="fast", keep_patient_level=False,
+                                     precision=precision,
+                                     detect_warm_up=detect_warm_up_checkbox,
+                                     profile=profile)
+        st.session_state['pending_jobs'].append(job.job_id)
+
+    collect_finished_jobs()
+    if st.session_state['pending_jobs']:
+        show_job_progress()
+
+    trial = st.session_state['latest_trial']
+    if trial is not None:
+        df_trial_results, _, trial_summary = trial.get_results()
+
+        ################
+        st.write(f"You've run {st.session_state.button_click_count} scenarios")
+        st.write("These metrics are for a 60 day period and only include those patients actually admitted")
+
+        st.dataframe(trial_summary)
+        if trial.warm_up_analysis is not None:
+            if trial.warm_up_analysis.warning() is not None:
+                st.warning(trial.warm_up_analysis.warning())
+            st.write(f"Warm up period used: {trial.scenario.warm_up_period / (24 * 60):g} days")
+            st.dataframe(trial.warm_up_analysis.to_dataframe())
+        if trial.precision is not None:
+            st.write(f"Stopped after {trial.n_runs} runs")
+            st.dataframe(trial.precision_df)
+        if trial.profiles:
+            # A cached trial shows the profile of the run that made it
+            run_profiles, trial_phases = trial.profiling_dataframe()
+            st.write("Where the time went, run by run")
+            st.dataframe(run_profiles.round(3))
+            st.dataframe(trial_phases.round(3))
+        ###################
+
+        #Wait times in hours, already counted into 1 hour bins run by run
+        counts, bin_edges = trial.patient_summary.histogram('Q Time Bed')
+        st.image(wait_time_chart(counts, bin_edges, trial_summary))
+
+        st.image(occupancy_chart(trial.monitor_bands(), trial.scenario.warm_up_period))
 
 with tab_animate:
-    st.write("Animation of the latest scenario goes here")
+    trial = st.session_state['latest_trial']
+    if trial is None:
+        st.write("Run a scenario to animate it")
+    else:
+        frame_hours = st.select_slider("Hours between frames", [1, 2, 4, 6, 12, 24], value=4)
+        frames = load_playback(trial.scenario, frame_hours * 60)
+        st.write("The first run of the latest scenario, through its 60 day results period")
+        st.plotly_chart(playback_chart(frames, trial.scenario.number_of_nelbeds,
+                                       trial.scenario.warm_up_period))
+
+        # Events in the hours up to each frame
+        events = frames[EVENTS].set_axis((frames.index - trial.scenario.warm_up_period) / 1440)
+        events.index.name = "Day"
+        st.line_chart(events)
         
 with tab2:
     st.write(f"You've run {st.session_state.button_click_count} scenarios")
 
-    # Convert series back to df, transpose, display
-    if st.session_state.button_click_count > 0:
-        st.write("Here are your inputs for each scenario")
-        current_i_df = pd.DataFrame(st.session_state['session_inputs']).T
-        st.dataframe(current_i_df)
-        
-        st.write("Here are your results for each scenario")
-        current_state_df = pd.DataFrame(st.session_state['session_results']).T
-        st.dataframe(current_state_df)
\ No newline at end of file
+    # Every scenario run is saved, so earlier sessions' scenarios can be
+    # found again; they are looked up a page at a time
+    show_all = st.radio("Show", ["This session's scenarios", "All saved scenarios"],
+                        horizontal=True) == "All saved scenarios"
+    owner = None if show_all else st.session_state['session_id']
+    with st.expander("Filter"):
+        beds_filter = st.slider("Number of beds", min_value=300, max_value=500,
+                                value=(300, 500))
+        los_filter = st.slider("Mean los in hours", min_value=100, max_value=300,
+                               value=(100, 300))
+    store = get_scenario_store()
+    n_scenarios = store.count(owner=owner, number_of_nelbeds=beds_filter,
+                              mean_time_in_bed=(los_filter[0] * 60, los_filter[1] * 60))
+    page_size = 20
+    n_pages = max(1, -(-n_scenarios // page_size))
+    page = st.number_input(f"Page (of {n_pages}, newest first)", min_value=1,
+                           max_value=n_pages, value=1) - 1
+    scenarios = load_scenario_page(owner, beds_filter, los_filter, page, page_size,
+                                   store.latest_id())
+
+    if len(scenarios) > 0:
+        st.write(f"Here are the inputs and mean results of {n_scenarios} scenarios")
+        st.dataframe(scenarios.set_index('Scenario'))
+
+    # Differences from a baseline scenario, run by run
+    if len(scenarios) > 1:
+        scenario_names = dict(zip(scenarios['Scenario'], scenarios.index))
+        baseline_name = st.selectbox("Compare against", list(scenario_names),
+                                     index=len(scenario_names) - 1)
+        compare_names = st.multiselect(
+            "Scenarios to compare", [name for name in scenario_names if name != baseline_name],
+            default=[name for name in scenario_names if name != baseline_name][:5])
+        baseline = load_run_results(scenario_names[baseline_name])
+        st.write("Differences from the baseline. Run n of every scenario uses the same "
+                 "random numbers, so the runs are compared in pairs; with common random "
+                 "numbers the CIs are narrower and fewer runs are needed to tell "
+                 "scenarios apart.")
+        for name in compare_names:
+            differences = paired_differences(load_run_results(scenario_names[name]), baseline)
+            st.write(f"{name} minus {baseline_name} ({differences.attrs['runs']} paired runs)")
+            st.dataframe(differences.round(2))
@@ -0,0 +1,136 @@
+import io
+
+import matplotlib.pyplot as plt
+import plotly.graph_objects as go
+import seaborn as sns
+
+try:
+    from .recorder import DEPARTMENTS
+except ImportError: # imported from inside the app folder
+    from recorder import DEPARTMENTS
+
+# Charts of a trial's results, drawn only from what the trial has already
+# binned or summarised (the patient summary's fixed bin counts, the trial
+# summary and the monitor's percentile bands), never from patient level rows,
+# so drawing one costs the same however many patients were simulated.
+
+# Histogram of the wait for a bed (hours) from the counts in 1 hour bins
+# (PatientSummary.histogram), with the key metrics from the trial summary
+# marked on it
+def wait_time_histogram(counts, bin_edges, trial_summary):
+    fig, ax = plt.subplots(figsize=(8, 6))
+    sns.histplot(x=bin_edges[:-1], weights=counts, bins=bin_edges.tolist(),
+                 kde=False, ax=ax)
+
+    # # Set the boundary for the bins to start at 0
+    ax.set_xlim(left=0)
+
+    # Add vertical lines with labels
+    lines = [
+        {"x": trial_summary.loc["Mean Q Time (Hrs)", "Mean"], "color": "tomato", "label": f'Mean Q Time: {round(trial_summary.loc["Mean Q Time (Hrs)", "Mean"])} hrs'},
+        {"x": 4, "color": "mediumturquoise", "label": f'4 Hr DTA Performance: {round(trial_summary.loc["4hr DTA Performance (%)", "Mean"])}%'},
+        {"x": 12, "color": "royalblue", "label": f'12 Hr DTAs per day: {round(trial_summary.loc["12hr DTAs", "Mean"])} hrs'},
+        {"x": trial_summary.loc["95th Percentile Q", "Mean"], "color": "goldenrod", "label": f'95th Percentile Q Time: {round(trial_summary.loc["95th Percentile Q", "Mean"])} hrs'},
+        {"x": trial_summary.loc["Max Q Time (Hrs)", "Mean"], "color": "slategrey", "label": f'Max Q Time: {round(trial_summary.loc["Max Q Time (Hrs)", "Mean"])} hrs'},
+    ]
+
+    for line in lines:
+        # Add the vertical line
+        ax.axvline(x=line["x"], color=line["color"], linestyle='--', linewidth=1, zorder=0)
+
+        # Add label with text
+        ax.text(line["x"] + 2, ax.get_ylim()[1] * 0.95, line["label"],
+                color=line["color"], ha='left', va='top', fontsize=10, rotation=90,
+                bbox=dict(facecolor='white', edgecolor='none', alpha=0.3, boxstyle='round,pad=0.5'))
+
+    # Add transparent rectangles for confidence intervals
+    ci_ranges = [
+        {"lower": trial_summary.loc["Mean Q Time (Hrs)", "Lower 95% CI"],
+        "upper": trial_summary.loc["Mean Q Time (Hrs)", "Upper 95% CI"], "color": "tomato"},
+        {"lower": trial_summary.loc["95th Percentile Q", "Lower 95% CI"],
+        "upper": trial_summary.loc["95th Percentile Q", "Upper 95% CI"], "color": "goldenrod"},
+        {"lower": trial_summary.loc["Max Q Time (Hrs)", "Lower 95% CI"],
+        "upper": trial_summary.loc["Max Q Time (Hrs)", "Upper 95% CI"], "color": "slategrey"},
+    ]
+
+    for ci in ci_ranges:
+        ax.axvspan(ci["lower"], ci["upper"], color=ci["color"], alpha=0.2, zorder=0)
+
+    # Add labels and title if necessary
+    ax.set_xlabel('Admission Delays (Hours)')
+    ax.set_ylabel('Patients')
+    ax.set_title('Histogram of Admission Delays (All Runs)')
+    fig.text(0.8, 0.01, 'Boxes show 95% CI.', ha='center', fontsize=10)
+    return fig
+
+# Beds in use and queue length through the runs from Trial.monitor_bands:
+# the median run and the 5th to 95th percentile band across runs
+def occupancy_bands_chart(bands, warm_up_period):
+    days = bands.index / (24 * 60)
+    fig, ax = plt.subplots(figsize=(8, 4))
+    for series, color, label in [("beds_in_use", "royalblue", "Beds in use"),
+                                 ("queue_length", "tomato", "Queue for a bed")]:
+        ax.fill_between(days, bands[(series, "p5")], bands[(series, "p95")],
+                        color=color, alpha=0.2, linewidth=0)
+        ax.plot(days, bands[(series, "p50")], color=color, linewidth=1, label=label)
+    ax.axvline(x=warm_up_period / (24 * 60), color="slategrey",
+               linestyle="--", linewidth=1, label="End of warm up")
+    ax.set_xlabel("Day")
+    ax.set_ylabel("Patients")
+    ax.set_title("Bed Occupancy and Queue (median and 5th-95th percentile of runs)")
+    ax.legend(loc="upper left")
+    return fig
+
+# Animated bar chart playing a run back from event_log.playback_frames: the
+# patients waiting for a bed and in a bed, by department, frame by frame
+# (days counted from start). Only the frames go to the browser, so it plays
+# smoothly however many events the run had. The frames are built directly
+# (one bar trace per department) as plotly express is slow with hundreds.
+def playback_animation(frames, capacity, start=0, frame_duration=60):
+    minutes = frames.index.to_numpy() - start
+    labels = [f"Day {int(m // 1440) + 1} {int(m % 1440 // 60):02d}:{int(m % 60):02d}"
+              for m in minutes]
+    states = ["Waiting for a bed", "In a bed"]
+    # patients in each state for each department, frame by frame
+    counts = {department: frames[[f"waiting {department}", f"in_bed {department}"]].to_numpy()
+              for department in DEPARTMENTS}
+
+    def bars(i):
+        return [go.Bar(x=states, y=counts[department][i].tolist(), name=department)
+                for department in DEPARTMENTS]
+
+    most = max(capacity, sum(counts.values()).max())
+    fig = go.Figure(
+        data=bars(0),
+        frames=[go.Frame(data=bars(i), name=label) for i, label in enumerate(labels)])
+    play = {"frame": {"duration": frame_duration, "redraw": False},
+            "transition": {"duration": 0}, "fromcurrent": True}
+    fig.update_layout(
+        barmode="stack", title="Patients waiting for and in a bed",
+        yaxis={"range": [0, most * 1.05], "title": "Patients"},
+        legend_title_text="Department",
+        updatemenus=[{"type": "buttons", "direction": "left", "x": 0.1, "y": 0,
+                      "xanchor": "right", "yanchor": "top", "pad": {"r": 10, "t": 70},
+                      "buttons": [
+                          {"label": "&#9654;", "method": "animate", "args": [None, play]},
+                          {"label": "&#9724;", "method": "animate",
+                           "args": [[None], {"frame": {"duration": 0, "redraw": False},
+                                             "mode": "immediate"}]}]}],
+        sliders=[{"x": 0.1, "y": 0, "len": 0.9, "xanchor": "left", "yanchor": "top",
+                  "pad": {"b": 10, "t": 50}, "currentvalue": {"prefix": "Time: "},
+                  "steps": [{"label": label, "method": "animate",
+                             "args": [[label], {"frame": {"duration": 0, "redraw": False},
+                                               "mode": "immediate"}]}
+                            for label in labels]}])
+    fig.add_hline(y=capacity, line_dash="dash", line_color="slategrey",
+                  annotation_text=f"{capacity} beds")
+    return fig
+
+# The figure as PNG bytes (as st.pyplot draws it), so the drawn chart can be
+# cached rather than the figure. The figure is closed, as pyplot keeps every
+# open figure alive.
+def figure_png(fig, dpi=200):
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format="png", dpi=dpi, bbox_inches="tight")
+    plt.close(fig)
+    return buffer.getvalue()
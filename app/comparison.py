@@ -0,0 +1,45 @@
+import numpy as np
+import pandas as pd
+
+try:
+    from .des_classes1 import SUMMARY_METRICS, metric_values
+except ImportError: # imported from inside the app folder
+    from des_classes1 import SUMMARY_METRICS, metric_values
+
+# Difference between two scenarios for every summary metric (scenario minus
+# baseline), from their df_trial_results. Runs with the same run number used
+# the same seeds, so they are compared as pairs: the CI is for the mean of the
+# run by run differences, which is much narrower than comparing the two
+# scenarios' own CIs when they share their random numbers (most of all with
+# common_random_numbers set on both). Only run numbers in both trials are
+# used (e.g. sequential trials can stop after different numbers of runs).
+def paired_differences(results, baseline_results, confidence=0.95,
+                       metrics=SUMMARY_METRICS):
+    # scipy.stats is slow to import so only load it when it is needed
+    import scipy.stats as stats
+
+    runs = results.index.intersection(baseline_results.index)
+    n_runs = len(runs)
+    all_differences = (
+        metric_values(results.loc[runs], metrics).astype(float)
+        - metric_values(baseline_results.loc[runs], metrics).astype(float))
+    rows = []
+    for metric in metrics:
+        differences = all_differences[metric]
+        mean = differences.mean()
+        se = differences.std() / np.sqrt(n_runs)
+        if n_runs > 1 and se > 0:
+            lower, upper = stats.t.interval(confidence, n_runs - 1,
+                                            loc=mean, scale=se)
+        else:
+            lower = upper = mean
+        rows.append({"Metric": metric,
+                     "Mean Difference": mean,
+                     "St. error": se,
+                     f"Lower {confidence:.0%} CI": lower,
+                     f"Upper {confidence:.0%} CI": upper,
+                     # the CI doesn't include 0
+                     "Different": bool(lower > 0 or upper < 0)})
+    summary = pd.DataFrame(rows).set_index("Metric")
+    summary.attrs["runs"] = n_runs
+    return summary
@@ -1,11 +1,38 @@
 
 import simpy
+from simpy.core import BoundClass
+from simpy.resources.resource import PriorityRequest
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
+import os
 import time
+from contextlib import nullcontext
+from dataclasses import dataclass, fields, replace
+from concurrent.futures import ProcessPoolExecutor
 from sim_tools.distributions import (Exponential, Lognormal, Uniform)
-import scipy.stats as stats
+
+try:
+    from .aggregation import PatientSummary
+    from .event_log import EVENT_CODES, EventLog
+    from .monitor import (BedMonitor, DEFAULT_MONITOR_INTERVAL,
+                          DEFAULT_PERCENTILES, percentile_bands)
+    from .profiling import RunProfile, profile_phase, profiles_to_dataframe
+    from .recorder import DEPARTMENTS, PatientRecorder
+    from .sampling import BatchSampler
+    from .seeds import SeedManager, new_master_seed
+except ImportError: # imported from inside the app folder
+    from aggregation import PatientSummary
+    from event_log import EVENT_CODES, EventLog
+    from monitor import (BedMonitor, DEFAULT_MONITOR_INTERVAL,
+                         DEFAULT_PERCENTILES, percentile_bands)
+    from profiling import RunProfile, profile_phase, profiles_to_dataframe
+    from recorder import DEPARTMENTS, PatientRecorder
+    from sampling import BatchSampler
+    from seeds import SeedManager, new_master_seed
+
+# Bump this whenever a change to the model alters its results, so cached
+# results from older versions are not reused
+MODEL_VERSION = 5
 
 class g: # global
     ed_inter_visit = 37.7 # see observed_edintervist notebook
@@ -17,6 +44,47 @@ class g: # global
     sim_duration = 86400 #run for 60 days
     warm_up_period = 86400 # warm up for 60 days - need to test if  this is long enough
     number_of_runs = 10
+    master_seed = 42 # seeds every run, set to None for a new seed each trial
+    common_random_numbers = False # draw each patient's LoS as they arrive (see Model)
+
+# The parameters for a single scenario. Instances are frozen (and so hashable)
+# and are passed explicitly to Trial and Model, so several scenarios can be run
+# at once in one process and they can be sent safely to worker processes.
+# Any value not given is taken from g.
+@dataclass(frozen=True)
+class Scenario:
+    ed_inter_visit: float = None
+    sdec_inter_visit: float = None
+    other_inter_visit: float = None
+    number_of_nelbeds: int = None
+    mean_time_in_bed: float = None
+    sd_time_in_bed: float = None
+    sim_duration: float = None
+    warm_up_period: float = None
+    number_of_runs: int = None
+    master_seed: int = None
+    common_random_numbers: bool = None
+
+    def __post_init__(self):
+        for field in fields(self):
+            if getattr(self, field.name) is None:
+                object.__setattr__(self, field.name, getattr(g, field.name))
+        # If g doesn't fix the seed, draw one now so it is recorded with the
+        # scenario and the trial can be replayed
+        if self.master_seed is None:
+            object.__setattr__(self, "master_seed", new_master_seed())
+
+    # Scenario using the values currently set on g
+    @classmethod
+    def from_g(cls):
+        return cls()
+
+    # Copy of this scenario with some values changed
+    def replace(self, **changes):
+        return replace(self, **changes)
+
+    def to_dict(self):
+        return {field.name: getattr(self, field.name) for field in fields(self)}
 
 class Patient:
     def __init__(self, p_id):
@@ -29,11 +97,55 @@ class Patient:
         self.priority = 0
         self.priority_update = 0
         self.sdec_other_priority = 0.8
+        self.time_in_bed = None
+
+# A bed request that knows the department (index into DEPARTMENTS) of the
+# patient making it
+class DepartmentRequest(PriorityRequest):
+    def __init__(self, resource, department, priority=0, preempt=True):
+        self.department = department
+        # counted as queuing until it is granted, which may be straight away
+        resource.queue_by_department[department] += 1
+        super().__init__(resource, priority, preempt)
+
+    def cancel(self):
+        if not self.triggered:
+            self.resource.queue_by_department[self.department] -= 1
+        super().cancel()
+
+# PriorityResource that keeps count of the beds in use and the requests
+# queuing for a bed by department as requests are granted, released and
+# cancelled, so the monitor doesn't have to look through every request.
+# Requests are made with request(department, priority).
+class DepartmentResource(simpy.PriorityResource):
+    request = BoundClass(DepartmentRequest)
+
+    def __init__(self, env, capacity=1):
+        super().__init__(env, capacity)
+        self.users_by_department = [0] * len(DEPARTMENTS)
+        self.queue_by_department = [0] * len(DEPARTMENTS)
+
+    def _do_put(self, event):
+        n_users = len(self.users)
+        super()._do_put(event)
+        if len(self.users) > n_users:
+            self.users_by_department[event.department] += 1
+            self.queue_by_department[event.department] -= 1
+
+    def _do_get(self, event):
+        n_users = len(self.users)
+        super()._do_get(event)
+        if len(self.users) < n_users:
+            self.users_by_department[event.request.department] -= 1
 
 class Model:
     # Constructor to set up the model for a run.  We pass in a run number when
-    # we create a new model.
-    def __init__(self, run_number):
+    # we create a new model, the scenario to run (defaults to the values in
+    # g) and how often (in minutes) to sample the beds in use and the queue.
+    def __init__(self, run_number, scenario=None,
+                 monitor_interval=DEFAULT_MONITOR_INTERVAL):
+        self.scenario = scenario if scenario is not None else Scenario.from_g()
+
         # Create a SimPy environment in which everything will live
         self.env = simpy.Environment()
 
@@ -41,30 +153,28 @@ class Model:
         self.patient_counter = 0
 
         # Create our resources
-        self.nelbed = simpy.PriorityResource(
-            self.env, capacity=g.number_of_nelbeds)
+        self.nelbed = DepartmentResource(
+            self.env, capacity=self.scenario.number_of_nelbeds)
 
         # Store the passed in run number
         self.run_number = run_number
 
-        # Create a new DataFrame that will store results against patientID
-        self.results_df = pd.DataFrame()
-        self.results_df["Patient ID"] = [1]
-        self.results_df["Department"] = [""]
-        self.results_df["InitialPriority"] = [0.0]
-        self.results_df["UpdatedPriority"] = [0.0]
-        self.results_df["Q Time Bed"] = [0.0]
-        self.results_df["Q Time Bed|Renege"] = [0.0]
-        self.results_df["dta"] = [0]
-        self.results_df["checkout"] = [0]
-        self.results_df["Q Time Bed SDEC"] = [0.0]
-        self.results_df["sdec_dta"] = [0]
-        self.results_df["sdec_checkout"] = [0]
-        self.results_df["Q Time Bed Other"] = [0.0]
-        self.results_df["other_dta"] = [0]
-        self.results_df["other_checkout"] = [0]
-        self.results_df["reneged"] = [0]
-        self.results_df.set_index("Patient ID", inplace=True)
+        # Create a recorder that will store results against patientID. The
+        # patient level DataFrame is built from it at the end of the run.
+        self.recorder = PatientRecorder()
+        self.results_df = None
+
+        # Samples of beds in use and queue length through the whole run
+        self.monitor = BedMonitor(
+            self.scenario.sim_duration + self.scenario.warm_up_period,
+            monitor_interval)
+
+        # Where the time goes in the run, only if enable_profiling is called
+        self.profile = None
+
+        # Every patient's arrival, queue, escalation, renege, admission and
+        # discharge, only if enable_event_log is called
+        self.event_log = None
 
         # Create an attribute to store the mean queuing times
         self.ed_admissions = 0
@@ -75,14 +185,25 @@ class Model:
         self.mean_q_time_other = 0
         self.reneged = 0
 
-        # Initialise distributions for generators
-        self.ed_inter_visit_dist = Exponential(mean = g.ed_inter_visit, random_seed = self.run_number*2)
-        self.sdec_inter_visit_dist = Exponential(mean = g.sdec_inter_visit, random_seed = self.run_number*3)
-        self.other_inter_visit_dist = Exponential(mean = g.other_inter_visit, random_seed = self.run_number*4)
-        self.mean_time_in_bed_dist = Lognormal(g.mean_time_in_bed, g.sd_time_in_bed, random_seed = self.run_number*5)
-        self.renege_time = Uniform(0, 9000, random_seed = self.run_number*6)
-        self.priority_update = Uniform(0, 9000, random_seed = self.run_number*7)
-        self.priority = Uniform(1,2, random_seed = self.run_number*8)
+        # Every distribution gets its own independent seed, spawned from the
+        # scenario's master seed for this run
+        self.seeds = SeedManager(self.scenario.master_seed).run_seeds(self.run_number)
+
+        # Initialise distributions for generators. Each one is wrapped in a
+        # BatchSampler so values are drawn from NumPy in blocks.
+        self.ed_inter_visit_dist = BatchSampler(Exponential(mean = self.scenario.ed_inter_visit, random_seed = self.seeds["ed_inter_visit"]))
+        self.sdec_inter_visit_dist = BatchSampler(Exponential(mean = self.scenario.sdec_inter_visit, random_seed = self.seeds["sdec_inter_visit"]))
+        self.other_inter_visit_dist = BatchSampler(Exponential(mean = self.scenario.other_inter_visit, random_seed = self.seeds["other_inter_visit"]))
+        self.mean_time_in_bed_dist = BatchSampler(Lognormal(self.scenario.mean_time_in_bed, self.scenario.sd_time_in_bed, random_seed = self.seeds["time_in_bed"]))
+        self.renege_time = BatchSampler(Uniform(0, 9000, random_seed = self.seeds["renege_time"]))
+        self.priority_update = BatchSampler(Uniform(0, 9000, random_seed = self.seeds["priority_update"]))
+        # Priorities are rounded to 1 or 2 a block at a time
+        self.priority = BatchSampler(Uniform(1,2, random_seed = self.seeds["priority"]),
+                                     transform=np.rint)
+        # With common random numbers SDEC and Other patients draw their LoS
+        # from their own streams (ED patients use mean_time_in_bed_dist)
+        self.sdec_time_in_bed_dist = BatchSampler(Lognormal(self.scenario.mean_time_in_bed, self.scenario.sd_time_in_bed, random_seed = self.seeds["sdec_time_in_bed"]))
+        self.other_time_in_bed_dist = BatchSampler(Lognormal(self.scenario.mean_time_in_bed, self.scenario.sd_time_in_bed, random_seed = self.seeds["other_time_in_bed"]))
     
     # A generator function for ed patient arrivals
     def generator_patient_arrivals(self):
@@ -97,8 +218,10 @@ class Model:
             p = Patient(self.patient_counter)
             p.department = "ED"
             p.renege_time = self.renege_time.sample()
-            p.priority = round(self.priority.sample())
+            p.priority = self.priority.sample()
             p.priority_update = self.priority_update.sample()
+            if self.scenario.common_random_numbers:
+                p.time_in_bed = self.mean_time_in_bed_dist.sample()
 
             # Tell SimPy to start up the attend_hospital function with
             # this patient
@@ -116,6 +239,8 @@ class Model:
             
             p = Patient(self.patient_counter)
             p.department = "SDEC"
+            if self.scenario.common_random_numbers:
+                p.time_in_bed = self.sdec_time_in_bed_dist.sample()
 
             self.env.process(self.attend_sdec(p))
 
@@ -129,6 +254,8 @@ class Model:
             
             p = Patient(self.patient_counter)
             p.department = "Other"
+            if self.scenario.common_random_numbers:
+                p.time_in_bed = self.other_time_in_bed_dist.sample()
 
             self.env.process(self.attend_other(p))
 
@@ -141,21 +268,20 @@ class Model:
         # Record the time the patient started queuing for a bed and their initial priority
         # If we are through the warm up period
         start_q_bed = self.env.now
-        patient.start_q_bed = start_q_bed - g.warm_up_period
-
-        if start_q_bed > g.warm_up_period:
-            self.results_df.at[patient.id, "dta"] = (
-                            patient.start_q_bed
-                        )
-            self.results_df.at[patient.id, "InitialPriority"] = (
-                            patient.priority
-                        )
-            self.results_df.at[patient.id, "Department"] = (
-                            patient.department
-                        )
+        patient.start_q_bed = start_q_bed - self.scenario.warm_up_period
+
+        if start_q_bed > self.scenario.warm_up_period:
+            self.recorder.record(patient.id, "dta", patient.start_q_bed)
+            self.recorder.record(patient.id, "InitialPriority", patient.priority)
+            self.recorder.record_department(patient.id, patient.department)
+
+        if self.event_log is not None:
+            self.log_event(patient, "arrival")
             
         # Request a bed
-        with self.nelbed.request(priority=patient.priority) as req:
+        with self.request_bed(patient, patient.priority) as req:
+            if self.event_log is not None and not req.triggered:
+                self.log_event(patient, "queue")
             # Freeze the function until one of 3 things happens....
             result_of_queue = (yield req | # they get a bed
                                self.env.timeout(patient.renege_time) | # they improve
@@ -164,137 +290,192 @@ class Model:
             # if the result is they get a bed, record the relevant details
             if req in result_of_queue:
                 end_q_bed = self.env.now
-                patient.end_q_bed = end_q_bed - g.warm_up_period
+                patient.end_q_bed = end_q_bed - self.scenario.warm_up_period
 
                 # Calculate the time this patient was queuing for the bed
                 patient.q_time_bed = end_q_bed - start_q_bed
 
                 # Only if we are through the warm up period, store the details
                 # next to the appropriate patientid (.at accesses a particular cell)
-                if start_q_bed > g.warm_up_period:
-                    self.results_df.at[patient.id, "Q Time Bed"] = (
-                        patient.q_time_bed
-                    )
-                    self.results_df.at[patient.id, "Q Time Bed|Renege"] = (
-                        patient.q_time_bed
-                    )
-                    self.results_df.at[patient.id, "checkout"] = (
-                        patient.end_q_bed
-                    )
-                    self.results_df.at[patient.id, "reneged"] = 0
+                if start_q_bed > self.scenario.warm_up_period:
+                    self.recorder.record(patient.id, "Q Time Bed", patient.q_time_bed)
+                    self.recorder.record(patient.id, "Q Time Bed|Renege", patient.q_time_bed)
+                    self.recorder.record(patient.id, "checkout", patient.end_q_bed)
+                    self.recorder.record(patient.id, "reneged", 0)
+
+                if self.event_log is not None:
+                    self.log_event(patient, "admit")
                 
-                sampled_bed_time = self.mean_time_in_bed_dist.sample()
+                sampled_bed_time = self.sample_time_in_bed(patient)
                 
                 # Freeze this function in place for the activity time we sampled
                 # above.  This is the patient spending time in the bed.
                 yield self.env.timeout(sampled_bed_time)
+
+                if self.event_log is not None:
+                    self.log_event(patient, "discharge")
             # If the result of the queue was deterioration    
             elif patient.priority_update < patient.renege_time:
                 # Update their priority
                 patient.priority = patient.priority - 2.2
+                if self.event_log is not None:
+                    self.log_event(patient, "escalate")
                 # Make another bed request with new priority
-                with self.nelbed.request(priority=patient.priority) as req:
+                with self.request_bed(patient, patient.priority) as req:
                     yield req
                     end_q_bed = self.env.now
-                    patient.end_q_bed = end_q_bed - g.warm_up_period
+                    patient.end_q_bed = end_q_bed - self.scenario.warm_up_period
                     patient.q_time_bed = end_q_bed - start_q_bed
 
-                    if start_q_bed > g.warm_up_period:
-                        self.results_df.at[patient.id, "Q Time Bed"] = (
-                            patient.q_time_bed
-                        )
-                        self.results_df.at[patient.id, "checkout"] = (
-                            patient.end_q_bed
-                        )
-                        self.results_df.at[patient.id, "reneged"] = 0
-                        self.results_df.at[patient.id, "UpdatedPriority"] = (
-                            patient.priority
-                        )
+                    if start_q_bed > self.scenario.warm_up_period:
+                        self.recorder.record(patient.id, "Q Time Bed", patient.q_time_bed)
+                        self.recorder.record(patient.id, "checkout", patient.end_q_bed)
+                        self.recorder.record(patient.id, "reneged", 0)
+                        self.recorder.record(patient.id, "UpdatedPriority", patient.priority)
+
+                    if self.event_log is not None:
+                        self.log_event(patient, "admit")
                 
-                    sampled_bed_time = self.mean_time_in_bed_dist.sample()
+                    sampled_bed_time = self.sample_time_in_bed(patient)
                 
                     yield self.env.timeout(sampled_bed_time)
+
+                    if self.event_log is not None:
+                        self.log_event(patient, "discharge")
             # If patient improves enough to leave the queue
             else:
                 end_q_bed = self.env.now
-                patient.end_q_bed = end_q_bed - g.warm_up_period
+                patient.end_q_bed = end_q_bed - self.scenario.warm_up_period
                 patient.q_time_bed = end_q_bed - start_q_bed
 
-                if start_q_bed > g.warm_up_period:
-                    self.results_df.at[patient.id, "reneged"] = 1
-                    self.results_df.at[patient.id, "Q Time Bed|Renege"] = (
-                        patient.q_time_bed
-                    )
-                    self.results_df.at[patient.id, "checkout"] = (
-                            patient.end_q_bed
-                    )
+                if self.event_log is not None:
+                    self.log_event(patient, "renege")
+
+                if start_q_bed > self.scenario.warm_up_period:
+                    self.recorder.record(patient.id, "reneged", 1)
+                    self.recorder.record(patient.id, "Q Time Bed|Renege", patient.q_time_bed)
+                    self.recorder.record(patient.id, "checkout", patient.end_q_bed)
     
     def attend_sdec(self, patient):
 
         start_q_bed = self.env.now
-        patient.start_q_bed = start_q_bed - g.warm_up_period
+        patient.start_q_bed = start_q_bed - self.scenario.warm_up_period
 
-        with self.nelbed.request(priority=patient.sdec_other_priority) as req:
+        if self.event_log is not None:
+            self.log_event(patient, "arrival")
+
+        with self.request_bed(patient, patient.sdec_other_priority) as req:
+            if self.event_log is not None and not req.triggered:
+                self.log_event(patient, "queue")
             yield req
 
             end_q_bed = self.env.now
-            patient.end_q_bed = end_q_bed - g.warm_up_period
+            patient.end_q_bed = end_q_bed - self.scenario.warm_up_period
 
             patient.q_time_bed = end_q_bed - start_q_bed
 
-            if start_q_bed > g.warm_up_period:
-                self.results_df.at[patient.id, "Q Time Bed SDEC"] = (
-                    patient.q_time_bed
-                )
-                self.results_df.at[patient.id, "sdec_dta"] = (
-                    patient.start_q_bed
-                )
-                self.results_df.at[patient.id, "sdec_checkout"] = (
-                    patient.end_q_bed
-                )
-                self.results_df.at[patient.id, "Department"] = (
-                            patient.department
-                        )
+            if self.event_log is not None:
+                self.log_event(patient, "admit")
+
+            if start_q_bed > self.scenario.warm_up_period:
+                self.recorder.record(patient.id, "Q Time Bed SDEC", patient.q_time_bed)
+                self.recorder.record(patient.id, "sdec_dta", patient.start_q_bed)
+                self.recorder.record(patient.id, "sdec_checkout", patient.end_q_bed)
+                self.recorder.record_department(patient.id, patient.department)
             
-            sampled_bed_time = self.mean_time_in_bed_dist.sample()
+            sampled_bed_time = self.sample_time_in_bed(patient)
             
             yield self.env.timeout(sampled_bed_time)
 
+            if self.event_log is not None:
+                self.log_event(patient, "discharge")
+
     def attend_other(self, patient):
 
         start_q_bed = self.env.now
-        patient.start_q_bed = start_q_bed - g.warm_up_period
+        patient.start_q_bed = start_q_bed - self.scenario.warm_up_period
 
-        with self.nelbed.request(priority=patient.sdec_other_priority) as req:
+        if self.event_log is not None:
+            self.log_event(patient, "arrival")
+
+        with self.request_bed(patient, patient.sdec_other_priority) as req:
+            if self.event_log is not None and not req.triggered:
+                self.log_event(patient, "queue")
             yield req
 
             end_q_bed = self.env.now
-            patient.end_q_bed = end_q_bed - g.warm_up_period
+            patient.end_q_bed = end_q_bed - self.scenario.warm_up_period
 
             patient.q_time_bed = end_q_bed - start_q_bed
 
-            if start_q_bed > g.warm_up_period:
-                self.results_df.at[patient.id, "Q Time Bed Other"] = (
-                    patient.q_time_bed
-                )
-                self.results_df.at[patient.id, "other_dta"] = (
-                    patient.start_q_bed
-                )
-                self.results_df.at[patient.id, "other_checkout"] = (
-                    patient.end_q_bed
-                )
-                self.results_df.at[patient.id, "Department"] = (
-                            patient.department
-                        )
+            if self.event_log is not None:
+                self.log_event(patient, "admit")
+
+            if start_q_bed > self.scenario.warm_up_period:
+                self.recorder.record(patient.id, "Q Time Bed Other", patient.q_time_bed)
+                self.recorder.record(patient.id, "other_dta", patient.start_q_bed)
+                self.recorder.record(patient.id, "other_checkout", patient.end_q_bed)
+                self.recorder.record_department(patient.id, patient.department)
             
-            sampled_bed_time = self.mean_time_in_bed_dist.sample()
+            sampled_bed_time = self.sample_time_in_bed(patient)
             
             yield self.env.timeout(sampled_bed_time)
 
+            if self.event_log is not None:
+                self.log_event(patient, "discharge")
+
+    # Length of stay for a patient who has just got a bed. Normally the
+    # next value of the LoS stream, in the order patients get beds. With
+    # common random numbers it was drawn when they arrived, from their
+    # department's stream, so the nth ED (SDEC, Other) patient of a run has
+    # the same LoS (relative to the mean) in every scenario, however the
+    # order they get beds in changes.
+    def sample_time_in_bed(self, patient):
+        if patient.time_in_bed is not None:
+            return patient.time_in_bed
+        return self.mean_time_in_bed_dist.sample()
+
+    # Times the phases of the run into profile (a profiling.RunProfile), and
+    # the random number draws and recorder writes within it, and counts the
+    # events processed
+    def enable_profiling(self, profile):
+        self.profile = profile
+        for sampler in vars(self).values():
+            if isinstance(sampler, BatchSampler):
+                sampler.dist.sample = profile.timed("Sampling",
+                                                    sampler.dist.sample)
+        self.recorder.record = profile.timed("Recorder", self.recorder.record)
+        self.recorder.record_department = profile.timed(
+            "Recorder", self.recorder.record_department)
+        self.env.step = profile.counted(self.env.step)
+
+    # Records every patient's events in a compact event_log.EventLog (see
+    # event_log.playback_frames to play the run back). Logging costs nothing
+    # unless this is called.
+    def enable_event_log(self):
+        self.event_log = EventLog()
+        return self.event_log
+
+    def log_event(self, patient, event):
+        self.event_log.record(self.env.now, patient.id, EVENT_CODES[event],
+                              DEPARTMENTS.index(patient.department))
+
+    # Requests a bed for the patient, noting their department on the request
+    # so beds and queues can be counted by department
+    def request_bed(self, patient, priority):
+        return self.nelbed.request(DEPARTMENTS.index(patient.department),
+                                   priority=priority)
+
+    # Records the beds in use and the length of the queue, by department,
+    # every monitor interval
+    def monitor_beds(self):
+        while self.monitor.n_recorded < self.monitor.n_samples:
+            self.monitor.record(self.nelbed.users_by_department,
+                                self.nelbed.queue_by_department)
+            yield self.env.timeout(self.monitor.interval)
+
     # This method calculates results over a single run.
     def calculate_run_results(self):
-        #drop the dummy patient we entered when we set up the df
-        self.results_df.drop([1], inplace=True)
         # Take the mean of the queuing times across patients in this run of the 
         # model.
         self.ed_admissions = (self.results_df["Department"] == "ED").sum()
@@ -317,22 +498,263 @@ class Model:
         self.env.process(self.generator_patient_arrivals())
         self.env.process(self.generator_sdec_arrivals())
         self.env.process(self.generator_other_arrivals())
+        self.env.process(self.monitor_beds())
 
         # Run the model for the duration specified in g class
-        self.env.run(until=(g.sim_duration + g.warm_up_period))
+        with profile_phase(self.profile, "Simulate"):
+            self.env.run(until=(self.scenario.sim_duration + self.scenario.warm_up_period))
+
+        with profile_phase(self.profile, "Run Results"):
+            # Build the patient level results in one step
+            self.results_df = self.recorder.to_dataframe()
 
-        # Now the simulation run has finished, call the method that calculates
-        # run results
-        self.calculate_run_results()
+            # Now the simulation run has finished, call the method that
+            # calculates run results
+            self.calculate_run_results()
 
         # Return patient level results for this run
         return (self.results_df)
 
+    # Returns the single run metrics in the column order used by
+    # Trial.df_trial_results
+    def get_run_results(self):
+        return [self.ed_admissions,
+                self.mean_q_time_bed,
+                self.min_q_time_bed,
+                self.max_q_time_bed,
+                self.perf_4hr,
+                self.dta_12hr,
+                self.q_time_bed_95,
+                self.sdec_admissions,
+                self.mean_q_time_sdec,
+                self.other_admissions,
+                self.mean_q_time_other,
+                self.reneged]
+
+# The simulation engines a Trial can use. "simpy" is the Model above,
+# "fast" is the heap based FastModel in fast_engine.py, which gives the same
+# results much more quickly.
+ENGINES = ["simpy", "fast"]
+
+def get_model_class(engine):
+    if engine == "simpy":
+        return Model
+    if engine == "fast":
+        # imported here as fast_engine imports Model from this module
+        try:
+            from .fast_engine import FastModel
+        except ImportError: # imported from inside the app folder
+            from fast_engine import FastModel
+        return FastModel
+    raise ValueError(f"Unknown engine {engine!r}, expected one of {ENGINES}")
+
+# Runs a single model, either in this process or in a worker process, and
+# returns (run, run results, patient level results, PatientSummary of the
+# run, BedMonitor of the run, new snapshot). The patient level results are
+# None unless keep_patient_level is set, so only the summaries are sent back
+# from a worker.
+# With warm_start the run starts from snapshot (a fast_engine.Snapshot)
+# instead of from empty. If there isn't one the run takes its own at the end
+# of the warm up and returns it as the new snapshot, otherwise that is None.
+# With profile the run is timed phase by phase (and with profile="memory" its
+# peak memory is measured too) and the profiling.RunProfile is returned as
+# well, otherwise that is None.
+# With a results_store (a results_store.PatientResultsStore) the patient level
+# results are written to it from here, so they never have to be sent back
+# from a worker.
+def run_single(run, scenario, engine="simpy", keep_patient_level=True,
+               warm_start=False, snapshot=None, top_up_period=0,
+               monitor_interval=DEFAULT_MONITOR_INTERVAL, profile=False,
+               results_store=None):
+    profile = RunProfile(run, memory=profile == "memory") if profile else None
+    if profile is not None:
+        profile.start_memory()
+    new_snapshot = None
+    with profile_phase(profile, "Setup"):
+        if warm_start:
+            # imported here as fast_engine imports Model from this module
+            try:
+                from .fast_engine import FastModel, take_snapshot
+            except ImportError: # imported from inside the app folder
+                from fast_engine import FastModel, take_snapshot
+            if snapshot is None:
+                snapshot = new_snapshot = take_snapshot(scenario, run)
+            my_model = FastModel(run, scenario, snapshot, top_up_period,
+                                 monitor_interval)
+        else:
+            my_model = get_model_class(engine)(run, scenario,
+                                               monitor_interval=monitor_interval)
+    if profile is not None:
+        my_model.enable_profiling(profile)
+    patient_level_results = my_model.run()
+    with profile_phase(profile, "Summarise"):
+        run_summary = PatientSummary.from_results(patient_level_results)
+        if results_store is not None:
+            results_store.write_run(run, patient_level_results)
+        if keep_patient_level:
+            patient_level_results = patient_level_results.round(2)
+        else:
+            patient_level_results = None
+    if profile is not None:
+        profile.stop_memory()
+    return (run, my_model.get_run_results(), patient_level_results,
+            run_summary, my_model.monitor, new_snapshot, profile)
+
+# 4hr DTA performance of each run as a percentage
+def percent_4hr(results):
+    return results["4hr (DTA) Performance"] * 100
+
+# Trial summary metrics and what they summarise: either a run result column
+# or a function of df_trial_results giving the metric for every run (module
+# level functions, so trials can still be pickled). Trial(metrics=...) takes
+# a dictionary like this one to summarise other or derived metrics.
+SUMMARY_METRICS = {"ED Admissions": "ED Admissions",
+                   "Mean Q Time (Hrs)": "Mean Q Time Bed",
+                   "Min Q Time": "Min Q Time Bed",
+                   "Max Q Time (Hrs)": "Max Q Time Bed",
+                   "4hr DTA Performance (%)": percent_4hr,
+                   "12hr DTAs": "12hr DTAs",
+                   "95th Percentile Q": "95th Percentile Q",
+                   "SDEC Admissions": "SDEC Admissions",
+                   "Mean Q Time SDEC": "Mean Q Time SDEC",
+                   "Other Admissions": "Other Admissions",
+                   "Mean Q Time Other": "Mean Q Time Other",
+                   "Reneged": "Reneged"}
+
+# How trial summary confidence intervals are worked out: from the normal
+# distribution, or the t distribution (wider for a small number of runs)
+CI_METHODS = ["normal", "t"]
+
+# Every metric for every run of results (a df_trial_results), one column per
+# metric
+def metric_values(results, metrics=SUMMARY_METRICS):
+    return pd.DataFrame({name: metric(results) if callable(metric)
+                         else results[metric]
+                         for name, metric in metrics.items()},
+                        index=results.index)
+
+# Summary across runs of every column of values (from metric_values) in one
+# go: one row per metric with its mean, standard deviation, standard error,
+# confidence interval, min and max. Runs where a metric is missing (e.g. no
+# SDEC patients) are left out of that metric.
+def summarise_runs(values, ci_method="normal", confidence=0.95):
+    # scipy.stats is slow to import so only load it when it is needed
+    import scipy.stats as stats
+
+    values = values.astype(float)
+    n_runs = values.count()
+    mean = values.mean()
+    std = values.std()
+    se = std / np.sqrt(n_runs)
+    if ci_method == "normal":
+        z = stats.norm.ppf(0.5 + confidence / 2)
+    elif ci_method == "t":
+        z = pd.Series(stats.t.ppf(0.5 + confidence / 2, n_runs - 1),
+                      index=values.columns)
+    else:
+        raise ValueError(f"Unknown CI method {ci_method!r}, expected one of "
+                         f"{CI_METHODS}")
+    summary = pd.DataFrame({"Mean": mean,
+                            "St. dev": std,
+                            "St. error": se,
+                            f"Lower {confidence:.0%} CI": mean - z * se,
+                            f"Upper {confidence:.0%} CI": mean + z * se,
+                            "Min": values.min(),
+                            "Max": values.max()})
+    summary.index.name = "Metric"
+    return summary
+
+# Metrics whose confidence intervals decide when a sequential trial stops
+PRECISION_METRICS = ["Mean Q Time (Hrs)", "4hr DTA Performance (%)"]
+
 # Class representing a Trial for our simulation - a batch of simulation runs.
 class Trial:
 
     # Empty df that will store results from each run against run number.
-    def  __init__(self):
+    # The scenario to run defaults to the values in g. engine picks the
+    # simulation engine (see ENGINES). Set parallel=True to spread the runs
+    # over a pool of worker processes, n_workers defaults to the number of
+    # CPUs available.
+    # The patient level results of every run are only kept (and returned by
+    # run_trial) if keep_patient_level is set, otherwise they are summarised
+    # run by run into self.patient_summary and run_trial returns None for them.
+    # If precision is set the trial is sequential: runs carry on until the 95%
+    # CI half width of every precision_metric is within precision (e.g. 0.05
+    # for 5%) of its mean, with at least min_runs runs, and number_of_runs in
+    # the scenario is the most runs that will be done.
+    # If detect_warm_up is set the warm up period is worked out from pilot
+    # runs (see WarmUpAnalysis) before the trial is run, and the scenario's
+    # warm_up_period is replaced with it.
+    # With warm_start (fast engine only) each run starts from its snapshot in
+    # the snapshots library (a snapshots.SnapshotLibrary) and skips its warm
+    # up; runs that aren't in the library yet add their snapshot to it. If
+    # top_up_period is set, a run with no exact snapshot starts from the
+    # nearest one instead and warms up for top_up_period.
+    # metrics are the rows of the trial summary (see SUMMARY_METRICS) and
+    # ci_method how its confidence intervals are worked out (see CI_METHODS).
+    # Every run samples the beds in use and the queue, by department, every
+    # monitor_interval minutes into self.monitors.
+    # With profile each run records where its time goes (see profiling.py;
+    # profile="memory" adds each run's peak memory), and the trial times its
+    # own phases; profiling_dataframe shows both.
+    # With a results_store (a results_store.PatientResultsStore) every run's
+    # patient level results are written to it as the run finishes, in compact
+    # types, to be read back memory-mapped; pass keep_patient_level=False as
+    # well so they aren't also kept in memory.
+    def  __init__(self, scenario=None, engine="simpy", parallel=False,
+                  n_workers=None, keep_patient_level=True, precision=None,
+                  precision_metrics=PRECISION_METRICS, min_runs=5,
+                  detect_warm_up=False, warm_start=False, snapshots=None,
+                  top_up_period=None, metrics=SUMMARY_METRICS,
+                  ci_method="normal",
+                  monitor_interval=DEFAULT_MONITOR_INTERVAL, profile=False,
+                  results_store=None):
+        self.scenario = scenario if scenario is not None else Scenario.from_g()
+        # fail early on a typo rather than in a worker process
+        get_model_class(engine)
+        self.engine = engine
+        self.parallel = parallel
+        self.n_workers = n_workers
+        self.keep_patient_level = keep_patient_level
+        self.precision = precision
+        self.metrics = dict(metrics)
+        if ci_method not in CI_METHODS:
+            raise ValueError(f"Unknown CI method {ci_method!r}, expected one "
+                             f"of {CI_METHODS}")
+        self.ci_method = ci_method
+        self.precision_metrics = list(precision_metrics)
+        # precision_metrics are only used by a sequential trial, so other
+        # trials can summarise any metrics
+        if precision is not None:
+            for metric in self.precision_metrics:
+                if metric not in self.metrics:
+                    raise ValueError(f"Unknown metric {metric!r}, expected one "
+                                     f"of {list(self.metrics)}")
+        self.min_runs = min_runs
+        self.detect_warm_up = detect_warm_up
+        self.warm_start = warm_start
+        if warm_start and engine != "fast":
+            raise ValueError("warm_start needs the fast engine")
+        if warm_start and snapshots is None:
+            # imported here as snapshots imports this module
+            try:
+                from .snapshots import SnapshotLibrary
+            except ImportError: # imported from inside the app folder
+                from snapshots import SnapshotLibrary
+            snapshots = SnapshotLibrary()
+        self.snapshots = snapshots
+        self.top_up_period = top_up_period
+        self.monitor_interval = monitor_interval
+        self.profile = profile
+        self.results_store = results_store
+        self.profiles = []
+        self.phase_times = {}
+        self.warm_up_analysis = None
+        self.monitors = []
+        self.n_runs = 0
+        self.precision_df = None
+        self.all_results_patient_level = None
+        self.patient_summary = PatientSummary()
         self.df_trial_results = pd.DataFrame()
         self.df_trial_results["Run Number"] = [0]
         self.df_trial_results["ED Admissions"] = [0]
@@ -350,373 +772,201 @@ class Trial:
         self.df_trial_results.set_index("Run Number", inplace=True)
 
     def calculate_trial_summary(self): # calculate single summary stat across all runs
-        #ED Admissions
-        self.mean_admission = (
-            self.df_trial_results["ED Admissions"].mean()
-        )
-        self.std_admission = (
-            self.df_trial_results["ED Admissions"].std()
-        )
-        self.se_admission = self.std_admission / np.sqrt(g.number_of_runs)
-        self.lowerci_admission, self.upperci_admission = (
-            stats.norm.interval(0.95, loc=self.mean_admission, scale=self.se_admission)
-        )
-        self.min_admission = (
-            self.df_trial_results["ED Admissions"].min()
-        )
-        self.max_admission = (
-            self.df_trial_results["ED Admissions"].max()
-        )
-        #Mean Q Time
-        self.mean_q_time_trial = (
-            self.df_trial_results["Mean Q Time Bed"].mean()
-        )
-        self.std_mean_q_time_trial = (
-            self.df_trial_results["Mean Q Time Bed"].std()
-        )
-        self.se_mean_q_time_trial = self.std_mean_q_time_trial / np.sqrt(g.number_of_runs)
-        self.lowerci_mean_q_time_trial, self.upperci_mean_q_time_trial = (
-            stats.norm.interval(0.95, loc=self.mean_q_time_trial, scale=self.se_mean_q_time_trial)
-        )
-        self.min_mean_q_time_trial = (
-            self.df_trial_results["Mean Q Time Bed"].min()
-        )
-        self.max_mean_q_time_trial = (
-            self.df_trial_results["Mean Q Time Bed"].max()
-        )
-        #Min Q Time
-        self.mean_min = (
-            self.df_trial_results["Min Q Time Bed"].mean()
-        )
-        self.std_min = (
-            self.df_trial_results["Min Q Time Bed"].std()
-        )
-        self.se_min = self.std_min / np.sqrt(g.number_of_runs)
-        self.lowerci_min, self.upperci_min = (
-            stats.norm.interval(0.95, loc=self.mean_min, scale=self.se_min)
-        )
-        self.min_min = (
-            self.df_trial_results["Min Q Time Bed"].min()
-        )
-        self.max_min = (
-            self.df_trial_results["Min Q Time Bed"].max()
-        )
-        #Max Q Time
-        self.mean_max = (
-            self.df_trial_results["Max Q Time Bed"].mean()
-        )
-        self.std_max = (
-            self.df_trial_results["Max Q Time Bed"].std()
-        )
-        self.se_max = self.std_max / np.sqrt(g.number_of_runs)
-        self.lowerci_max, self.upperci_max = (
-            stats.norm.interval(0.95, loc=self.mean_max, scale=self.se_max)
-        )
-        self.min_max = (
-            self.df_trial_results["Max Q Time Bed"].min()
-        )
-        self.max_max = (
-            self.df_trial_results["Max Q Time Bed"].max()
-        )
-        #4hr Performance
-        self.mean_4hr = (
-            self.df_trial_results["4hr (DTA) Performance"].mean()
-        )
-        self.std_4hr = (
-            self.df_trial_results["4hr (DTA) Performance"].std()
-        )
-        self.se_4hr = self.std_4hr / np.sqrt(g.number_of_runs)
-        self.lowerci_4hr, self.upperci_4hr = (
-            stats.norm.interval(0.95, loc=self.mean_4hr, scale=self.se_4hr)
-        )
-        self.min_4hr = (
-            self.df_trial_results["4hr (DTA) Performance"].min()
-        )
-        self.max_4hr = (
-            self.df_trial_results["4hr (DTA) Performance"].max()
-        )
-        #12hr DTAs
-        self.mean_12hr = (
-            self.df_trial_results["12hr DTAs"].mean()
-        )
-        self.std_12hr = (
-            self.df_trial_results["12hr DTAs"].std()
-        )
-        self.se_12hr = self.std_12hr / np.sqrt(g.number_of_runs)
-        self.lowerci_12hr, self.upperci_12hr = (
-            stats.norm.interval(0.95, loc=self.mean_12hr, scale=self.se_12hr)
-        )
-        self.min_12hr = (
-            self.df_trial_results["12hr DTAs"].min()
-        )
-        self.max_12hr = (
-            self.df_trial_results["12hr DTAs"].max()
-        )
-        #95th Percentile
-        self.mean_95 = (
-            self.df_trial_results["95th Percentile Q"].mean()
-        )
-        self.std_95 = (
-            self.df_trial_results["95th Percentile Q"].std()
-        )
-        self.se_95 = self.std_95 / np.sqrt(g.number_of_runs)
-        self.lowerci_95, self.upperci_95 = (
-            stats.norm.interval(0.95, loc=self.mean_95, scale=self.se_95)
-        )
-        self.min_95 = (
-            self.df_trial_results["95th Percentile Q"].min()
-        )
-        self.max_95 = (
-            self.df_trial_results["95th Percentile Q"].max()
-        )
-        #SDEC Admissions
-        self.mean_sdec = (
-            self.df_trial_results["SDEC Admissions"].mean()
-        )
-        self.std_sdec = (
-            self.df_trial_results["SDEC Admissions"].std()
-        )
-        self.se_sdec = self.std_sdec / np.sqrt(g.number_of_runs)
-        self.lowerci_sdec, self.upperci_sdec = (
-            stats.norm.interval(0.95, loc=self.mean_sdec, scale=self.se_sdec)
-        )
-        self.min_sdec = (
-            self.df_trial_results["SDEC Admissions"].min()
-        )
-        self.max_sdec = (
-            self.df_trial_results["SDEC Admissions"].max()
-        )
-        #Reneged
-        self.mean_reneged = (
-            self.df_trial_results["Reneged"].mean()
-        )
-        self.std_reneged = (
-            self.df_trial_results["Reneged"].std()
-        )
-        self.se_reneged = self.std_reneged / np.sqrt(g.number_of_runs)
-        self.lowerci_reneged, self.upperci_reneged = (
-            stats.norm.interval(0.95, loc=self.mean_reneged, scale=self.se_reneged)
-        )
-        self.min_reneged = (
-            self.df_trial_results["Reneged"].min()
-        )
-        self.max_reneged = (
-            self.df_trial_results["Reneged"].max()
-        )
-
-        #pandas dataframe to hold the results
-        self.trial_summary_df = pd.DataFrame()
-        self.trial_summary_df["Metric"] = ["ED Admissions",
-                                           "Mean Q Time (Hrs)", 
-                                           "Min Q Time",
-                                           "Max Q Time (Hrs)",
-                                           "4hr (DTA) Performance",
-                                           "12hr DTAs",
-                                           "95th Percentile Q",
-                                           "SDEC Admissions",
-                                           "Reneged"]
-        self.trial_summary_df["Mean"] = [self.mean_admission,
-                                            self.mean_q_time_trial,
-                                            self.mean_min,
-                                            self.mean_max,
-                                            self.mean_4hr,
-                                            self.mean_12hr,
-                                            self.mean_95,
-                                            self.mean_sdec,
-                                            self.mean_reneged]
-        self.trial_summary_df["St. dev"] = [self.std_admission,
-                                            self.std_mean_q_time_trial,
-                                            self.std_min,
-                                            self.std_max,
-                                            self.std_4hr,
-                                            self.std_12hr,
-                                            self.std_95,
-                                            self.std_sdec,
-                                            self.std_reneged]
-        self.trial_summary_df["St. error"] = [self.se_admission,
-                                              self.se_mean_q_time_trial,
-                                              self.se_min,
-                                              self.se_max,
-                                              self.se_4hr,
-                                              self.se_12hr,
-                                              self.se_95,
-                                              self.se_sdec,
-                                              self.se_reneged]
-        self.trial_summary_df["Lower 95% CI"] = [self.lowerci_admission,
-                                                 self.lowerci_mean_q_time_trial,
-                                                 self.lowerci_min,
-                                                 self.lowerci_max,
-                                                 self.lowerci_4hr,
-                                                 self.lowerci_12hr,
-                                                 self.lowerci_95,
-                                                 self.lowerci_sdec,
-                                                 self.lowerci_reneged]
-        self.trial_summary_df["Upper 95% CI"] = [self.upperci_admission,
-                                                 self.upperci_mean_q_time_trial,
-                                                 self.upperci_min,
-                                                 self.upperci_max,
-                                                 self.upperci_4hr,
-                                                 self.upperci_12hr,
-                                                 self.upperci_95,
-                                                 self.upperci_sdec,
-                                                 self.upperci_reneged]
-        self.trial_summary_df["Min"] = [self.min_admission,
-                                        self.min_mean_q_time_trial,
-                                        self.min_min,
-                                        self.min_max,
-                                        self.min_4hr,
-                                        self.min_12hr,
-                                        self.min_95,
-                                        self.min_sdec,
-                                        self.min_reneged]
-        self.trial_summary_df["Max"] = [self.max_admission,
-                                        self.max_mean_q_time_trial,
-                                        self.max_min,
-                                        self.max_max,
-                                        self.max_4hr,
-                                        self.max_12hr,
-                                        self.max_95,
-                                        self.max_sdec,
-                                        self.max_reneged]
-        self.trial_summary_df = self.trial_summary_df.round(2)
-        self.trial_summary_df.set_index("Metric", inplace=True)
-        self.trial_summary_df.loc["4hr (DTA) Performance"] = self.trial_summary_df.loc["4hr (DTA) Performance"] * 100
-        self.trial_summary_df = self.trial_summary_df.rename(index={"4hr (DTA) Performance":"4hr DTA Performance (%)"})
-    
+        values = metric_values(self.df_trial_results, self.metrics)
+        self.trial_summary_df = summarise_runs(values, self.ci_method).round(2)
+
+    # Number of worker processes to use for a parallel trial
+    def get_n_workers(self):
+        n_workers = self.n_workers or os.cpu_count() or 1
+        return max(1, min(n_workers, self.scenario.number_of_runs))
+
+    # Pool of worker processes for a parallel trial, or None to run in this
+    # process. Used as a context manager either way.
+    def make_pool(self):
+        if not self.parallel or self.get_n_workers() == 1:
+            return nullcontext()
+        return ProcessPoolExecutor(max_workers=self.get_n_workers())
+
+    # (snapshot, top up period) to start each of runs from, when warm
+    # starting. Snapshots that aren't in the library are None.
+    def get_snapshots(self, runs):
+        if not self.warm_start:
+            return [(None, 0)] * len(runs)
+
+        snapshots = []
+        for run in runs:
+            snapshot = self.snapshots.get(self.scenario, run)
+            if snapshot is not None:
+                snapshots.append((snapshot, 0))
+            elif self.top_up_period is not None:
+                # (None if there isn't a near one, so the run takes its own)
+                snapshots.append((self.snapshots.nearest(self.scenario, run),
+                                  self.top_up_period))
+            else:
+                snapshots.append((None, 0))
+        return snapshots
+
+    # The arguments to run_single for each of runs
+    def get_run_args(self, runs):
+        return [(run, self.scenario, self.engine, self.keep_patient_level,
+                 self.warm_start, snapshot, top_up_period,
+                 self.monitor_interval, self.profile, self.results_store)
+                for run, (snapshot, top_up_period)
+                in zip(runs, self.get_snapshots(runs))]
+
+    # Iterator returning the results of run_single for runs in order, either
+    # from this process or from pool
+    def map_runs(self, runs, pool=None):
+        args = zip(*self.get_run_args(runs))
+        if pool is None:
+            return map(run_single, *args)
+        # map returns the results in run order so the output matches the
+        # serial trial
+        return pool.map(run_single, *args)
+
+    # Generator returning the results of run_single for the runs of the trial
+    # in order. A sequential trial hands out runs a batch (one per worker) at
+    # a time and stops as soon as the runs so far are precise enough, so it
+    # stops after the same run however many workers there are.
+    # pool is a pool of worker processes to use instead of making one (it is
+    # left running afterwards). Closing the generator early cancels the runs
+    # that haven't started.
+    def iter_runs(self, pool=None):
+        max_runs = self.scenario.number_of_runs
+
+        with nullcontext(pool) if pool is not None else self.make_pool() as pool:
+            if self.precision is None:
+                yield from self.map_runs(range(max_runs), pool)
+                return
+
+            batch_size = self.get_n_workers() if pool is not None else 1
+            for start in range(0, max_runs, batch_size):
+                batch = range(start, min(start + batch_size, max_runs))
+                for results in self.map_runs(batch, pool):
+                    yield results
+                    if self.precision_reached():
+                        return
+
+    # 95% CI half width of the precision metrics relative to their means,
+    # using the t distribution as there may only be a few runs
+    def calculate_precision(self):
+        import scipy.stats as stats
+
+        results = metric_values(
+            self.df_trial_results.iloc[:self.n_runs],
+            {metric: self.metrics[metric] for metric in self.precision_metrics})
+        rows = []
+        for metric in self.precision_metrics:
+            values = results[metric]
+            mean = values.mean()
+            if self.n_runs > 1:
+                half_width = (stats.t.ppf(0.975, self.n_runs - 1)
+                              * values.std() / np.sqrt(self.n_runs))
+            else:
+                half_width = np.inf
+            if half_width == 0:
+                relative_precision = 0.0
+            elif mean == 0:
+                relative_precision = np.inf
+            else:
+                relative_precision = half_width / abs(mean)
+            rows.append({"Metric": metric,
+                         "Mean": mean,
+                         "CI Half Width": half_width,
+                         "Relative Precision": relative_precision})
+        self.precision_df = pd.DataFrame(rows).set_index("Metric")
+        return self.precision_df
+
+    def precision_reached(self):
+        if self.n_runs < self.min_runs:
+            return False
+        precision_df = self.calculate_precision()
+        return bool((precision_df["Relative Precision"] <= self.precision).all())
 
     # Method to run a trial
-    def run_trial(self):
-        # Run the simulation for the number of runs specified in g class.
+    # progress (optional) is called with the number of runs done and the most
+    # there will be after every run (after every pilot run first, with
+    # detect_warm_up); an exception raised from it stops the trial. pool is as
+    # for iter_runs, and is used for the pilot runs too.
+    def run_trial(self, progress=None, pool=None):
+        # Run the simulation for the number of runs specified in the scenario.
         # For each run, we create a new instance of the Model class and call its
         # run method, which sets everything else in motion.
+        start_time = time.perf_counter()
+        if self.detect_warm_up:
+            self.run_warm_up_analysis(progress, pool)
+            self.phase_times["Warm Up Analysis"] = time.perf_counter() - start_time
+
         results_dfs = []
         
-        for run in range(g.number_of_runs):
-            my_model = Model(run)
-            patient_level_results = my_model.run()
-            
-            self.df_trial_results.loc[run] = [my_model.ed_admissions, 
-                                              my_model.mean_q_time_bed,
-                                              my_model.min_q_time_bed,
-                                              my_model.max_q_time_bed,
-                                              my_model.perf_4hr,
-                                              my_model.dta_12hr,
-                                              my_model.q_time_bed_95,
-                                              my_model.sdec_admissions,
-                                              my_model.mean_q_time_sdec,
-                                              my_model.other_admissions,
-                                              my_model.mean_q_time_other,
-                                              my_model.reneged]
-
-            patient_level_results = patient_level_results.round(2)
-            patient_level_results['run'] = run
-
-            results_dfs.append(patient_level_results)
+        start_time = time.perf_counter()
+        for run, run_results, patient_level_results, run_summary, monitor, new_snapshot, profile in self.iter_runs(pool):
+            self.df_trial_results.loc[run] = run_results
+            self.n_runs = run + 1
+            self.patient_summary.merge(run_summary)
+            self.monitors.append(monitor)
+            if new_snapshot is not None:
+                self.snapshots.add(new_snapshot)
+            if profile is not None:
+                self.profiles.append(profile)
+
+            if patient_level_results is not None:
+                patient_level_results['run'] = run
+
+                results_dfs.append(patient_level_results)
+
+            if progress is not None:
+                progress(self.n_runs, self.scenario.number_of_runs)
         
         #stick all the individual results together
-        all_results_patient_level = pd.concat(results_dfs)
+        if results_dfs:
+            self.all_results_patient_level = pd.concat(results_dfs)
+        self.phase_times["Runs"] = time.perf_counter() - start_time
                                               
         # Once the trial (ie all runs) has completed, print the final results
         #self.print_trial_results()
         #self.print_alltrial_summary()
 
+        start_time = time.perf_counter()
         self.calculate_trial_summary()
-
-        return self.df_trial_results, all_results_patient_level, self.trial_summary_df
-
-# Create an instance of the Trial class
-my_trial = Trial()
-
-print(f"Running {g.number_of_runs} simulations......")
-start_time = time.time()
-
-# Call the run_trial method of our Trial object
-df_trial_results, all_results_patient_level, trial_summary =  my_trial.run_trial()
-
-
-# end_time = time.time()
-# elapsed_time = end_time - start_time
-# print(f"That took {round(elapsed_time)} seconds")
-# print("Doing some transformations")
-
-# #Convert wait times into hours
-# all_results_patient_level['q_time_bed_hours'] = all_results_patient_level['Q Time Bed'] / 60.0
-# all_results_patient_level['under4hrflag'] = np.where(all_results_patient_level['q_time_bed_hours'] < 4, 1, 0)
-# all_results_patient_level['dta12hrflag'] = np.where(all_results_patient_level['q_time_bed_hours'] > 12, 1, 0)
-# all_results_patient_level['q_time_bed_or_renege'] = all_results_patient_level['Q Time Bed|Renege'] / 60.0
-
-# ################
-# print("Calculating wait time metrics.....")
-# print("These metrics only include those patients actually admitted")
-# #calculating the metrics
-# #Mean
-# mean_pat_data = round(all_results_patient_level['q_time_bed_hours'].mean())
-
-# #Min
-# min_pat_data = round(all_results_patient_level['q_time_bed_hours'].min())
-
-# #Max
-# max_pat_data = round(all_results_patient_level['q_time_bed_hours'].max())
-
-# #95th percentile
-# q_pat_data = round(all_results_patient_level['q_time_bed_hours'].quantile(0.95))
-
-# #4hr performance
-# perf4hr_pat_data = "{:.0%}".format(all_results_patient_level['under4hrflag'].mean())
-
-# #12hr DTAs per day
-# dtasperday = round((all_results_patient_level['dta12hrflag'].sum() / g.number_of_runs) / 60.0)
-
-# #Patients reneged from ED
-# reneged = round(all_results_patient_level['reneged'].sum() / g.number_of_runs)
-
-# #save these in a df
-# # according to chat you want to make it into a dictionary first
-# data = {
-#     "Metric": ["Mean Q Time (Hrs)", "Min Q Time", "Max Q Time (Hrs)", "4hr (DTA) Performance",
-#                 "12hr DTAs per day", "95th Percentile Q Time (Hrs)", "Reneged"],
-#     "Results": [mean_pat_data, min_pat_data, max_pat_data, perf4hr_pat_data, 
-#                 dtasperday, q_pat_data, reneged]
-# }
-
-# df = pd.DataFrame(data)
-
-# display(df)
-
-# #####################
-# #plotting and showing a single figure
-
-# # Create the histogram
-# plt.figure(figsize=(8, 6))
-# sns.histplot(all_results_patient_level['q_time_bed_hours'], bins=range(int(all_results_patient_level['q_time_bed_hours'].min()), 
-#                                                       int(all_results_patient_level['q_time_bed_hours'].max()) + 1, 1), 
-#              kde=False)
-
-# # Set the boundary for the bins to start at 0
-# plt.xlim(left=0)
-
-# # Add vertical lines
-# plt.axvline(x=mean_pat_data, color='tomato', linestyle='--', linewidth=1, label='Mean Q Time', zorder=0)
-# plt.axvline(x=4, color='mediumturquoise', linestyle='--', linewidth=1, label='4 Hours', zorder=0)
-# plt.axvline(x=12, color='royalblue', linestyle='--', linewidth=1, label='12 Hours', zorder=0)
-# plt.axvline(x=q_pat_data, color='goldenrod', linestyle='--', linewidth=1, zorder=0)
-# plt.axvline(x=max_pat_data, color='slategrey', linestyle='--', linewidth=1, zorder=0)
-
-# # Add labels to the lines
-# plt.text(mean_pat_data + 2, plt.ylim()[1] * 0.95, f'Mean Q Time: {mean_pat_data} hrs', color='tomato', ha='left', va='top', fontsize=10, rotation=90,
-#             bbox=dict(facecolor='white', edgecolor='none', alpha=0.7, boxstyle='round,pad=0.5'))
-# plt.text(4 + 2, plt.ylim()[1] * 0.95, f'4 Hr Performance: {perf4hr_pat_data}', color='mediumturquoise', ha='left', va='top', fontsize=10, rotation=90,
-#             bbox=dict(facecolor='white', edgecolor='none', alpha=0.7, boxstyle='round,pad=0.5'))
-# plt.text(12 + 2, plt.ylim()[1] * 0.95, f'12 Hr DTAs per day: {dtasperday}', color='royalblue', ha='left', va='top', fontsize=10, rotation=90,
-#             bbox=dict(facecolor='white', edgecolor='none', alpha=0.7, boxstyle='round,pad=0.5'))
-# plt.text(q_pat_data + 2, plt.ylim()[1] * 0.95, f'95th Percentile Q Time: {q_pat_data} hrs', color='goldenrod', ha='left', va='top', fontsize=10, rotation=90,
-#             bbox=dict(facecolor='white', edgecolor='none', alpha=0.7, boxstyle='round,pad=0.5'))
-# plt.text(max_pat_data + 1, plt.ylim()[1] * 0.95, f'Max Q Time: {max_pat_data} hrs', color='slategrey', ha='left', va='top', fontsize=10, rotation=90)
-
-# # Add labels and title if necessary
-# plt.xlabel('Admission Delays (Hours)')
-# plt.ylabel('Frequency')
-# plt.title('Histogram of Admission Delays')
-
-# # Display the plot
-# plt.show()
+        if self.precision is not None:
+            self.calculate_precision()
+        self.phase_times["Trial Summary"] = time.perf_counter() - start_time
+
+        return self.get_results()
+
+    # Works out the warm up period for the scenario and uses it for the trial.
+    # progress and pool are as for WarmUpAnalysis.run.
+    def run_warm_up_analysis(self, progress=None, pool=None):
+        # imported here as warmup imports Trial from this module
+        try:
+            from .warmup import WarmUpAnalysis
+        except ImportError: # imported from inside the app folder
+            from warmup import WarmUpAnalysis
+
+        self.warm_up_analysis = WarmUpAnalysis(
+            self.scenario, engine=self.engine, parallel=self.parallel,
+            n_workers=self.n_workers)
+        self.warm_up_analysis.run(progress, pool)
+        self.scenario = self.warm_up_analysis.get_scenario()
+
+    # With profile, one row per run of where its time went (plus a total),
+    # and the wall time of each phase of the trial (runs in parallel overlap,
+    # so the Runs phase can be shorter than the total of the runs)
+    def profiling_dataframe(self):
+        runs = profiles_to_dataframe(self.profiles)
+        trial = pd.DataFrame({"Wall Time (s)": self.phase_times})
+        trial.index.name = "Trial Phase"
+        return runs, trial
+
+    # Percentile bands across the runs of the monitor series (see
+    # monitor.BedMonitor.series_names) at every sample time
+    def monitor_bands(self, series=("beds_in_use", "queue_length"),
+                      percentiles=DEFAULT_PERCENTILES):
+        return percentile_bands(self.monitors, series, percentiles)
+
+    # The (df_trial_results, all_results_patient_level, trial_summary) tuple
+    # returned by run_trial
+    def get_results(self):
+        return (self.df_trial_results, self.all_results_patient_level,
+                self.trial_summary_df)
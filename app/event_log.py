@@ -0,0 +1,94 @@
+from array import array
+
+import numpy as np
+import pandas as pd
+
+try:
+    from .recorder import DEPARTMENTS
+except ImportError: # imported from inside the app folder
+    from recorder import DEPARTMENTS
+
+# Events in a patient's stay, stored as their index in this list. ED patients
+# arrive and, if there isn't a free bed, queue; while queuing they can
+# escalate (deteriorate, and queue again with a higher priority) or renege
+# (improve and leave). Patients who get a bed are admitted, and discharged
+# when they leave it.
+EVENTS = ["arrival", "queue", "escalate", "renege", "admit", "discharge"]
+EVENT_CODES = {event: code for code, event in enumerate(EVENTS)}
+
+# How each event changes the number of patients waiting for a bed (arrived
+# but not yet admitted) and the number in a bed
+WAITING_CHANGE = np.array([1, 0, 0, -1, -1, 0])
+IN_BED_CHANGE = np.array([0, 0, 0, 0, 1, -1])
+
+# Every event of a run (see Model.enable_event_log), appended to typed arrays
+# (time, patient ID, event code and department code, 14 bytes an event) in
+# the order they happen.
+class EventLog:
+    def __init__(self):
+        self.times = array("d")
+        self.patient_ids = array("i")
+        self.events = array("b")
+        self.departments = array("b")
+
+    def __len__(self):
+        return len(self.times)
+
+    # Event and department are codes (EVENT_CODES and index in DEPARTMENTS)
+    def record(self, time, patient_id, event, department):
+        self.times.append(time)
+        self.patient_ids.append(patient_id)
+        self.events.append(event)
+        self.departments.append(department)
+
+    # The log as NumPy arrays (times, patient_ids, events, departments),
+    # sharing the log's memory
+    def to_arrays(self):
+        return (np.frombuffer(self.times, dtype=np.float64),
+                np.frombuffer(self.patient_ids, dtype=np.int32),
+                np.frombuffer(self.events, dtype=np.int8),
+                np.frombuffer(self.departments, dtype=np.int8))
+
+    # One row per event, with the event and department as categoricals
+    def to_dataframe(self):
+        times, patient_ids, events, departments = self.to_arrays()
+        return pd.DataFrame({
+            "time": times,
+            "Patient ID": patient_ids,
+            "event": pd.Categorical.from_codes(events, EVENTS),
+            "Department": pd.Categorical.from_codes(departments, DEPARTMENTS)})
+
+# Downsamples an event log into frames for playing the run back: the number
+# of patients waiting for a bed and in a bed, by department, every interval
+# minutes from start to end (the last event if None), and how many of each
+# event there were in the interval up to each frame. One row per frame,
+# indexed by time; columns are "waiting <department>", "in_bed <department>"
+# and the EVENTS.
+# Worked out with cumulative sums over the whole log, so it takes one pass
+# however many frames there are.
+def playback_frames(event_log, interval=240, start=0, end=None):
+    times, _, events, departments = event_log.to_arrays()
+    if end is None:
+        end = times[-1] if len(times) else start
+    frame_times = np.arange(start, end + interval / 2, interval)
+    # number of events at or before each frame
+    n_events = np.searchsorted(times, frame_times, side="right")
+
+    frames = {}
+    for state, change in [("waiting", WAITING_CHANGE[events]),
+                          ("in_bed", IN_BED_CHANGE[events])]:
+        for code, department in enumerate(DEPARTMENTS):
+            totals = np.concatenate(
+                [[0], np.cumsum(np.where(departments == code, change, 0))])
+            frames[f"{state} {department}"] = totals[n_events]
+
+    # events in (previous frame, this frame], and before the first frame in
+    # the interval up to it
+    n_before_first = np.searchsorted(times, frame_times[0] - interval,
+                                     side="right")
+    for code, event in enumerate(EVENTS):
+        totals = np.concatenate([[0], np.cumsum(events == code)])
+        counts = totals[n_events]
+        frames[event] = np.diff(counts, prepend=totals[n_before_first])
+
+    return pd.DataFrame(frames, index=pd.Index(frame_times, name="time"))
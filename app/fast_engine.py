@@ -0,0 +1,633 @@
+import heapq
+import time
+from collections import deque
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+try:
+    from .des_classes1 import Model, Patient
+    from .monitor import BedMonitor, DEFAULT_MONITOR_INTERVAL
+    from .profiling import profile_phase
+    from .recorder import PatientRecorder
+except ImportError: # imported from inside the app folder
+    from des_classes1 import Model, Patient
+    from monitor import BedMonitor, DEFAULT_MONITOR_INTERVAL
+    from profiling import profile_phase
+    from recorder import PatientRecorder
+
+# The model's random streams (see seeds.STREAMS) and the attribute holding
+# each one's BatchSampler
+SAMPLERS = {"ed_inter_visit": "ed_inter_visit_dist",
+            "sdec_inter_visit": "sdec_inter_visit_dist",
+            "other_inter_visit": "other_inter_visit_dist",
+            "time_in_bed": "mean_time_in_bed_dist",
+            "renege_time": "renege_time",
+            "priority_update": "priority_update",
+            "priority": "priority",
+            "sdec_time_in_bed": "sdec_time_in_bed_dist",
+            "other_time_in_bed": "other_time_in_bed_dist"}
+
+# Arrival routes (these match the department codes used by PatientRecorder)
+ED_ROUTE = 0
+SDEC_ROUTE = 1
+OTHER_ROUTE = 2
+
+# Where an ED patient is in attend_hospital
+WAITING = 0
+ADMITTED = 1
+DETERIORATED = 2
+RENEGED = 3
+
+# Event codes. DISCHARGE and ED_TIMEOUT are scheduled on the heap, the rest
+# are follow-on events due at the current time.
+DISCHARGE = 0 # patient leaves their bed
+ED_TIMEOUT = 1 # earlier of an ED patient's renege and priority update times
+GRANTED = 2 # a bed request has been granted
+ADMIT_ED = 3 # ED patient resumes after their first request is granted
+ED_RESUME = 4 # ED patient resumes after their timeout
+TRIGGER = 5 # a released bed is offered to the front of the queue
+
+# The state of a FastModel run at a point in time: every patient still in a
+# bed or in the queue (see FastModel.make_snapshot for the arrays in
+# patients), the queue in order as (priority, request time, patient, whether
+# it is their second request), the time until the next arrival on each route
+# and the state of every random stream. Times are relative to the snapshot.
+# time is how much of the scenario (from empty) has been simulated.
+@dataclass(frozen=True)
+class Snapshot:
+    scenario: object
+    run_number: int
+    time: float
+    patients: dict
+    queue: tuple
+    beds_in_use: int
+    queue_length: int
+    next_arrivals: tuple
+    rng_states: dict
+
+# An alternative to the SimPy Model for the single priority bed pool. Instead
+# of a SimPy process per patient it runs a specialised event loop:
+#  * arrival times for each route are drawn up front (they don't depend on
+#    the state of the model) and merged in time order
+#  * a heap of (time, event id, code, patient) holds discharges and ED
+#    renege / priority update timeouts
+#  * a deque holds follow-on events due at the current time (a bed being
+#    granted after a release, etc.), which are processed before anything else
+#  * the bed queue is a heap of (priority, time of request, order of request,
+#    request), the same ordering as simpy's PriorityResource. Cancelled
+#    requests are left in the heap and skipped when they reach the front.
+# Only events that can change the state of the model are scheduled (e.g. one
+# timeout per waiting ED patient for the earlier of their renege and priority
+# update times, rather than both), patients are list indexes rather than
+# objects and the whole loop runs on local variables.
+#
+# Things that happen at the same instant are processed in the same order as
+# in SimPy and every random stream gives the same values in the same order,
+# so for the same scenario and run number FastModel gives the same results as
+# Model (see compare_engines). This includes Model's behaviour that an ED
+# patient whose priority is updated keeps their first request in the queue
+# until they are discharged, so it can be granted a second bed.
+#
+# Results are stored and summarised in the same way as Model, so it can be
+# used anywhere a Model is.
+#
+# A run can also start from a Snapshot of a model at the end of (some of) its
+# warm up, rather than from empty. It then only simulates the rest of the
+# scenario's warm up period (or top_up_period, if that is longer) before
+# collecting results.
+class FastModel(Model):
+    def __init__(self, run_number, scenario=None, snapshot=None,
+                 top_up_period=0, monitor_interval=DEFAULT_MONITOR_INTERVAL):
+        super().__init__(run_number, scenario, monitor_interval)
+
+        self.now = 0.0
+        self.capacity = self.scenario.number_of_nelbeds
+        self.snapshot = snapshot
+        if snapshot is None:
+            self.warm_up_period = self.scenario.warm_up_period
+        else:
+            self.warm_up_period = max(
+                self.scenario.warm_up_period - snapshot.time, top_up_period)
+            # carry on every random stream from where the snapshot left it
+            for stream, attribute in SAMPLERS.items():
+                sampler = getattr(self, attribute)
+                sampler.dist.rng.bit_generator.state = (
+                    snapshot.rng_states[stream])
+        self.end_time = self.scenario.sim_duration + self.warm_up_period
+        if snapshot is not None:
+            # sample times are on the same clock as a run from empty (the
+            # results period starts at the scenario's warm up period)
+            self.monitor = BedMonitor(
+                self.end_time, monitor_interval,
+                start_time=self.scenario.warm_up_period - self.warm_up_period)
+
+        # Time of the first arrival on each route after the end of the run,
+        # needed to take a snapshot
+        self.next_arrivals = None
+
+        # State of the bed pool at the end of the run
+        self.beds_in_use = 0
+        self.queue_length = 0
+
+        # Number of events processed by the event loop
+        self.events_processed = 0
+
+    # The event log is only recorded by Model's processes, which this engine
+    # doesn't run
+    def enable_event_log(self):
+        raise ValueError("The event log needs the simpy engine")
+
+    # Arrival times for one route: first (0, or from the snapshot), then the
+    # running total of the inter-arrival times, up to the end of the run.
+    # Drawn a block at a time straight from the distribution, which gives the
+    # same values as the generator in Model sampling one at a time. Also
+    # returns the time of the first arrival after the end of the run.
+    def arrival_times(self, sampler, first=0.0):
+        blocks = [np.array([first])]
+        last = first
+        while last < self.end_time:
+            inter = sampler.dist.sample(size=sampler.block_size)
+            # cumsum adds one value at a time, like env.now + timeout
+            block = np.cumsum(np.concatenate(([last], inter)))[1:]
+            blocks.append(block)
+            last = block[-1]
+        times = np.concatenate(blocks)
+        in_run = times < self.end_time
+        return times[in_run], float(times[~in_run][0])
+
+    # All arrivals in time order as arrays of times and routes. Arrivals at
+    # the same time (i.e. time 0) are in the order the generators are started
+    # in Model.run: ED, SDEC, Other.
+    def all_arrivals(self):
+        if self.snapshot is None:
+            first = (0.0, 0.0, 0.0)
+        else:
+            first = self.snapshot.next_arrivals
+        ed, next_ed = self.arrival_times(self.ed_inter_visit_dist, first[0])
+        sdec, next_sdec = self.arrival_times(self.sdec_inter_visit_dist,
+                                             first[1])
+        other, next_other = self.arrival_times(self.other_inter_visit_dist,
+                                               first[2])
+        self.next_arrivals = (next_ed, next_sdec, next_other)
+        times = np.concatenate((ed, sdec, other))
+        routes = np.concatenate((np.full(len(ed), ED_ROUTE),
+                                 np.full(len(sdec), SDEC_ROUTE),
+                                 np.full(len(other), OTHER_ROUTE)))
+        order = np.argsort(times, kind="stable")
+        return times[order], routes[order]
+
+    # Renege time, priority, priority update time and (with common random
+    # numbers, otherwise None) length of stay for every patient (in arrival
+    # order). ED patients take the next values from each stream, as in
+    # generator_patient_arrivals, everyone else requests a bed with the
+    # SDEC / Other priority. Each route draws its LoS from its own stream.
+    def patient_samples(self, routes):
+        is_ed = routes == ED_ROUTE
+        n_ed = int(is_ed.sum())
+
+        renege_times = np.zeros(len(routes))
+        renege_times[is_ed] = self.renege_time.dist.sample(size=n_ed)
+
+        priorities = np.full(len(routes), Patient(0).sdec_other_priority)
+        priorities[is_ed] = np.rint(self.priority.dist.sample(size=n_ed))
+
+        priority_updates = np.zeros(len(routes))
+        priority_updates[is_ed] = self.priority_update.dist.sample(size=n_ed)
+
+        times_in_bed = None
+        if self.scenario.common_random_numbers:
+            times_in_bed = np.zeros(len(routes))
+            for route, sampler in ((ED_ROUTE, self.mean_time_in_bed_dist),
+                                   (SDEC_ROUTE, self.sdec_time_in_bed_dist),
+                                   (OTHER_ROUTE, self.other_time_in_bed_dist)):
+                on_route = routes == route
+                times_in_bed[on_route] = sampler.dist.sample(
+                    size=int(on_route.sum()))
+
+        return renege_times, priorities, priority_updates, times_in_bed
+
+    # State of the event loop at the start of the run for n patients: empty,
+    # or the snapshot's patients (who are the first patients) in their beds
+    # and in the queue, with their pending discharges and timeouts. Beds in
+    # use and the queue length are given in total and by route.
+    def initial_state(self, n):
+        state = [WAITING] * n
+        granted = [False] * (2 * n)
+        cancelled = [False] * (2 * n)
+        in_use = [0, 0, 0]
+        queued = [0, 0, 0]
+        if self.snapshot is None:
+            return (state, granted, cancelled, [], [], 0, 0, in_use, queued,
+                    0, 0)
+
+        patients = self.snapshot.patients
+        events = []
+        for i in range(len(patients["route"])):
+            state[i] = int(patients["state"][i])
+            granted[i] = bool(patients["granted_first"][i])
+            granted[n + i] = bool(patients["granted_second"][i])
+            cancelled[i] = bool(patients["cancelled_first"][i])
+            # every request a snapshot patient has been granted is still held
+            in_use[patients["route"][i]] += granted[i] + granted[n + i]
+            if not np.isnan(patients["discharge_in"][i]):
+                events.append((float(patients["discharge_in"][i]),
+                               DISCHARGE, i))
+            if not np.isnan(patients["timeout_in"][i]):
+                events.append((float(patients["timeout_in"][i]),
+                               ED_TIMEOUT, i))
+        events = [(t, count, code, p) for count, (t, code, p)
+                  in enumerate(sorted(events), start=1)]
+        heapq.heapify(events)
+
+        # the snapshot's queue is in order, so numbering the requests in
+        # that order keeps ties in the same order
+        queue = [(priority, request_time, order,
+                  n + i if second else i)
+                 for order, (priority, request_time, i, second)
+                 in enumerate(self.snapshot.queue, start=1)]
+        heapq.heapify(queue)
+        for _, _, i, _ in self.snapshot.queue:
+            queued[patients["route"][i]] += 1
+
+        return (state, granted, cancelled, queue, events,
+                self.snapshot.beds_in_use, self.snapshot.queue_length,
+                in_use, queued, len(queue), len(events))
+
+    # The event loop. Follow-on events due now are processed first, then
+    # whichever is sooner of the next arrival and the next event on the heap.
+    # Patient i (in arrival order) has ID i + 1. Their first bed request is
+    # request i, and an ED patient's request after a priority update is
+    # request n + i.
+    # A run from a snapshot starts with the snapshot's patients (who have
+    # already arrived) ahead of the new arrivals.
+    def run_events(self, capture_snapshot=False):
+        arrival_array, route_array = self.all_arrivals()
+        renege_array, priority_array, update_array, los_array = (
+            self.patient_samples(route_array))
+        n_existing = 0
+        if self.snapshot is not None:
+            patients = self.snapshot.patients
+            n_existing = len(patients["route"])
+            arrival_array = np.concatenate((patients["arrival"], arrival_array))
+            route_array = np.concatenate((patients["route"], route_array))
+            renege_array = np.concatenate((patients["renege_time"],
+                                           renege_array))
+            priority_array = np.concatenate((patients["priority"],
+                                             priority_array))
+            update_array = np.concatenate((patients["priority_update"],
+                                           update_array))
+            if los_array is not None:
+                los_array = np.concatenate((patients["time_in_bed"],
+                                            los_array))
+        arrivals = arrival_array.tolist()
+        routes = route_array.tolist()
+        renege_times = renege_array.tolist()
+        priorities = priority_array.tolist()
+        priority_updates = update_array.tolist()
+        times_in_bed = los_array.tolist() if los_array is not None else None
+        n = len(arrivals)
+
+        # Every patient gets at most one row, so the recorder never has to grow
+        self.recorder = PatientRecorder(initial_capacity=max(n, 1))
+        get_row = self.recorder.get_row
+        departments = self.recorder.department_codes
+        data = self.recorder.data
+        q_time_col = data["Q Time Bed"]
+        q_time_renege_col = data["Q Time Bed|Renege"]
+        dta_col = data["dta"]
+        checkout_col = data["checkout"]
+        reneged_col = data["reneged"]
+        initial_priority_col = data["InitialPriority"]
+        updated_priority_col = data["UpdatedPriority"]
+        direct_cols = {SDEC_ROUTE: (data["Q Time Bed SDEC"],
+                                    data["sdec_dta"],
+                                    data["sdec_checkout"]),
+                       OTHER_ROUTE: (data["Q Time Bed Other"],
+                                     data["other_dta"],
+                                     data["other_checkout"])}
+
+        warm_up = self.warm_up_period
+        end_time = self.end_time
+        capacity = self.capacity
+        sample_los = self.mean_time_in_bed_dist.sample
+        monitor = self.monitor
+        next_sample = monitor.next_time
+        heappush = heapq.heappush
+        heappop = heapq.heappop
+
+        (state, granted, cancelled, queue, events, beds_in_use, queue_length,
+         in_use, queued, request_count, event_count) = self.initial_state(n)
+        # the route of every request (patient i makes requests i and n + i)
+        request_routes = routes + routes
+        due = deque()
+        processed = 0
+        next_arrival = n_existing
+        now = 0.0
+        # simpy takes the first sample before anyone arriving at time 0 has
+        # requested a bed
+        monitor.record(in_use, queued)
+        next_sample = monitor.next_time
+
+        while True:
+            if due:
+                code, x = due.popleft()
+                if code == TRIGGER:
+                    # Offer a free bed to the front of the queue. Like simpy,
+                    # only the front of the queue is ever looked at.
+                    while queue and cancelled[queue[0][3]]:
+                        heappop(queue)
+                    if queue and beds_in_use < capacity:
+                        req = heappop(queue)[3]
+                        queue_length -= 1
+                        granted[req] = True
+                        beds_in_use += 1
+                        queued[request_routes[req]] -= 1
+                        in_use[request_routes[req]] += 1
+                        due.append((GRANTED, req))
+                elif code == GRANTED:
+                    if x >= n:
+                        # ED patient gets a bed after their priority update
+                        p = x - n
+                        if arrivals[p] > warm_up:
+                            row = get_row(p + 1)
+                            q_time_col[row] = now - arrivals[p]
+                            checkout_col[row] = now - warm_up
+                            reneged_col[row] = 0
+                            updated_priority_col[row] = priorities[p] - 2.2
+                        event_count += 1
+                        los = (sample_los() if times_in_bed is None
+                               else times_in_bed[p])
+                        heappush(events, (now + los, event_count,
+                                          DISCHARGE, p))
+                    elif routes[x] != ED_ROUTE:
+                        # SDEC / Other patient gets a bed
+                        if arrivals[x] > warm_up:
+                            row = get_row(x + 1)
+                            q_col, dta, checkout = direct_cols[routes[x]]
+                            q_col[row] = now - arrivals[x]
+                            dta[row] = arrivals[x] - warm_up
+                            checkout[row] = now - warm_up
+                            departments[row] = routes[x]
+                        event_count += 1
+                        los = (sample_los() if times_in_bed is None
+                               else times_in_bed[x])
+                        heappush(events, (now + los, event_count,
+                                          DISCHARGE, x))
+                    elif state[x] == WAITING:
+                        # attend_hospital resumes one step later, once the
+                        # condition (req | timeout | timeout) is processed
+                        due.append((ADMIT_ED, x))
+                    # otherwise this is the first request of a patient whose
+                    # priority was updated, it holds a bed until they leave
+                elif code == ADMIT_ED:
+                    state[x] = ADMITTED
+                    if arrivals[x] > warm_up:
+                        row = get_row(x + 1)
+                        q_time_col[row] = now - arrivals[x]
+                        q_time_renege_col[row] = now - arrivals[x]
+                        checkout_col[row] = now - warm_up
+                        reneged_col[row] = 0
+                    event_count += 1
+                    los = (sample_los() if times_in_bed is None
+                           else times_in_bed[x])
+                    heappush(events, (now + los, event_count,
+                                      DISCHARGE, x))
+                elif priority_updates[x] < renege_times[x]:
+                    # ED_RESUME after deterioration - request another bed with
+                    # the new priority
+                    state[x] = DETERIORATED
+                    request_count += 1
+                    heappush(queue, (priorities[x] - 2.2, now, request_count,
+                                     n + x))
+                    queue_length += 1
+                    queued[ED_ROUTE] += 1
+                    if beds_in_use < capacity:
+                        while queue and cancelled[queue[0][3]]:
+                            heappop(queue)
+                        req = heappop(queue)[3]
+                        queue_length -= 1
+                        granted[req] = True
+                        beds_in_use += 1
+                        queued[request_routes[req]] -= 1
+                        in_use[request_routes[req]] += 1
+                        due.append((GRANTED, req))
+                else:
+                    # ED_RESUME after the patient improves enough to leave
+                    # the queue
+                    state[x] = RENEGED
+                    if arrivals[x] > warm_up:
+                        row = get_row(x + 1)
+                        reneged_col[row] = 1
+                        q_time_renege_col[row] = now - arrivals[x]
+                        checkout_col[row] = now - warm_up
+                    # cancel and release their request
+                    cancelled[x] = True
+                    queue_length -= 1
+                    queued[ED_ROUTE] -= 1
+                    if queue_length:
+                        due.append((TRIGGER, None))
+            elif next_arrival < n and (
+                    not events or arrivals[next_arrival] <= events[0][0]):
+                now = arrivals[next_arrival]
+                while next_sample < now:
+                    monitor.record(in_use, queued)
+                    next_sample = monitor.next_time
+                # Patients arriving at the same time all request a bed before
+                # anything else happens (simpy processes them as urgent)
+                while next_arrival < n and arrivals[next_arrival] == now:
+                    p = next_arrival
+                    next_arrival += 1
+                    processed += 1
+                    if routes[p] == ED_ROUTE and now > warm_up:
+                        row = get_row(p + 1)
+                        dta_col[row] = now - warm_up
+                        initial_priority_col[row] = priorities[p]
+                        departments[row] = ED_ROUTE
+                    request_count += 1
+                    heappush(queue, (priorities[p], now, request_count, p))
+                    queue_length += 1
+                    queued[routes[p]] += 1
+                    if beds_in_use < capacity:
+                        while queue and cancelled[queue[0][3]]:
+                            heappop(queue)
+                        req = heappop(queue)[3]
+                        queue_length -= 1
+                        granted[req] = True
+                        beds_in_use += 1
+                        queued[request_routes[req]] -= 1
+                        in_use[request_routes[req]] += 1
+                        due.append((GRANTED, req))
+                    if routes[p] == ED_ROUTE and not granted[p]:
+                        event_count += 1
+                        heappush(events, (now + min(renege_times[p],
+                                                    priority_updates[p]),
+                                          event_count, ED_TIMEOUT, p))
+                continue
+            elif events and events[0][0] < end_time:
+                now, _, code, p = heappop(events)
+                while next_sample < now:
+                    monitor.record(in_use, queued)
+                    next_sample = monitor.next_time
+                if code == DISCHARGE:
+                    if routes[p] == ED_ROUTE and state[p] == DETERIORATED:
+                        # leave the inner 'with' block (release the second
+                        # request) then the outer one (cancel and release the
+                        # first)
+                        beds_in_use -= 1
+                        in_use[ED_ROUTE] -= 1
+                        if queue_length:
+                            due.append((TRIGGER, None))
+                        if not granted[p] and not cancelled[p]:
+                            cancelled[p] = True
+                            queue_length -= 1
+                            queued[ED_ROUTE] -= 1
+                    if granted[p]:
+                        beds_in_use -= 1
+                        in_use[routes[p]] -= 1
+                    # (if the queue is empty there is nothing to offer the
+                    # bed to, and nothing can join it before the release is
+                    # processed)
+                    if queue_length:
+                        due.append((TRIGGER, None))
+                elif state[p] == WAITING and not granted[p]:
+                    # ED_TIMEOUT, stale if the patient already has a bed.
+                    # attend_hospital resumes one step later, once the
+                    # condition has been processed
+                    due.append((ED_RESUME, p))
+            else:
+                break
+            processed += 1
+
+        # nothing changes between the last event and the end of the run
+        while next_sample < end_time:
+            monitor.record(in_use, queued)
+            next_sample = monitor.next_time
+
+        self.now = end_time
+        self.patient_counter = n
+        self.beds_in_use = beds_in_use
+        self.queue_length = queue_length
+        self.events_processed += processed
+
+        if capture_snapshot:
+            self.snapshot = self.make_snapshot(
+                arrivals[:next_arrival], routes, renege_times, priorities,
+                priority_updates, times_in_bed, state, granted, cancelled,
+                queue, events)
+
+    # Snapshot of the model at the end of the run. Patients are only kept if
+    # they are still in a bed (a discharge is pending) or in the queue.
+    # Times are relative to the end of the run, so it is time 0 for a model
+    # started from the snapshot.
+    def make_snapshot(self, arrivals, routes, renege_times, priorities,
+                      priority_updates, times_in_bed, state, granted,
+                      cancelled, queue, events):
+        n = len(state)
+        end_time = self.end_time
+        discharge_in = {}
+        timeout_in = {}
+        for t, _, code, p in events:
+            if code == DISCHARGE:
+                discharge_in[p] = t - end_time
+            elif state[p] == WAITING and not granted[p]:
+                # (other timeouts are stale)
+                timeout_in[p] = t - end_time
+        live_requests = sorted(entry for entry in queue
+                               if not cancelled[entry[3]])
+        queued = {req % n for _, _, _, req in live_requests}
+
+        active = sorted(set(discharge_in) | set(timeout_in) | queued)
+        index = {p: i for i, p in enumerate(active)}
+        patients = {
+            "arrival": np.array([arrivals[p] - end_time for p in active]),
+            "route": np.array([routes[p] for p in active], dtype=np.int64),
+            "renege_time": np.array([renege_times[p] for p in active]),
+            "priority": np.array([priorities[p] for p in active]),
+            "priority_update": np.array([priority_updates[p]
+                                         for p in active]),
+            # (only drawn up front with common random numbers)
+            "time_in_bed": np.array([times_in_bed[p] if times_in_bed is not None
+                                     else np.nan for p in active]),
+            "state": np.array([state[p] for p in active], dtype=np.int8),
+            "granted_first": np.array([granted[p] for p in active]),
+            "granted_second": np.array([granted[n + p] for p in active]),
+            "cancelled_first": np.array([cancelled[p] for p in active]),
+            "discharge_in": np.array([discharge_in.get(p, np.nan)
+                                      for p in active]),
+            "timeout_in": np.array([timeout_in.get(p, np.nan)
+                                    for p in active])}
+        queue_entries = tuple((priority, request_time - end_time,
+                               index[req % n], req >= n)
+                              for priority, request_time, _, req
+                              in live_requests)
+
+        rng_states = {stream: getattr(self, attribute).dist.rng.bit_generator.state
+                      for stream, attribute in SAMPLERS.items()}
+        time_so_far = end_time
+        if self.snapshot is not None:
+            time_so_far += self.snapshot.time
+
+        return Snapshot(scenario=self.scenario,
+                        run_number=self.run_number,
+                        time=time_so_far,
+                        patients=patients,
+                        queue=queue_entries,
+                        beds_in_use=self.beds_in_use,
+                        queue_length=self.queue_length,
+                        next_arrivals=tuple(t - end_time
+                                            for t in self.next_arrivals),
+                        rng_states=rng_states)
+
+    def run(self):
+        with profile_phase(self.profile, "Simulate"):
+            self.run_events()
+        if self.profile is not None:
+            self.profile.events = self.events_processed
+
+        with profile_phase(self.profile, "Run Results"):
+            self.results_df = self.recorder.to_dataframe()
+            self.calculate_run_results()
+
+        return (self.results_df)
+
+# Takes a snapshot of run_number of a scenario at the end of its warm up
+# period. Up to then the run is exactly the same as a full run of the
+# scenario, so starting from the snapshot (with no further warm up) is the
+# same as running the full warm up, other than the random numbers used after
+# the warm up.
+def take_snapshot(scenario, run_number):
+    model = FastModel(run_number, scenario.replace(sim_duration=0))
+    model.run_events(capture_snapshot=True)
+    return model.snapshot
+
+# Validates FastModel against the SimPy Model: runs both engines for the same
+# scenario and run numbers and returns their run results side by side, along
+# with how long each run took. 'identical' is True when every metric matches.
+def compare_engines(scenario=None, run_numbers=range(3)):
+    rows = []
+    for run in run_numbers:
+        results = {}
+        for engine, model_class in [("simpy", Model), ("fast", FastModel)]:
+            start_time = time.perf_counter()
+            model = model_class(run, scenario)
+            patient_level_results = model.run()
+            elapsed_time = time.perf_counter() - start_time
+            results[engine] = (model.get_run_results(), patient_level_results,
+                               elapsed_time)
+
+        simpy_results, simpy_patients, simpy_time = results["simpy"]
+        fast_results, fast_patients, fast_time = results["fast"]
+        rows.append({"Run Number": run,
+                     "identical": (simpy_results == fast_results
+                                   and simpy_patients.equals(fast_patients)),
+                     "SimPy Time (s)": simpy_time,
+                     "Fast Time (s)": fast_time,
+                     "Speed Up": simpy_time / fast_time,
+                     "SimPy Mean Q Time Bed": simpy_results[1],
+                     "Fast Mean Q Time Bed": fast_results[1],
+                     "SimPy Reneged": simpy_results[-1],
+                     "Fast Reneged": fast_results[-1]})
+
+    return pd.DataFrame(rows).set_index("Run Number")
@@ -0,0 +1,191 @@
+import itertools
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+try:
+    from .des_classes1 import Trial
+except ImportError: # imported from inside the app folder
+    from des_classes1 import Trial
+
+# Raised from a job's progress callback to stop its trial
+class JobCancelled(Exception):
+    pass
+
+# A trial of one scenario run in the background by a JobQueue. status is one
+# of "queued", "running", "done", "cancelled" or "failed"; runs_done and
+# total_runs are updated after every run (total_runs is the most there will
+# be, a sequential trial can stop sooner). Once it is done, trial is the Trial
+# that was run, and if it failed, error is the exception.
+class Job:
+    def __init__(self, job_id, scenario, owner=None, **trial_kwargs):
+        self.job_id = job_id
+        self.scenario = scenario
+        self.owner = owner
+        self.trial_kwargs = trial_kwargs
+        self.status = "queued"
+        self.runs_done = 0
+        self.total_runs = scenario.number_of_runs
+        self.trial = None
+        self.error = None
+        self.from_cache = False
+        self.submitted_time = time.time()
+        self.finished_time = None
+        self.cancel_requested = threading.Event()
+        # held while the status changes
+        self.lock = threading.Lock()
+
+    @property
+    def finished(self):
+        return self.status in ("done", "cancelled", "failed")
+
+    # Fraction of the runs done, for a progress bar
+    @property
+    def progress(self):
+        if self.status == "done":
+            return 1.0
+        return self.runs_done / self.total_runs if self.total_runs else 0.0
+
+    # Stops the job before its next run finishes (runs already running in a
+    # worker are left to finish, as a process can't be interrupted safely).
+    # A job that hasn't started is cancelled straight away.
+    def cancel(self):
+        with self.lock:
+            self.cancel_requested.set()
+            if self.status == "queued":
+                self.finish("cancelled")
+
+    # Marks the job as started, unless it has been cancelled. Returns whether
+    # it should run.
+    def start(self):
+        with self.lock:
+            if self.cancel_requested.is_set():
+                return False
+            self.status = "running"
+            return True
+
+    def finish(self, status):
+        self.finished_time = time.time()
+        self.status = status
+
+    # Called by the trial after every run
+    def update_progress(self, runs_done, total_runs):
+        self.runs_done = runs_done
+        self.total_runs = total_runs
+        if self.cancel_requested.is_set():
+            raise JobCancelled()
+
+# Runs trials in the background so the app stays responsive: the script that
+# submits a job returns straight away, and the job carries on across reruns of
+# the script (it is only held by the queue's registry, by job_id).
+#
+# One queue is shared by every session, so every user's runs go to a single
+# pool of n_workers worker processes and at most max_running_jobs trials run
+# at a time; the rest wait in the order they were submitted. Each trial is
+# driven by a thread that hands its runs to the pool and collects the results
+# (the threads only wait on the workers, so don't hold up the web server).
+#
+# With a result_cache (a result_cache.ResultCache) a scenario that has been
+# run before finishes as soon as it is submitted, and finished trials are
+# added to it. Finished jobs are dropped from the registry keep_finished
+# seconds after they finish.
+class JobQueue:
+    def __init__(self, result_cache=None, n_workers=None, max_running_jobs=2,
+                 keep_finished=60 * 60):
+        self.result_cache = result_cache
+        self.n_workers = n_workers or os.cpu_count() or 1
+        self.max_running_jobs = max_running_jobs
+        self.keep_finished = keep_finished
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.job_ids = itertools.count(1)
+        self.runner = ThreadPoolExecutor(max_workers=max_running_jobs,
+                                         thread_name_prefix="job")
+        # made when the first job needs it
+        self.pool = None
+
+    def get_pool(self):
+        with self.lock:
+            if self.pool is None and self.n_workers > 1:
+                self.pool = ProcessPoolExecutor(max_workers=self.n_workers)
+            return self.pool
+
+    # Queues a trial of the scenario and returns its Job. trial_kwargs are
+    # passed to Trial; owner identifies who submitted it (e.g. a session).
+    def submit(self, scenario, owner=None, **trial_kwargs):
+        self.prune()
+        job = Job(str(next(self.job_ids)), scenario, owner, **trial_kwargs)
+        with self.lock:
+            self.jobs[job.job_id] = job
+
+        if self.result_cache is not None:
+            trial = self.result_cache.get(
+                self.result_cache.trial_key(scenario, **trial_kwargs))
+            if trial is not None:
+                job.trial = trial
+                job.runs_done = job.total_runs = trial.n_runs
+                job.from_cache = True
+                job.finish("done")
+                return job
+
+        self.runner.submit(self.run_job, job)
+        return job
+
+    def run_job(self, job):
+        if not job.start():
+            return
+        try:
+            trial = Trial(job.scenario, parallel=self.n_workers > 1,
+                          n_workers=self.n_workers, **job.trial_kwargs)
+            trial.run_trial(progress=job.update_progress,
+                            pool=self.get_pool())
+        except JobCancelled:
+            job.finish("cancelled")
+            return
+        except Exception as error:
+            job.error = error
+            job.finish("failed")
+            return
+
+        if self.result_cache is not None:
+            self.result_cache.put(
+                self.result_cache.trial_key(job.scenario, **job.trial_kwargs),
+                trial)
+        job.trial = trial
+        job.finish("done")
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    # Jobs (of owner, or everyone's) in the order they were submitted
+    def list_jobs(self, owner=None):
+        with self.lock:
+            return [job for job in self.jobs.values()
+                    if owner is None or job.owner == owner]
+
+    # Number of jobs submitted before job that haven't started yet, plus
+    # those running (0 if job is running or finished)
+    def jobs_ahead(self, job):
+        if job.status != "queued":
+            return 0
+        return sum(1 for other in self.list_jobs()
+                   if not other.finished and other is not job
+                   and int(other.job_id) < int(job.job_id))
+
+    # Drops finished jobs older than keep_finished
+    def prune(self):
+        cutoff = time.time() - self.keep_finished
+        with self.lock:
+            for job_id in [job_id for job_id, job in self.jobs.items()
+                           if job.finished and job.finished_time < cutoff]:
+                del self.jobs[job_id]
+
+    # Cancels every job and stops the workers
+    def shutdown(self):
+        for job in self.list_jobs():
+            job.cancel()
+        self.runner.shutdown(wait=True)
+        if self.pool is not None:
+            self.pool.shutdown(wait=True)
@@ -0,0 +1,119 @@
+from array import array
+
+import numpy as np
+import pandas as pd
+
+try:
+    from .recorder import DEPARTMENTS
+except ImportError: # imported from inside the app folder
+    from recorder import DEPARTMENTS
+
+DEFAULT_MONITOR_INTERVAL = 60 # minutes
+
+# Percentiles of the bands worked out by percentile_bands
+DEFAULT_PERCENTILES = (5, 25, 50, 75, 95)
+
+# Samples the state of the bed pool every interval minutes through a run
+# (from time 0, so including the warm up period): the beds in use and the
+# requests queuing for a bed, by department (in the order of DEPARTMENTS).
+# start_time is the time of the first sample, for a run that doesn't start
+# from empty (see FastModel).
+# Samples are appended to typed arrays of 32 bit ints, one value per
+# department, which is much quicker than writing into NumPy arrays a sample
+# at a time. beds_by_department and queue_by_department give them as NumPy
+# arrays with a row per department.
+class BedMonitor:
+    def __init__(self, end_time, interval=DEFAULT_MONITOR_INTERVAL,
+                 start_time=0):
+        self.interval = interval
+        self.n_samples = int(np.ceil(end_time / interval))
+        self.times = start_time + np.arange(self.n_samples) * interval
+        self.beds_data = array("i")
+        self.queue_data = array("i")
+        self.n_recorded = 0
+
+    # Time of the next sample (from the start of the run), or infinity once
+    # every sample has been taken. A python float, as it is compared against
+    # every event in FastModel.
+    @property
+    def next_time(self):
+        if self.n_recorded == self.n_samples:
+            return float("inf")
+        return float(self.n_recorded * self.interval)
+
+    # Beds in use and queue length for each department at the next sample
+    def record(self, beds_in_use, queue_length):
+        self.beds_data.extend(beds_in_use)
+        self.queue_data.extend(queue_length)
+        self.n_recorded += 1
+
+    # Samples not taken yet are 0
+    def by_department(self, data):
+        values = np.zeros((self.n_samples, len(DEPARTMENTS)), dtype=np.int32)
+        values[:self.n_recorded] = np.frombuffer(
+            data, dtype=np.int32).reshape(-1, len(DEPARTMENTS))
+        return values.T
+
+    @property
+    def beds_by_department(self):
+        return self.by_department(self.beds_data)
+
+    @property
+    def queue_by_department(self):
+        return self.by_department(self.queue_data)
+
+    # Totals over all departments
+    @property
+    def beds_in_use(self):
+        return self.beds_by_department.sum(axis=0)
+
+    @property
+    def queue_length(self):
+        return self.queue_by_department.sum(axis=0)
+
+    # Names of the series in to_dataframe (and accepted by series)
+    @staticmethod
+    def series_names():
+        return (["beds_in_use", "queue_length"]
+                + [f"beds_in_use {d}" for d in DEPARTMENTS]
+                + [f"queue_length {d}" for d in DEPARTMENTS])
+
+    def series(self, name):
+        total, _, department = name.partition(" ")
+        if not department:
+            return getattr(self, total)
+        by_department = (self.beds_by_department if total == "beds_in_use"
+                         else self.queue_by_department)
+        return by_department[DEPARTMENTS.index(department)]
+
+    def to_dataframe(self):
+        return pd.DataFrame({name: self.series(name)
+                             for name in self.series_names()},
+                            index=pd.Index(self.times, name="time"))
+
+# Percentiles across runs of monitor series at every sample time, from a list
+# of BedMonitors. One column per series and percentile (a MultiIndex of
+# (series, percentile)), indexed by time. Runs are matched up by time, so
+# runs that started from a snapshot (and so have no samples for the earlier
+# part of the warm up) only count where they have samples.
+def percentile_bands(monitors, series=("beds_in_use", "queue_length"),
+                     percentiles=DEFAULT_PERCENTILES):
+    same_times = all(len(m.times) == len(monitors[0].times)
+                     and m.times[0] == monitors[0].times[0]
+                     for m in monitors)
+    times = (monitors[0].times if same_times
+             else np.unique(np.concatenate([m.times for m in monitors])))
+
+    bands = {}
+    for name in series:
+        if same_times:
+            values = np.stack([m.series(name) for m in monitors]).astype(float)
+        else:
+            values = np.full((len(monitors), len(times)), np.nan)
+            for i, m in enumerate(monitors):
+                values[i, np.searchsorted(times, m.times)] = m.series(name)
+        result = np.nanpercentile(values, percentiles, axis=0)
+        for percentile, row in zip(percentiles, result):
+            bands[(name, f"p{percentile}")] = row
+
+    return pd.DataFrame(bands, index=pd.Index(times, name="time"))
@@ -0,0 +1,225 @@
+import argparse
+import math
+
+import numpy as np
+import pandas as pd
+
+try:
+    from .des_classes1 import Scenario, Trial, SUMMARY_METRICS, metric_values
+except ImportError: # imported from inside the app folder
+    from des_classes1 import Scenario, Trial, SUMMARY_METRICS, metric_values
+
+# Parameters that can be searched: whether the target is met above or below
+# the answer ("min" for beds: the fewest beds that meet the target, "max" for
+# length of stay: the longest that still meets it), the default search range
+# (the ranges of the app's sliders) and how close the search gets
+SEARCH_PARAMETERS = {
+    "number_of_nelbeds": {"find": "min", "low": 300, "high": 500,
+                          "tolerance": 1},
+    "mean_time_in_bed": {"find": "max", "low": 100 * 60, "high": 300 * 60,
+                         "tolerance": 60},
+}
+
+# Metrics that can be targeted and whether the target is a minimum or a
+# maximum
+TARGET_METRICS = {"4hr DTA Performance (%)": "at least",
+                  "95th Percentile Q": "at most"}
+
+# Finds the fewest beds (or the longest mean length of stay) that meets a
+# target for a metric, e.g. 4hr DTA performance of at least 95%, by
+# bisection between low and high.
+#
+# Each candidate is judged on its own: it gets min_runs runs, then batch_size
+# more at a time until the 95% CI of the metric is clear of the target (or
+# max_runs is reached, when the mean decides), so candidates far from the
+# answer are settled with few runs. Candidates (and their runs) are
+# remembered, so nothing is run twice.
+#
+# Every candidate is run with the same seeds, and common_random_numbers
+# (True unless given as False) replaces base_scenario's setting, so each
+# patient also has the same length of stay for every candidate. The
+# decisions aren't paired, but with the same patients the metric changes
+# smoothly from one candidate to the next, so noise is less likely to make
+# the candidates on either side of the answer disagree with each other.
+class TargetSearch:
+    def __init__(self, target, metric="4hr DTA Performance (%)",
+                 parameter="number_of_nelbeds", low=None, high=None,
+                 base_scenario=None, engine="fast", min_runs=5, max_runs=30,
+                 batch_size=5, tolerance=None, parallel=False,
+                 n_workers=None, common_random_numbers=True):
+        if metric not in TARGET_METRICS:
+            raise ValueError(f"Can't target {metric!r}, expected one of "
+                             f"{list(TARGET_METRICS)}")
+        if parameter not in SEARCH_PARAMETERS:
+            raise ValueError(f"Can't search {parameter!r}, expected one of "
+                             f"{list(SEARCH_PARAMETERS)}")
+        settings = SEARCH_PARAMETERS[parameter]
+        self.target = target
+        self.metric = metric
+        self.parameter = parameter
+        self.low = low if low is not None else settings["low"]
+        self.high = high if high is not None else settings["high"]
+        self.tolerance = (tolerance if tolerance is not None
+                          else settings["tolerance"])
+        self.base_scenario = (base_scenario if base_scenario is not None
+                              else Scenario.from_g()).replace(
+                                  common_random_numbers=common_random_numbers)
+        self.engine = engine
+        self.min_runs = min_runs
+        self.max_runs = max_runs
+        self.batch_size = batch_size
+        self.parallel = parallel
+        self.n_workers = n_workers
+        # parameter value -> metric value of each run so far
+        self.runs = {}
+        # parameter value -> whether it meets the target
+        self.decisions = {}
+        self.best = None
+
+    # The metric for each of rows (run results), as reported in the trial
+    # summary
+    def run_metrics(self, rows, columns):
+        results = pd.DataFrame(rows, columns=columns)
+        return metric_values(
+            results, {self.metric: SUMMARY_METRICS[self.metric]})[self.metric]
+
+    def meets_target(self, value):
+        if TARGET_METRICS[self.metric] == "at least":
+            return value >= self.target
+        return value <= self.target
+
+    # Mean and 95% CI (t distribution) of the metric over the runs so far
+    @staticmethod
+    def confidence_interval(values):
+        import scipy.stats as stats
+
+        mean = np.mean(values)
+        if len(values) < 2:
+            return mean, -math.inf, math.inf
+        half_width = (stats.t.ppf(0.975, len(values) - 1)
+                      * np.std(values, ddof=1) / np.sqrt(len(values)))
+        return mean, mean - half_width, mean + half_width
+
+    # Runs more runs of the candidate value until it is clear whether it
+    # meets the target. Returns True if it does.
+    def evaluate(self, value, pool=None):
+        if value in self.decisions:
+            return self.decisions[value]
+
+        scenario = self.base_scenario.replace(
+            **{self.parameter: value, "number_of_runs": self.max_runs})
+        trial = Trial(scenario, engine=self.engine, keep_patient_level=False)
+        columns = list(trial.df_trial_results.columns)
+        values = self.runs.setdefault(value, [])
+
+        while len(values) < self.max_runs:
+            n_new = self.min_runs if not values else self.batch_size
+            runs = range(len(values), min(len(values) + n_new, self.max_runs))
+            rows = [results[1] for results in trial.map_runs(runs, pool)]
+            values.extend(self.run_metrics(rows, columns).tolist())
+
+            _, lower, upper = self.confidence_interval(values)
+            if self.meets_target(lower) == self.meets_target(upper):
+                break
+
+        mean, _, _ = self.confidence_interval(values)
+        self.decisions[value] = self.meets_target(mean)
+        return self.decisions[value]
+
+    def midpoint(self, a, b):
+        if self.parameter == "number_of_nelbeds":
+            return (a + b) // 2
+        return (a + b) / 2
+
+    # Runs the search and returns the best value that meets the target, or
+    # None if even the best end of the range doesn't
+    def run(self):
+        pool_trial = Trial(self.base_scenario.replace(
+                               number_of_runs=self.max_runs),
+                           engine=self.engine, parallel=self.parallel,
+                           n_workers=self.n_workers)
+        with pool_trial.make_pool() as pool:
+            # the end of the range that is easiest to meet the target at
+            if SEARCH_PARAMETERS[self.parameter]["find"] == "min":
+                passing, failing = self.high, self.low
+            else:
+                passing, failing = self.low, self.high
+
+            if not self.evaluate(passing, pool):
+                self.best = None
+                return self.best
+            if self.evaluate(failing, pool):
+                self.best = failing
+                return self.best
+
+            while abs(passing - failing) > self.tolerance:
+                mid = self.midpoint(passing, failing)
+                if self.evaluate(mid, pool):
+                    passing = mid
+                else:
+                    failing = mid
+
+        self.best = passing
+        return self.best
+
+    # Total number of model runs used by the search
+    @property
+    def total_runs(self):
+        return sum(len(values) for values in self.runs.values())
+
+    # One row per candidate tried, in the order they were tried
+    def to_dataframe(self):
+        rows = []
+        for value, values in self.runs.items():
+            mean, lower, upper = self.confidence_interval(values)
+            rows.append({self.parameter: value,
+                         "Runs": len(values),
+                         self.metric: mean,
+                         "Lower 95% CI": lower,
+                         "Upper 95% CI": upper,
+                         "Meets Target": self.decisions.get(value)})
+        return pd.DataFrame(rows).set_index(self.parameter)
+
+
+# Command line entry point, e.g.
+#   python -m app.optimise --target 76 --parameter number_of_nelbeds
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Find the fewest beds (or longest mean length of stay) "
+                    "that meets a target")
+    parser.add_argument("--target", type=float, required=True,
+                        help="e.g. 95 for 4hr DTA performance of 95%%, or 24 "
+                             "for a 95th percentile wait of 24 hours")
+    parser.add_argument("--metric", choices=list(TARGET_METRICS),
+                        default="4hr DTA Performance (%)")
+    parser.add_argument("--parameter", choices=list(SEARCH_PARAMETERS),
+                        default="number_of_nelbeds")
+    parser.add_argument("--low", type=float, default=None)
+    parser.add_argument("--high", type=float, default=None)
+    parser.add_argument("--max-runs", type=int, default=30,
+                        help="most runs for any one candidate")
+    parser.add_argument("--parallel", action="store_true",
+                        help="spread the runs over a pool of worker processes")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="number of worker processes (default: all CPUs)")
+    args = parser.parse_args(argv)
+
+    low, high = args.low, args.high
+    if args.parameter == "number_of_nelbeds":
+        low = int(low) if low is not None else None
+        high = int(high) if high is not None else None
+
+    search = TargetSearch(args.target, args.metric, args.parameter, low, high,
+                          max_runs=args.max_runs, parallel=args.parallel,
+                          n_workers=args.workers)
+    best = search.run()
+    print(search.to_dataframe().round(2).to_string())
+    print()
+    print(f"{search.total_runs} runs in total")
+    if best is None:
+        print("The target isn't met anywhere in the range")
+    else:
+        print(f"Best {args.parameter} meeting the target: {best:g}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,30 @@
+import os
+
+APP_NAME = "nel_flow"
+
+# Per-user folders for what the app keeps between runs: the result cache
+# (pickles, which run code when they are loaded) and saved data, so nothing is
+# read from or written to a folder other users can write to. They follow the
+# XDG conventions (~/.cache/nel_flow and ~/.local/share/nel_flow, or the
+# local app data folder on Windows), and env_var, if set, overrides the
+# folder.
+def user_dir(kind, env_var):
+    path = os.environ.get(env_var)
+    if not path:
+        if os.name == "nt":
+            base = os.environ.get("LOCALAPPDATA", os.path.expanduser("~"))
+            path = os.path.join(base, APP_NAME, kind)
+        else:
+            xdg_var, default = {"cache": ("XDG_CACHE_HOME", "~/.cache"),
+                                "data": ("XDG_DATA_HOME", "~/.local/share")}[kind]
+            base = os.environ.get(xdg_var) or os.path.expanduser(default)
+            path = os.path.join(base, APP_NAME)
+    return path
+
+# Makes path (if it doesn't exist) as a folder only its owner can use, and
+# returns it. Raises PermissionError for an existing folder belonging to
+# someone else.
+def private_dir(path):
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    os.chmod(path, 0o700)
+    return path
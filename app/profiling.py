@@ -0,0 +1,112 @@
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+import pandas as pd
+
+# Phases of a run that are timed. Sampling (drawing random numbers) and
+# Recorder (writing patient results) happen during Simulate, so are part of
+# its time too; the rest of Simulate is the event loop itself (SimPy's
+# scheduling, or FastModel's).
+PHASES = ["Setup", "Simulate", "Sampling", "Recorder", "Run Results",
+          "Summarise"]
+
+# Where the time goes in one run, filled in by run_single when a trial is run
+# with profile=True: wall time per phase (seconds) and the number of events
+# processed. With profile="memory" it also records the peak memory allocated
+# during the run (bytes, from tracemalloc), but tracing every allocation makes
+# the run about three times slower, so the times are then inflated.
+#
+# Nothing is timed unless a run is profiled. Models only look at their
+# profile between phases, and the hooks inside the run (random number draws,
+# recorder writes, counting SimPy events) are wrappers put around those
+# methods of one model's objects, so unprofiled runs don't pay for them.
+class RunProfile:
+    def __init__(self, run_number, memory=False):
+        self.run_number = run_number
+        self.memory = memory
+        self.times = dict.fromkeys(PHASES, 0.0)
+        self.events = 0
+        self.peak_memory = None
+        self.tracing_memory = False
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.times[name] += time.perf_counter() - start
+
+    # func wrapped so the time spent in it is added to phase name
+    def timed(self, name, func):
+        times = self.times
+        perf_counter = time.perf_counter
+
+        def timed_func(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                times[name] += perf_counter() - start
+        return timed_func
+
+    # func wrapped so every call counts as an event
+    def counted(self, func):
+        def counted_func(*args, **kwargs):
+            self.events += 1
+            return func(*args, **kwargs)
+        return counted_func
+
+    # Peak memory is measured from here, if it is profiled (if something else
+    # is already tracing allocations, it is left to that)
+    def start_memory(self):
+        if not self.memory:
+            return
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.tracing_memory = True
+        tracemalloc.reset_peak()
+
+    def stop_memory(self):
+        if not self.memory:
+            return
+        self.peak_memory = tracemalloc.get_traced_memory()[1]
+        if self.tracing_memory:
+            tracemalloc.stop()
+            self.tracing_memory = False
+
+    @property
+    def total_time(self):
+        return sum(self.times[name] for name in PHASES
+                   if name not in ("Sampling", "Recorder"))
+
+    def to_dict(self):
+        row = {"Run Number": self.run_number}
+        row.update({f"{name} (s)": value for name, value in self.times.items()})
+        row["Total (s)"] = self.total_time
+        row["Events"] = self.events
+        simulate = self.times["Simulate"]
+        row["Events/sec"] = self.events / simulate if simulate else 0.0
+        if self.peak_memory is not None:
+            row["Peak Memory (MB)"] = self.peak_memory / 1024**2
+        return row
+
+# profile.phase(name), or nothing if profile is None (the run isn't profiled)
+def profile_phase(profile, name):
+    if profile is None:
+        return nullcontext()
+    return profile.phase(name)
+
+# One row per run profile, plus a total row (peak memory is the largest of
+# the runs)
+def profiles_to_dataframe(profiles):
+    df = pd.DataFrame([profile.to_dict() for profile in profiles])
+    df = df.set_index("Run Number")
+    total = df.sum()
+    total["Events/sec"] = (total["Events"] / total["Simulate (s)"]
+                           if total["Simulate (s)"] else 0.0)
+    if "Peak Memory (MB)" in df:
+        total["Peak Memory (MB)"] = df["Peak Memory (MB)"].max()
+    df.loc["Total"] = total
+    return df
@@ -0,0 +1,95 @@
+import numpy as np
+import pandas as pd
+
+# Columns of the patient level results, in the order they appear in the
+# results DataFrame. Everything apart from Department is stored as a float so
+# cells that are never written come out as NaN, as they did when the
+# DataFrame was enlarged one cell at a time.
+PATIENT_COLUMNS = ["InitialPriority",
+                   "UpdatedPriority",
+                   "Q Time Bed",
+                   "Q Time Bed|Renege",
+                   "dta",
+                   "checkout",
+                   "Q Time Bed SDEC",
+                   "sdec_dta",
+                   "sdec_checkout",
+                   "Q Time Bed Other",
+                   "other_dta",
+                   "other_checkout",
+                   "reneged"]
+
+DEPARTMENTS = ["ED", "SDEC", "Other"]
+
+# Records patient level results into preallocated NumPy arrays (one per
+# column) that double in size when they fill up. A patient gets a row the
+# first time anything is recorded against them, and the DataFrame is only
+# built once, at the end of the run.
+class PatientRecorder:
+    def __init__(self, initial_capacity=4096):
+        self.capacity = initial_capacity
+        self.n_rows = 0
+        # Maps patient id to row number
+        self.rows = {}
+        self.patient_ids = np.zeros(self.capacity, dtype=np.int64)
+        # Departments are stored as codes into DEPARTMENTS, -1 means not set
+        self.department_codes = np.full(self.capacity, -1, dtype=np.int8)
+        self.department_lookup = {d: i for i, d in enumerate(DEPARTMENTS)}
+        self.data = {col: np.full(self.capacity, np.nan)
+                     for col in PATIENT_COLUMNS}
+
+    # Double the size of every column array
+    def grow(self):
+        new_capacity = self.capacity * 2
+
+        patient_ids = np.zeros(new_capacity, dtype=np.int64)
+        patient_ids[:self.n_rows] = self.patient_ids[:self.n_rows]
+        self.patient_ids = patient_ids
+
+        department_codes = np.full(new_capacity, -1, dtype=np.int8)
+        department_codes[:self.n_rows] = self.department_codes[:self.n_rows]
+        self.department_codes = department_codes
+
+        for col, values in self.data.items():
+            new_values = np.full(new_capacity, np.nan)
+            new_values[:self.n_rows] = values[:self.n_rows]
+            self.data[col] = new_values
+
+        self.capacity = new_capacity
+
+    # Returns the row for a patient, adding one if this is the first time
+    # they have been seen
+    def get_row(self, patient_id):
+        row = self.rows.get(patient_id)
+        if row is None:
+            if self.n_rows == self.capacity:
+                self.grow()
+            row = self.n_rows
+            self.rows[patient_id] = row
+            self.patient_ids[row] = patient_id
+            self.n_rows += 1
+        return row
+
+    # Store a single value against a patient (the equivalent of
+    # results_df.at[patient_id, column] = value)
+    def record(self, patient_id, column, value):
+        # get the row first, it may grow (replace) the column arrays
+        row = self.get_row(patient_id)
+        self.data[column][row] = value
+
+    def record_department(self, patient_id, department):
+        self.department_codes[self.get_row(patient_id)] = (
+            self.department_lookup[department]
+        )
+
+    # Build the patient level DataFrame in one go
+    def to_dataframe(self):
+        n = self.n_rows
+        departments = np.array(DEPARTMENTS + [np.nan], dtype=object)
+        # code -1 picks up the trailing NaN
+        columns = {"Department": departments[self.department_codes[:n]]}
+        for col in PATIENT_COLUMNS:
+            columns[col] = self.data[col][:n].copy()
+        return pd.DataFrame(columns,
+                            index=pd.Index(self.patient_ids[:n].copy(),
+                                           name="Patient ID"))
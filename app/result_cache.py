@@ -0,0 +1,207 @@
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+try:
+    from .des_classes1 import MODEL_VERSION, Trial
+    from .paths import private_dir, user_dir
+except ImportError: # imported from inside the app folder
+    from des_classes1 import MODEL_VERSION, Trial
+    from paths import private_dir, user_dir
+
+# Per-user, so no one else can plant a pickle in it; set NEL_FLOW_CACHE_DIR
+# to put it somewhere else
+DEFAULT_CACHE_DIR = user_dir("cache", "NEL_FLOW_CACHE_DIR")
+
+# Trial arguments that change how a trial is run but not its results. (A
+# snapshot library only changes the results of a trial with a top_up_period,
+# which can start from whichever snapshot is nearest.)
+RUN_ONLY_KWARGS = ["parallel", "n_workers", "snapshots"]
+
+# Content addressed cache of trial results. Entries are keyed on a hash of the
+# full scenario, the seeds and the model version, so a scenario that has
+# already been run (by anyone using the same server) comes back instantly.
+#
+# There are two layers:
+#  * an in-memory LRU of pickled results, bounded by max_memory_bytes
+#  * pickle files in cache_dir, bounded by max_disk_bytes. The least recently
+#    used files (by modification time, which is refreshed on every hit) are
+#    removed first.
+# Results are stored pickled, so every get returns a fresh copy that callers
+# are free to modify.
+class ResultCache:
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR,
+                 max_memory_bytes=256 * 1024**2,
+                 max_disk_bytes=2 * 1024**3):
+        self.cache_dir = cache_dir
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.memory = OrderedDict()
+        self.memory_bytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if self.cache_dir is not None:
+            private_dir(self.cache_dir)
+
+    # A value as it goes into a key, the same in every process: functions
+    # (e.g. Trial metrics) by their module and name, objects by their
+    # cache_key(). Raises ValueError for anything else that JSON can't hold,
+    # or a function that can't be found by name (a lambda or nested
+    # function), rather than keying on a repr that can change between runs.
+    @classmethod
+    def key_value(cls, value):
+        if value is None or isinstance(value, (bool, int, float, str)):
+            return value
+        if isinstance(value, np.generic):
+            return value.item()
+        if isinstance(value, (list, tuple)):
+            return [cls.key_value(item) for item in value]
+        if isinstance(value, dict):
+            return {str(name): cls.key_value(item) for name, item in value.items()}
+        if hasattr(value, "cache_key"):
+            return {"type": type(value).__qualname__, "key": value.cache_key()}
+        if callable(value):
+            name = getattr(value, "__qualname__", "")
+            if name and "<" not in name:
+                return {"function": f"{value.__module__}.{name}"}
+        raise ValueError(f"Can't use {value!r} in a cache key")
+
+    # Key for a scenario. Anything else that changes the results (e.g. seeds)
+    # is passed as keyword arguments.
+    @classmethod
+    def make_key(cls, scenario, **extra):
+        key_data = {"model_version": MODEL_VERSION,
+                    "scenario": scenario.to_dict(),
+                    "extra": cls.key_value(extra)}
+        key_json = json.dumps(key_data, sort_keys=True)
+        return hashlib.sha256(key_json.encode("utf-8")).hexdigest()
+
+    def path_for(self, key):
+        return os.path.join(self.cache_dir, f"{key}.pkl")
+
+    # Returns the cached value for key, or None if it is not cached
+    def get(self, key):
+        with self.lock:
+            data = self.memory.get(key)
+            if data is not None:
+                self.memory.move_to_end(key)
+
+        if data is None and self.cache_dir is not None:
+            data = self.read_disk(key)
+            if data is not None:
+                self.put_memory(key, data)
+
+        with self.lock:
+            if data is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return pickle.loads(data)
+
+    def put(self, key, value):
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        self.put_memory(key, data)
+        if self.cache_dir is not None:
+            self.write_disk(key, data)
+
+    def put_memory(self, key, data):
+        if len(data) > self.max_memory_bytes:
+            return
+        with self.lock:
+            old = self.memory.pop(key, None)
+            if old is not None:
+                self.memory_bytes -= len(old)
+            self.memory[key] = data
+            self.memory_bytes += len(data)
+            # evict least recently used entries
+            while self.memory_bytes > self.max_memory_bytes:
+                _, evicted = self.memory.popitem(last=False)
+                self.memory_bytes -= len(evicted)
+
+    def read_disk(self, key):
+        path = self.path_for(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            # mark as recently used
+            os.utime(path)
+        except OSError:
+            return None
+        return data
+
+    def write_disk(self, key, data):
+        if len(data) > self.max_disk_bytes:
+            return
+        # write to a temporary file and move it into place so other processes
+        # never read a half written entry
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, self.path_for(key))
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        self.evict_disk()
+
+    # Remove the least recently used files until the cache fits in
+    # max_disk_bytes
+    def evict_disk(self):
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(".pkl"):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total_bytes = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_bytes <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total_bytes -= size
+
+    def clear(self):
+        with self.lock:
+            self.memory.clear()
+            self.memory_bytes = 0
+        if self.cache_dir is not None:
+            for entry in os.scandir(self.cache_dir):
+                if entry.name.endswith(".pkl"):
+                    os.remove(entry.path)
+
+    # Key for a trial of the scenario with trial_kwargs (passed to Trial).
+    # Apart from those in RUN_ONLY_KWARGS they are part of the key.
+    def trial_key(self, scenario, **trial_kwargs):
+        return self.make_key(scenario, **{k: v for k, v in trial_kwargs.items()
+                                          if k not in RUN_ONLY_KWARGS})
+
+    # Returns a Trial for the scenario that has been run, either from the
+    # cache or by running it now. trial_kwargs are as for trial_key.
+    def get_trial(self, scenario, **trial_kwargs):
+        key = self.trial_key(scenario, **trial_kwargs)
+        trial = self.get(key)
+        if trial is None:
+            trial = Trial(scenario, **trial_kwargs)
+            trial.run_trial()
+            self.put(key, trial)
+        return trial
+
+    # Runs a trial for the scenario, or returns the cached results if it has
+    # been run before. Returns the same (df_trial_results,
+    # all_results_patient_level, trial_summary) tuple as Trial.run_trial.
+    def run_trial(self, scenario, **trial_kwargs):
+        return self.get_trial(scenario, **trial_kwargs).get_results()
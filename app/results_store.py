@@ -0,0 +1,157 @@
+import os
+import re
+import tempfile
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+try:
+    from .recorder import DEPARTMENTS, PATIENT_COLUMNS
+except ImportError: # imported from inside the app folder
+    from recorder import DEPARTMENTS, PATIENT_COLUMNS
+
+# Compact types of the patient level columns: the run and patient ID as small
+# ints, the department as a dictionary (categorical) of int8 codes, the
+# initial priority and reneged flag as int8 and the rest as float32 (times in
+# minutes, and the updated priority, which is fractional).
+# float32 keeps times to within about a second up to the end of a 120 day
+# run. Cells that were never written are nulls rather than NaN.
+INT8_COLUMNS = ["InitialPriority", "reneged"]
+PATIENT_SCHEMA = pa.schema(
+    [("run", pa.int16()),
+     ("Patient ID", pa.int32()),
+     ("Department", pa.dictionary(pa.int8(), pa.string()))]
+    + [(col, pa.int8() if col in INT8_COLUMNS else pa.float32())
+       for col in PATIENT_COLUMNS])
+
+RUN_FILE_PATTERN = re.compile(r"run_(\d+)\.arrow$")
+# Temporary files write_run writes a run to before moving it into place
+TMP_FILE_PATTERN = re.compile(r"run_.*\.arrow\.tmp$")
+
+# The patient level results of one run (a DataFrame as returned by
+# Model.run) as an Arrow table with the PATIENT_SCHEMA types. Times are
+# rounded to 2 decimal places, as Trial does for the rows it keeps.
+def to_arrow_table(run, patient_level_results):
+    n = len(patient_level_results)
+    departments = patient_level_results["Department"]
+    codes = np.full(n, -1, dtype=np.int8)
+    for i, department in enumerate(DEPARTMENTS):
+        codes[(departments == department).to_numpy()] = i
+    arrays = [pa.array(np.full(n, run, dtype=np.int16)),
+              pa.array(patient_level_results.index.to_numpy(dtype=np.int32)),
+              pa.DictionaryArray.from_arrays(
+                  pa.array(codes, mask=codes < 0),
+                  pa.array(DEPARTMENTS, pa.string()))]
+    for col in PATIENT_COLUMNS:
+        values = patient_level_results[col].to_numpy(dtype=np.float64)
+        missing = np.isnan(values)
+        if col in INT8_COLUMNS:
+            values = np.where(missing, 0, values).astype(np.int8)
+        else:
+            values = np.round(values, 2).astype(np.float32)
+        arrays.append(pa.array(values, mask=missing))
+    return pa.Table.from_arrays(arrays, schema=PATIENT_SCHEMA)
+
+# Converts a table of patient level results back to a DataFrame indexed by
+# Patient ID, keeping the compact types (Department is categorical, the int8
+# columns are nullable Int8)
+def to_dataframe(table):
+    df = table.to_pandas(types_mapper={pa.int8(): pd.Int8Dtype()}.get)
+    return df.set_index("Patient ID") if "Patient ID" in df else df
+
+# Stores trial results on disk, one Arrow IPC file per run in directory, so
+# runs are written as they finish (by whichever process ran them) and a
+# trial far bigger than memory can be kept. Pass one to
+# Trial(..., results_store=...).
+#
+# The files are uncompressed so they can be read back memory-mapped:
+# read_table returns Arrow columns that point straight at the files, and
+# nothing is copied into memory until it is used (to_dataframe, or e.g.
+# pyarrow.compute on a column). to_parquet writes everything to one
+# compressed Parquet file for sharing.
+class PatientResultsStore:
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def __repr__(self):
+        return f"PatientResultsStore({self.directory!r})"
+
+    # Trials writing to different directories are cached separately
+    # (see ResultCache.key_value)
+    def cache_key(self):
+        return os.path.abspath(self.directory)
+
+    def path_for(self, run):
+        return os.path.join(self.directory, f"run_{run:05d}.arrow")
+
+    # Writes the patient level results of a run (replacing any earlier ones)
+    def write_run(self, run, patient_level_results):
+        table = to_arrow_table(run, patient_level_results)
+        # write to a temporary file and move it into place so readers never
+        # see a half written run
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix="run_",
+                                        suffix=".arrow.tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                with pa.ipc.new_file(f, PATIENT_SCHEMA) as writer:
+                    writer.write_table(table)
+            os.replace(tmp_path, self.path_for(run))
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    # Run numbers that have been written, in order
+    def runs(self):
+        runs = []
+        for name in os.listdir(self.directory):
+            match = RUN_FILE_PATTERN.match(name)
+            if match:
+                runs.append(int(match.group(1)))
+        return sorted(runs)
+
+    # The results of runs (all of them if None) as one memory-mapped Arrow
+    # table, with only columns if given
+    def read_table(self, columns=None, runs=None):
+        tables = []
+        for run in self.runs() if runs is None else runs:
+            with pa.memory_map(self.path_for(run)) as source:
+                table = pa.ipc.open_file(source).read_all()
+            tables.append(table.select(columns) if columns is not None
+                          else table)
+        if not tables:
+            schema = PATIENT_SCHEMA
+            if columns is not None:
+                schema = pa.schema([schema.field(col) for col in columns])
+            return schema.empty_table()
+        return pa.concat_tables(tables)
+
+    # As read_table, as a DataFrame (this loads the columns into memory)
+    def to_dataframe(self, columns=None, runs=None):
+        if columns is not None and "Patient ID" not in columns:
+            columns = ["Patient ID"] + list(columns)
+        return to_dataframe(self.read_table(columns, runs))
+
+    def to_parquet(self, path, compression="zstd"):
+        pq.write_table(self.read_table(), path, compression=compression)
+
+    # Removes the runs written so far (and any temporary files left by a
+    # write_run that was interrupted), leaving everything else in the
+    # directory alone
+    def clear(self):
+        for name in os.listdir(self.directory):
+            if RUN_FILE_PATTERN.match(name) or TMP_FILE_PATTERN.match(name):
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    pass
+
+# Reads a Parquet file written by PatientResultsStore.to_parquet, memory
+# mapped, as a DataFrame with the compact types
+def read_parquet(path, columns=None):
+    if columns is not None and "Patient ID" not in columns:
+        columns = ["Patient ID"] + list(columns)
+    return to_dataframe(pq.read_table(path, columns=columns, memory_map=True))
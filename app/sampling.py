@@ -0,0 +1,34 @@
+DEFAULT_BLOCK_SIZE = 1024
+
+# Wraps a sim_tools distribution so that variates are drawn from NumPy in
+# large blocks and handed out one at a time, instead of making one Python
+# level RNG call per variate. A new block is only drawn when the current one
+# runs out.
+#
+# NumPy generators produce the same stream whether values are drawn one at a
+# time or in blocks, so for a given seed the model sees exactly the same
+# sequence of values as calling dist.sample() each time.
+class BatchSampler:
+    def __init__(self, dist, block_size=DEFAULT_BLOCK_SIZE, transform=None):
+        self.dist = dist
+        self.block_size = block_size
+        # optional vectorised function applied to each block (e.g. np.rint)
+        self.transform = transform
+        self.block = []
+        self.position = 0
+
+    def refill(self):
+        block = self.dist.sample(size=self.block_size)
+        if self.transform is not None:
+            block = self.transform(block)
+        # python floats are quicker to hand out and do arithmetic on than
+        # NumPy scalars
+        self.block = block.tolist()
+        self.position = 0
+
+    def sample(self):
+        if self.position == len(self.block):
+            self.refill()
+        value = self.block[self.position]
+        self.position += 1
+        return value
@@ -0,0 +1,240 @@
+import os
+import sqlite3
+import time
+from contextlib import closing
+from dataclasses import fields
+
+import pandas as pd
+
+try:
+    from .des_classes1 import MODEL_VERSION, Scenario
+    from .paths import private_dir, user_dir
+except ImportError: # imported from inside the app folder
+    from des_classes1 import MODEL_VERSION, Scenario
+    from paths import private_dir, user_dir
+
+# Where the store is kept unless another path is given: in the user's data
+# folder (~/.local/share/nel_flow, or NEL_FLOW_DATA_DIR if it is set), which
+# is kept across reboots and only they can write to
+def default_store_path():
+    return os.path.join(private_dir(user_dir("data", "NEL_FLOW_DATA_DIR")),
+                        "scenarios.db")
+
+# Scenario values, as columns of the scenarios table. Master seeds can be too
+# big for an SQLite integer so are stored as text.
+SCENARIO_COLUMNS = {f.name: ("TEXT" if f.name == "master_seed"
+                             else {int: "INTEGER", float: "REAL",
+                                   bool: "INTEGER"}[f.type])
+                    for f in fields(Scenario)}
+
+# Columns of a trial summary and the names they are stored under
+SUMMARY_COLUMNS = {"Mean": "mean", "St. dev": "st_dev", "St. error": "st_error",
+                   "Lower 95% CI": "lower_ci", "Upper 95% CI": "upper_ci",
+                   "Min": "min", "Max": "max"}
+
+# Scenario values the scenarios can be filtered on (see query), and that are
+# indexed
+FILTER_COLUMNS = ["number_of_nelbeds", "mean_time_in_bed", "ed_inter_visit",
+                  "sdec_inter_visit", "other_inter_visit"]
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS scenarios (
+    scenario_id INTEGER PRIMARY KEY,
+    created REAL NOT NULL,
+    label TEXT,
+    owner TEXT,
+    engine TEXT,
+    model_version INTEGER,
+    n_runs INTEGER,
+    {", ".join(f"{name} {kind}" for name, kind in SCENARIO_COLUMNS.items())}
+);
+CREATE INDEX IF NOT EXISTS scenarios_created ON scenarios (created);
+CREATE INDEX IF NOT EXISTS scenarios_owner ON scenarios (owner, created);
+CREATE INDEX IF NOT EXISTS scenarios_parameters
+    ON scenarios ({", ".join(FILTER_COLUMNS)});
+CREATE TABLE IF NOT EXISTS summaries (
+    scenario_id INTEGER NOT NULL REFERENCES scenarios ON DELETE CASCADE,
+    metric TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    {", ".join(f"{name} REAL" for name in SUMMARY_COLUMNS.values())},
+    PRIMARY KEY (scenario_id, metric)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS run_results (
+    scenario_id INTEGER NOT NULL REFERENCES scenarios ON DELETE CASCADE,
+    run INTEGER NOT NULL,
+    result TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    value REAL,
+    PRIMARY KEY (scenario_id, run, result)
+) WITHOUT ROWID;
+"""
+
+# Keeps the scenarios that have been run (their values, trial summary and run
+# by run results) in an SQLite database, so they outlast the session and can
+# be searched and paged through without loading them all.
+#
+# Every method opens its own connection, so one store can be shared by every
+# session of the app (each runs in its own thread).
+class ScenarioStore:
+    def __init__(self, path=None):
+        self.path = path if path is not None else default_store_path()
+        with closing(self.connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+
+    def connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA foreign_keys=ON")
+        return conn
+
+    # Adds a trial that has been run and returns its scenario_id. label is a
+    # name to show for it and owner who ran it (e.g. a session).
+    def add(self, trial, label=None, owner=None):
+        df_trial_results, _, trial_summary = trial.get_results()
+        values = trial.scenario.to_dict()
+        row = {"created": time.time(), "label": label, "owner": owner,
+               "engine": trial.engine, "model_version": MODEL_VERSION,
+               "n_runs": trial.n_runs}
+        row.update({name: (None if values[name] is None else str(values[name]))
+                    if name == "master_seed" else values[name]
+                    for name in SCENARIO_COLUMNS})
+
+        # (positions keep the metrics and results in the order Trial has them)
+        summary_rows = [
+            (metric, position)
+            + tuple(float(summary[col]) for col in SUMMARY_COLUMNS)
+            for position, (metric, summary)
+            in enumerate(trial_summary.iterrows())]
+        results = df_trial_results.iloc[:trial.n_runs]
+        run_rows = [(int(run), result, position, float(value))
+                    for position, result in enumerate(results.columns)
+                    for run, value in results[result].items()]
+
+        with closing(self.connect()) as conn, conn:
+            cursor = conn.execute(
+                f"INSERT INTO scenarios ({', '.join(row)}) "
+                f"VALUES ({', '.join('?' * len(row))})", list(row.values()))
+            scenario_id = cursor.lastrowid
+            conn.executemany(
+                f"INSERT INTO summaries VALUES "
+                f"(?, {', '.join('?' * (len(SUMMARY_COLUMNS) + 2))})",
+                [(scenario_id,) + summary_row for summary_row in summary_rows])
+            conn.executemany("INSERT INTO run_results VALUES (?, ?, ?, ?, ?)",
+                             [(scenario_id,) + run_row for run_row in run_rows])
+        return scenario_id
+
+    # SQL condition and parameters for the filters (see query)
+    @staticmethod
+    def where(owner=None, **filters):
+        conditions = []
+        params = []
+        if owner is not None:
+            conditions.append("owner = ?")
+            params.append(owner)
+        for name, value in filters.items():
+            if name not in FILTER_COLUMNS:
+                raise ValueError(f"Can't filter on {name!r}, expected one of "
+                                 f"{FILTER_COLUMNS}")
+            if isinstance(value, tuple):
+                low, high = value
+                if low is not None:
+                    conditions.append(f"{name} >= ?")
+                    params.append(low)
+                if high is not None:
+                    conditions.append(f"{name} <= ?")
+                    params.append(high)
+            else:
+                conditions.append(f"{name} = ?")
+                params.append(value)
+        sql = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        return sql, params
+
+    # Number of scenarios matching the filters (see query)
+    def count(self, owner=None, **filters):
+        where, params = self.where(owner, **filters)
+        with closing(self.connect()) as conn:
+            return conn.execute(f"SELECT COUNT(*) FROM scenarios {where}",
+                                params).fetchone()[0]
+
+    # The id of the newest scenario (0 if there are none), which changes
+    # whenever one is added
+    def latest_id(self):
+        with closing(self.connect()) as conn:
+            return conn.execute(
+                "SELECT COALESCE(MAX(scenario_id), 0) FROM scenarios"
+            ).fetchone()[0]
+
+    # A page of the scenarios, newest first, one row per scenario indexed by
+    # scenario_id. filters are scenario values (FILTER_COLUMNS), each either
+    # a value or a (low, high) range where either end can be None; owner only
+    # returns the scenarios they added. With metrics, the mean of each of
+    # those summary metrics is added as a column.
+    def query(self, owner=None, limit=50, offset=0, metrics=(), **filters):
+        where, params = self.where(owner, **filters)
+        with closing(self.connect()) as conn:
+            scenarios = pd.read_sql_query(
+                f"SELECT * FROM scenarios {where} "
+                f"ORDER BY created DESC, scenario_id DESC LIMIT ? OFFSET ?",
+                conn, params=params + [limit, offset],
+                index_col="scenario_id")
+            if metrics and len(scenarios):
+                means = self.read_summaries(conn, scenarios.index, metrics)
+                scenarios = scenarios.join(means["mean"].unstack("metric"))
+        return scenarios
+
+    @staticmethod
+    def read_summaries(conn, scenario_ids, metrics=None):
+        ids = [int(i) for i in scenario_ids]
+        sql = (f"SELECT * FROM summaries WHERE scenario_id IN "
+               f"({', '.join('?' * len(ids))})")
+        params = ids
+        if metrics is not None:
+            sql += f" AND metric IN ({', '.join('?' * len(metrics))})"
+            params = ids + list(metrics)
+        sql += " ORDER BY scenario_id, position"
+        summaries = pd.read_sql_query(sql, conn, params=params,
+                                      index_col=["scenario_id", "metric"])
+        return summaries.drop(columns="position")
+
+    # The trial summary of a scenario, as Trial.calculate_trial_summary
+    # returns it
+    def summary(self, scenario_id):
+        with closing(self.connect()) as conn:
+            summary = self.read_summaries(conn, [scenario_id])
+        summary = summary.droplevel("scenario_id")
+        summary.columns = list(SUMMARY_COLUMNS)
+        summary.index.name = "Metric"
+        return summary
+
+    # The run by run results of a scenario, as Trial.df_trial_results
+    def run_results(self, scenario_id):
+        with closing(self.connect()) as conn:
+            rows = pd.read_sql_query(
+                "SELECT run, result, value FROM run_results "
+                "WHERE scenario_id = ? ORDER BY position, run", conn,
+                params=[int(scenario_id)])
+        results = rows.pivot(index="run", columns="result", values="value")
+        results = results[rows["result"].unique()]
+        results.index.name = "Run Number"
+        results.columns.name = None
+        return results
+
+    # The scenario's values, as a Scenario
+    def scenario(self, scenario_id):
+        with closing(self.connect()) as conn:
+            row = conn.execute(
+                f"SELECT {', '.join(SCENARIO_COLUMNS)} FROM scenarios "
+                f"WHERE scenario_id = ?", [int(scenario_id)]).fetchone()
+        if row is None:
+            raise KeyError(scenario_id)
+        values = dict(zip(SCENARIO_COLUMNS, row))
+        if values["master_seed"] is not None:
+            values["master_seed"] = int(values["master_seed"])
+        values["common_random_numbers"] = bool(values["common_random_numbers"])
+        return Scenario(**values)
+
+    def delete(self, scenario_ids):
+        ids = [int(i) for i in scenario_ids]
+        with closing(self.connect()) as conn, conn:
+            conn.execute(f"DELETE FROM scenarios WHERE scenario_id IN "
+                         f"({', '.join('?' * len(ids))})", ids)
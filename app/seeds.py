@@ -0,0 +1,42 @@
+import numpy as np
+
+# The random streams used by a single run of the model. Each run gets its
+# own child of the master SeedSequence and each stream gets its own child of
+# the run's SeedSequence, so no two streams (in the same run or across runs)
+# share a seed. Streams are matched to children by position, so only ever add
+# new streams to the end of this list or existing results will change.
+STREAMS = ["ed_inter_visit",
+           "sdec_inter_visit",
+           "other_inter_visit",
+           "time_in_bed",
+           "renege_time",
+           "priority_update",
+           "priority",
+           "sdec_time_in_bed",
+           "other_time_in_bed"]
+
+# Hands out independent seeds for every run and stream from one master seed.
+# If no master seed is given one is drawn from the OS; either way it is kept
+# in master_seed so the trial can be recorded and replayed exactly.
+class SeedManager:
+    def __init__(self, master_seed=None):
+        self.seed_sequence = np.random.SeedSequence(master_seed)
+        self.master_seed = self.seed_sequence.entropy
+
+    # SeedSequence for a run. This is the same as the run_number'th child of
+    # self.seed_sequence.spawn(), but can be created without spawning all the
+    # runs before it (e.g. in a worker process).
+    def run_seed_sequence(self, run_number):
+        return np.random.SeedSequence(
+            self.master_seed,
+            spawn_key=self.seed_sequence.spawn_key + (run_number,))
+
+    # Dictionary of stream name -> SeedSequence for a run. These can be passed
+    # straight to np.random.default_rng (or a sim_tools distribution).
+    def run_seeds(self, run_number):
+        children = self.run_seed_sequence(run_number).spawn(len(STREAMS))
+        return dict(zip(STREAMS, children))
+
+# Creates a new master seed from OS entropy
+def new_master_seed():
+    return np.random.SeedSequence().entropy
@@ -0,0 +1,105 @@
+import math
+import os
+import pickle
+import tempfile
+import threading
+
+try:
+    from .fast_engine import take_snapshot
+except ImportError: # imported from inside the app folder
+    from fast_engine import take_snapshot
+
+# Scenario values that don't change the state of a model at the end of its
+# warm up, so aren't part of a snapshot's key
+NON_STATE_PARAMETERS = ["sim_duration", "number_of_runs"]
+
+# Scenario values compared when looking for the nearest snapshot
+DISTANCE_PARAMETERS = ["ed_inter_visit",
+                       "sdec_inter_visit",
+                       "other_inter_visit",
+                       "number_of_nelbeds",
+                       "mean_time_in_bed",
+                       "sd_time_in_bed"]
+
+# A library of warmed up model states (fast_engine.Snapshot), one per
+# scenario and run, so runs can skip their warm up.
+#
+# A snapshot is only an exact match for a scenario that differs in
+# NON_STATE_PARAMETERS at most (e.g. a longer run of the same scenario), and
+# starting from it is then as good as running the warm up. Other scenarios
+# can start from the nearest snapshot of the same run and seed (the smallest
+# total log ratio of DISTANCE_PARAMETERS) but need a shorter top up warm up
+# to settle into their own state.
+#
+# If path is given the library is loaded from it and save() writes it back.
+class SnapshotLibrary:
+    def __init__(self, path=None):
+        self.path = path
+        self.snapshots = {}
+        self.lock = threading.Lock()
+        if path is not None and os.path.exists(path):
+            with open(path, "rb") as f:
+                self.snapshots = pickle.load(f)
+
+    @staticmethod
+    def state_key(scenario):
+        return tuple(sorted((name, value)
+                            for name, value in scenario.to_dict().items()
+                            if name not in NON_STATE_PARAMETERS))
+
+    def __len__(self):
+        return len(self.snapshots)
+
+    def add(self, snapshot):
+        key = (self.state_key(snapshot.scenario), snapshot.run_number)
+        with self.lock:
+            self.snapshots[key] = snapshot
+
+    # The snapshot for exactly this scenario and run, or None
+    def get(self, scenario, run_number):
+        return self.snapshots.get((self.state_key(scenario), run_number))
+
+    # The snapshot that is closest to the scenario for this run, or None if
+    # there isn't one for the same seed, warm up period and way of drawing
+    # lengths of stay
+    def nearest(self, scenario, run_number):
+        with self.lock:
+            snapshots = list(self.snapshots.values())
+
+        best, best_distance = None, math.inf
+        for snapshot in snapshots:
+            other = snapshot.scenario
+            if (snapshot.run_number != run_number
+                    or other.master_seed != scenario.master_seed
+                    or other.warm_up_period != scenario.warm_up_period
+                    or other.common_random_numbers
+                    != scenario.common_random_numbers):
+                continue
+            distance = sum(abs(math.log(getattr(scenario, name)
+                                        / getattr(other, name)))
+                           for name in DISTANCE_PARAMETERS)
+            if distance < best_distance:
+                best, best_distance = snapshot, distance
+        return best
+
+    # The snapshot for this scenario and run, taking it if it isn't in the
+    # library yet
+    def get_or_take(self, scenario, run_number):
+        snapshot = self.get(scenario, run_number)
+        if snapshot is None:
+            snapshot = take_snapshot(scenario, run_number)
+            self.add(snapshot)
+        return snapshot
+
+    def save(self, path=None):
+        path = path or self.path
+        with self.lock:
+            data = pickle.dumps(self.snapshots,
+                                protocol=pickle.HIGHEST_PROTOCOL)
+        # write to a temporary file and move it into place so a reader never
+        # sees a half written library
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".",
+                                        suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
@@ -0,0 +1,234 @@
+import argparse
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import fields
+
+import numpy as np
+import pandas as pd
+
+try:
+    from .des_classes1 import Scenario, Trial, run_single
+except ImportError: # imported from inside the app folder
+    from des_classes1 import Scenario, Trial, run_single
+
+# Scenario values that can be swept
+SWEEP_PARAMETERS = [f.name for f in fields(Scenario) if f.name != "number_of_runs"]
+
+# Runs every run of every combination of parameter values (a grid of
+# scenarios built on base_scenario), e.g.
+#   Sweep({"number_of_nelbeds": [400, 434, 470],
+#          "mean_time_in_bed": np.arange(150, 231, 20) * 60})
+# All the runs of all the scenarios are handed to one pool of worker
+# processes, and each run's results are appended to output_path as a row of
+# a tidy CSV (one row per scenario and run: the scenario's values, the run
+# number, then the run results) as soon as it finishes. If the sweep is
+# stopped and started again with the same output_path, runs that are already
+# in the file are not run again, so it carries on where it left off. This
+# also means more runs, or more parameter values, can be added to a finished
+# sweep.
+#
+# warm_start, snapshots and top_up_period are as for Trial.
+class Sweep:
+    def __init__(self, parameters, base_scenario=None, output_path=None,
+                 engine="fast", parallel=True, n_workers=None,
+                 warm_start=False, snapshots=None, top_up_period=None):
+        for name in parameters:
+            if name not in SWEEP_PARAMETERS:
+                raise ValueError(f"Can't sweep {name!r}, expected one of "
+                                 f"{SWEEP_PARAMETERS}")
+        self.parameters = {name: list(values)
+                           for name, values in parameters.items()}
+        self.base_scenario = (base_scenario if base_scenario is not None
+                              else Scenario.from_g())
+        self.output_path = output_path
+        self.engine = engine
+        self.parallel = parallel
+        self.n_workers = n_workers
+        self.warm_start = warm_start
+        self.snapshots = snapshots
+        self.top_up_period = top_up_period
+        # rows of results, if there is no output_path
+        self.results = []
+
+    # Every combination of the parameter values, as scenarios
+    def get_scenarios(self):
+        names = list(self.parameters)
+        return [self.base_scenario.replace(
+                    **{name: value.item() if isinstance(value, np.generic)
+                       else value for name, value in zip(names, values)})
+                for values in itertools.product(*self.parameters.values())]
+
+    # Identifies a run of a scenario (given as a dictionary of its values)
+    # in the output. Master seeds can be too big for a column of integers so
+    # are read and compared as strings.
+    @staticmethod
+    def run_key(values, run):
+        return tuple(str(values[name]) if name == "master_seed"
+                     else values[name]
+                     for name in SWEEP_PARAMETERS) + (int(run),)
+
+    # All the results so far (including any from earlier, interrupted
+    # sweeps), one row per scenario and run
+    def load_results(self):
+        rows = pd.DataFrame(self.results)
+        if self.output_path is not None and os.path.exists(self.output_path):
+            self.drop_partial_row()
+            rows = pd.concat([pd.read_csv(self.output_path,
+                                          dtype={"master_seed": str}),
+                              rows], ignore_index=True)
+        return rows
+
+    # If the sweep was killed part way through writing a row, cut it off so
+    # the run is done again
+    def drop_partial_row(self):
+        with open(self.output_path, "rb+") as f:
+            data = f.read()
+            if data and not data.endswith(b"\n"):
+                f.truncate(data.rfind(b"\n") + 1)
+
+    # Rows are kept in memory if there is no output file
+    def write_row(self, row):
+        if self.output_path is None:
+            self.results.append(row)
+            return
+        new_file = (not os.path.exists(self.output_path)
+                    or os.path.getsize(self.output_path) == 0)
+        # one write per row, flushed straight away, so an interrupted sweep
+        # loses at most the row being written
+        with open(self.output_path, "a", newline="") as f:
+            f.write(pd.DataFrame([row]).to_csv(index=False, header=new_file))
+            f.flush()
+
+    # Runs all the runs of all the scenarios that aren't in the output yet,
+    # and returns all the results. progress (optional) is called with the
+    # number of runs done and the total after every run.
+    def run(self, progress=None):
+        scenarios = self.get_scenarios()
+        trials = [Trial(scenario, engine=self.engine,
+                        keep_patient_level=False, warm_start=self.warm_start,
+                        snapshots=self.snapshots,
+                        top_up_period=self.top_up_period)
+                  for scenario in scenarios]
+        # all the trials share one snapshot library
+        if self.warm_start:
+            self.snapshots = trials[0].snapshots
+            for trial in trials:
+                trial.snapshots = self.snapshots
+        result_columns = list(trials[0].df_trial_results.columns)
+
+        done = {self.run_key(row, row["run"])
+                for row in self.load_results().to_dict("records")}
+
+        jobs = []
+        for trial in trials:
+            runs = [run for run in range(trial.scenario.number_of_runs)
+                    if self.run_key(trial.scenario.to_dict(), run) not in done]
+            jobs.extend(trial.get_run_args(runs))
+
+        n_total = len(scenarios) * self.base_scenario.number_of_runs
+        n_done = n_total - len(jobs)
+
+        # results are the output of run_single for a run of scenario
+        def record(scenario, results):
+            nonlocal n_done
+            run, run_results, _, _, _, new_snapshot, _ = results
+            row = {name: getattr(scenario, name) for name in SWEEP_PARAMETERS}
+            row["run"] = run
+            row.update(zip(result_columns, run_results))
+            self.write_row(row)
+            if new_snapshot is not None:
+                self.snapshots.add(new_snapshot)
+            n_done += 1
+            if progress is not None:
+                progress(n_done, n_total)
+
+        # the scenario is the second argument to run_single
+        n_workers = self.n_workers or os.cpu_count() or 1
+        if not self.parallel or n_workers == 1 or len(jobs) <= 1:
+            for args in jobs:
+                record(args[1], run_single(*args))
+        else:
+            with ProcessPoolExecutor(max_workers=min(n_workers, len(jobs))) as pool:
+                futures = {pool.submit(run_single, *args): args[1]
+                           for args in jobs}
+                for future in as_completed(futures):
+                    record(futures[future], future.result())
+
+        return self.load_results().sort_values(
+            SWEEP_PARAMETERS + ["run"], ignore_index=True)
+
+    # Mean of each run result for every scenario in results (from run), one
+    # row per scenario indexed by the values that vary. Each result also has
+    # '<result> Lower 95% CI' and '<result> Upper 95% CI' columns.
+    @staticmethod
+    def summarise(results):
+        import scipy.stats as stats
+
+        swept = [name for name in SWEEP_PARAMETERS
+                 if results[name].nunique() > 1] or SWEEP_PARAMETERS[:1]
+        metrics = [col for col in results.columns
+                   if col not in SWEEP_PARAMETERS + ["run"]]
+        grouped = results.groupby(swept)[metrics]
+        mean = grouped.mean()
+        half_width = grouped.sem() * stats.t.ppf(0.975, grouped.count() - 1)
+
+        summary = pd.DataFrame({"Runs": grouped.size()})
+        for metric in metrics:
+            summary[metric] = mean[metric]
+            summary[f"{metric} Lower 95% CI"] = mean[metric] - half_width[metric]
+            summary[f"{metric} Upper 95% CI"] = mean[metric] + half_width[metric]
+        return summary
+
+
+# Parses a parameter's values from the command line: either a comma
+# separated list, or start:stop:step (stop included if it is on a step)
+def parse_values(text):
+    if ":" in text:
+        start, stop, step = (float(x) for x in text.split(":"))
+        values = np.arange(start, stop + step / 2, step)
+    else:
+        values = np.array([float(x) for x in text.split(",")])
+    if np.all(values == np.round(values)):
+        return [int(v) for v in values]
+    return values.tolist()
+
+# Command line entry point, e.g.
+#   python -m app.sweep number_of_nelbeds=400:480:20 \
+#       mean_time_in_bed=9000,11000,13500 --runs 10 --output sweep.csv
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Run a grid of scenarios and write one row per run to a "
+                    "CSV file. Running it again with the same output carries "
+                    "on where it left off.")
+    parser.add_argument("parameters", nargs="+", metavar="NAME=VALUES",
+                        help="scenario value and the values to sweep, as "
+                             "v1,v2,... or start:stop:step")
+    parser.add_argument("--output", required=True, help="CSV file of results")
+    parser.add_argument("--runs", type=int, default=None,
+                        help="runs per scenario")
+    parser.add_argument("--engine", default="fast", help="simulation engine")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="number of worker processes (default: all CPUs)")
+    args = parser.parse_args(argv)
+
+    parameters = {}
+    for parameter in args.parameters:
+        name, _, values = parameter.partition("=")
+        parameters[name] = parse_values(values)
+    base_scenario = Scenario.from_g()
+    if args.runs is not None:
+        base_scenario = base_scenario.replace(number_of_runs=args.runs)
+
+    sweep = Sweep(parameters, base_scenario, output_path=args.output,
+                  engine=args.engine, n_workers=args.workers)
+    results = sweep.run(
+        progress=lambda done, total: print(f"\r{done}/{total} runs", end=""))
+    print()
+
+    summary = Sweep.summarise(results)
+    print(summary[["Runs"] + list(results.columns[len(SWEEP_PARAMETERS) + 1:])]
+          .round(2).to_string())
+
+if __name__ == "__main__":
+    main()
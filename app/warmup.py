@@ -0,0 +1,126 @@
+import math
+
+import numpy as np
+import pandas as pd
+
+try:
+    from .des_classes1 import Scenario, Trial
+except ImportError: # imported from inside the app folder
+    from des_classes1 import Scenario, Trial
+
+# Monitor series the warm up is judged on
+WARM_UP_SERIES = ["beds_in_use", "queue_length"]
+
+# MSER-5: the series is averaged in batches of batch_size and, for every
+# truncation point d in the first half of the batches, MSER(d) is the
+# variance of the batches after d divided by the number of them. The d that
+# minimises it removes the initial bias without throwing away more data than
+# it needs to. Returns (number of points to truncate, whether the minimum is
+# before the end of the first half). If it isn't, the series has not settled
+# and the run is too short to tell.
+def mser(series, batch_size=5):
+    n_batches = len(series) // batch_size
+    batches = (np.asarray(series[:n_batches * batch_size], dtype=float)
+               .reshape(n_batches, batch_size).mean(axis=1))
+
+    # sums over the batches after each truncation point
+    tail_count = np.arange(n_batches, 0, -1)
+    tail_sum = np.cumsum(batches[::-1])[::-1]
+    tail_sum_sq = np.cumsum(batches[::-1] ** 2)[::-1]
+    sum_sq_dev = np.maximum(tail_sum_sq - tail_sum ** 2 / tail_count, 0)
+    mser_values = sum_sq_dev / tail_count ** 2
+
+    limit = n_batches // 2
+    d = int(np.argmin(mser_values[:limit + 1]))
+    return d * batch_size, d < limit
+
+
+# Works out how long the warm up needs to be for a scenario. Pilot runs are
+# done with no warm up for twice the scenario's warm up plus its sim_duration
+# (so MSER, which only looks in the first half, can find a warm up longer
+# than the scenario's), the bed monitor series are averaged over the runs (as
+# in Welch's method) and MSER-5 picks the truncation point of each. The warm
+# up is the longest of these, rounded up to whole days, so it is long enough
+# for every series. If any series hasn't settled by half way through the
+# pilot runs the scenario's own warm up is kept, and warning() says so (it
+# may be too short).
+class WarmUpAnalysis:
+    def __init__(self, scenario=None, n_runs=5, engine="simpy",
+                 parallel=False, n_workers=None, batch_size=5):
+        self.scenario = scenario if scenario is not None else Scenario.from_g()
+        self.n_runs = n_runs
+        self.engine = engine
+        self.parallel = parallel
+        self.n_workers = n_workers
+        self.batch_size = batch_size
+        self.series = None
+        self.truncation = {}
+        self.settled = {}
+        self.warm_up_period = None
+        self.pilot_duration = (self.scenario.sim_duration
+                               + 2 * self.scenario.warm_up_period)
+
+    # progress (optional) is called with the number of pilot runs done and
+    # the total after every run; an exception raised from it stops them. pool
+    # is a pool of worker processes to use (as for Trial.iter_runs).
+    def run(self, progress=None, pool=None):
+        pilot_scenario = self.scenario.replace(
+            warm_up_period=0,
+            sim_duration=self.pilot_duration,
+            number_of_runs=self.n_runs)
+        pilot = Trial(pilot_scenario, engine=self.engine,
+                      parallel=self.parallel, n_workers=self.n_workers,
+                      keep_patient_level=False)
+        # only the bed monitors are needed, not the trial results
+        monitors = []
+        for results in pilot.iter_runs(pool):
+            monitors.append(results[4])
+            if progress is not None:
+                progress(len(monitors), self.n_runs)
+        self.series = pd.DataFrame(
+            {name: np.mean([getattr(m, name) for m in monitors], axis=0)
+             for name in WARM_UP_SERIES},
+            index=pd.Index(monitors[0].times, name="time"))
+
+        interval = monitors[0].interval
+        for name in WARM_UP_SERIES:
+            n_points, settled = mser(self.series[name].to_numpy(),
+                                     self.batch_size)
+            self.truncation[name] = n_points * interval
+            self.settled[name] = settled
+
+        if all(self.settled.values()):
+            day = 24 * 60
+            self.warm_up_period = (
+                math.ceil(max(self.truncation.values()) / day) * day)
+        else:
+            self.warm_up_period = self.scenario.warm_up_period
+
+        return self.warm_up_period
+
+    # Why the scenario's own warm up was kept instead of a detected one, or
+    # None if every series settled
+    def warning(self):
+        unsettled = [name for name in WARM_UP_SERIES if not self.settled[name]]
+        if not unsettled:
+            return None
+        day = 24 * 60
+        return (f"The warm up couldn't be worked out: {' and '.join(unsettled)} "
+                f"hadn't settled half way through the "
+                f"{self.pilot_duration / day:g} day pilot runs, so the "
+                f"scenario's own warm up of {self.scenario.warm_up_period / day:g} "
+                f"days is used, and may be too short")
+
+    # The scenario with the detected warm up period
+    def get_scenario(self):
+        return self.scenario.replace(warm_up_period=self.warm_up_period)
+
+    # One row per series with its truncation point in days and whether it
+    # settled
+    def to_dataframe(self):
+        return pd.DataFrame({
+            "Series": WARM_UP_SERIES,
+            "Warm Up (Days)": [self.truncation[name] / (24 * 60)
+                               for name in WARM_UP_SERIES],
+            "Settled": [self.settled[name] for name in WARM_UP_SERIES]
+        }).set_index("Series").round(2)
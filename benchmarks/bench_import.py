@@ -0,0 +1,49 @@
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+# Checks that importing the model stays cheap. Each import runs in a fresh
+# interpreter so nothing is already cached in sys.modules.
+#   python benchmarks/bench_import.py --budget 3
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_MODULE = "app.des_classes1"
+DEFAULT_BUDGET = 3.0 # seconds
+DEFAULT_REPEATS = 5
+
+# Wall time (seconds) to start python and import the module, best of
+# `repeats`. Python start-up on its own is subtracted.
+def time_import(module=DEFAULT_MODULE, repeats=DEFAULT_REPEATS):
+    def best_of(code):
+        times = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, "-c", code], cwd=REPO_ROOT,
+                           check=True)
+            times.append(time.perf_counter() - start)
+        return min(times)
+
+    return best_of(f"import {module}") - best_of("pass")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import time benchmark")
+    parser.add_argument("--module", default=DEFAULT_MODULE)
+    parser.add_argument("--budget", type=float, default=DEFAULT_BUDGET,
+                        help="maximum import time in seconds")
+    parser.add_argument("--repeats", type=int, default=DEFAULT_REPEATS)
+    args = parser.parse_args(argv)
+
+    import_time = time_import(args.module, args.repeats)
+    print(f"import {args.module}: {import_time:.3f}s "
+          f"(budget {args.budget:.3f}s)")
+
+    if import_time > args.budget:
+        print("FAIL: import time is over budget")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
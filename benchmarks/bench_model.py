@@ -0,0 +1,216 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+from bench_import import REPO_ROOT, time_import
+
+sys.path.insert(0, REPO_ROOT)
+
+from app.des_classes1 import (g, Scenario, Trial, get_model_class,
+                              run_single)
+
+# Times single model runs and whole trials on fixed scenarios, writes the
+# results to a JSON file and compares them against a stored baseline, e.g.
+#   python benchmarks/bench_model.py --save-baseline   (once, before a change)
+#   python benchmarks/bench_model.py                   (after it)
+# Exits with 1 if anything is more than --tolerance slower (or uses more
+# memory) than the baseline. Timings vary from machine to machine, so the
+# baseline should be made on the machine it is compared on.
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_RESULTS = os.path.join(BENCH_DIR, "results.json")
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, "baseline.json")
+DEFAULT_TOLERANCE = 0.2
+DEFAULT_REPEATS = 3
+# Quick benchmarks are repeated until they have taken at least this long in
+# total (seconds), as one fast engine run is too short to time reliably
+MIN_TOTAL_TIME = 2.0
+
+# The fixed scenarios: the default 434 beds, a congested hospital with 300
+# beds (long queues, lots of reneging) and a quarter more arrivals by every
+# route
+SCENARIOS = {
+    "default": Scenario(),
+    "congested": Scenario(number_of_nelbeds=300),
+    "high_arrivals": Scenario(ed_inter_visit=g.ed_inter_visit / 1.25,
+                              sdec_inter_visit=g.sdec_inter_visit / 1.25,
+                              other_inter_visit=g.other_inter_visit / 1.25),
+}
+
+# Benchmarks: one model run of every scenario on each engine, and trials of
+# the default scenario. 100 runs of the SimPy engine would take minutes, so
+# that trial is on the fast engine only.
+BENCHMARKS = (
+    [{"name": f"model_{scenario}_{engine}", "kind": "model",
+      "scenario": scenario, "engine": engine}
+     for scenario in SCENARIOS for engine in ["simpy", "fast"]]
+    + [{"name": "trial_10_simpy", "kind": "trial", "scenario": "default",
+        "engine": "simpy", "runs": 10},
+       {"name": "trial_10_fast", "kind": "trial", "scenario": "default",
+        "engine": "fast", "runs": 10},
+       {"name": "trial_100_fast", "kind": "trial", "scenario": "default",
+        "engine": "fast", "runs": 100}]
+)
+
+# Modules whose import time is measured (Model and Trial are in
+# des_classes1)
+IMPORTS = ["app.des_classes1", "app.fast_engine"]
+
+# Whether more is worse for each measurement, for comparing with the baseline
+HIGHER_IS_WORSE = {"runtime_s": True, "events_per_sec": False,
+                   "peak_memory_mb": True, "import_s": True}
+
+# Best wall time (seconds) of calling func at least `repeats` times
+def best_time(func, repeats):
+    times = []
+    while len(times) < repeats or sum(times) < MIN_TOTAL_TIME:
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+# Runtime is the best of `repeats` (or more) unprofiled runs. Events and peak
+# memory come from one more run, profiled and with its memory traced (which
+# slows it down, so it isn't timed).
+def bench_model(scenario, engine, repeats):
+    model_class = get_model_class(engine)
+    runtime = best_time(lambda: model_class(0, scenario).run(), repeats)
+
+    profile = run_single(0, scenario, engine, keep_patient_level=False,
+                         profile="memory")[-1]
+    return {"runtime_s": runtime,
+            "events_per_sec": profile.events / runtime,
+            "peak_memory_mb": profile.peak_memory / 1024**2}
+
+# As bench_model, for a trial of `runs` runs in this process
+def bench_trial(scenario, engine, runs, repeats):
+    scenario = scenario.replace(number_of_runs=runs)
+    runtime = best_time(
+        lambda: Trial(scenario, engine=engine,
+                      keep_patient_level=False).run_trial(),
+        repeats)
+
+    tracemalloc.start()
+    try:
+        trial = Trial(scenario, engine=engine, keep_patient_level=False,
+                      profile=True)
+        trial.run_trial()
+        peak_memory = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    events = sum(profile.events for profile in trial.profiles)
+    return {"runtime_s": runtime,
+            "events_per_sec": events / runtime,
+            "peak_memory_mb": peak_memory / 1024**2}
+
+# Runs the benchmarks whose names contain any of `only` (all of them if it
+# is empty)
+def run_benchmarks(only=(), repeats=DEFAULT_REPEATS,
+                   trial_repeats=DEFAULT_REPEATS, import_repeats=5):
+    results = {}
+    for benchmark in BENCHMARKS:
+        name = benchmark["name"]
+        if only and not any(part in name for part in only):
+            continue
+        print(f"{name}...", end="", flush=True)
+        scenario = SCENARIOS[benchmark["scenario"]]
+        if benchmark["kind"] == "model":
+            results[name] = bench_model(scenario, benchmark["engine"], repeats)
+        else:
+            results[name] = bench_trial(scenario, benchmark["engine"],
+                                        benchmark["runs"], trial_repeats)
+        print(f" {results[name]['runtime_s']:.3f}s")
+
+    for module in IMPORTS:
+        name = f"import_{module}"
+        if only and not any(part in name for part in only):
+            continue
+        results[name] = {"import_s": time_import(module, import_repeats)}
+        print(f"{name}: {results[name]['import_s']:.3f}s")
+
+    return {"python": platform.python_version(),
+            "platform": platform.platform(),
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "results": results}
+
+# Rows of (benchmark, measurement, baseline, current, change, regressed) for
+# every measurement in both. change is current / baseline - 1.
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    rows = []
+    for name, measurements in results["results"].items():
+        base = baseline["results"].get(name)
+        if base is None:
+            continue
+        for measurement, value in measurements.items():
+            if measurement not in base or not base[measurement]:
+                continue
+            change = value / base[measurement] - 1
+            if HIGHER_IS_WORSE[measurement]:
+                regressed = change > tolerance
+            else:
+                regressed = change < -tolerance / (1 + tolerance)
+            rows.append((name, measurement, base[measurement], value, change,
+                         regressed))
+    return rows
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark model runs and trials against a baseline")
+    parser.add_argument("--only", nargs="*", default=[],
+                        help="only run benchmarks whose names contain one of "
+                             "these, e.g. fast model_default")
+    parser.add_argument("--repeats", type=int, default=DEFAULT_REPEATS,
+                        help="model runs timed per benchmark (best is kept)")
+    parser.add_argument("--trial-repeats", type=int, default=DEFAULT_REPEATS,
+                        help="trials timed per benchmark (best is kept)")
+    parser.add_argument("--output", default=DEFAULT_RESULTS,
+                        help="JSON file to write the results to")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE,
+                        help="JSON file of baseline results")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="write the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="fraction worse than the baseline that counts "
+                             "as a regression")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.only, args.repeats, args.trial_repeats)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline written to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}, run with --save-baseline "
+              f"to make one")
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    rows = compare(results, baseline, args.tolerance)
+    print()
+    print(f"{'benchmark':<32}{'measurement':<16}{'baseline':>12}"
+          f"{'current':>12}{'change':>9}")
+    for name, measurement, base, value, change, regressed in rows:
+        flag = "  REGRESSED" if regressed else ""
+        print(f"{name:<32}{measurement:<16}{base:>12.4g}{value:>12.4g}"
+              f"{change:>+9.1%}{flag}")
+
+    n_regressed = sum(row[-1] for row in rows)
+    if n_regressed:
+        print(f"FAIL: {n_regressed} measurements are more than "
+              f"{args.tolerance:.0%} worse than the baseline")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
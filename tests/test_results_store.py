@@ -0,0 +1,27 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from app.recorder import PATIENT_COLUMNS
+from app.results_store import PatientResultsStore
+
+
+def test_clear_only_removes_runs(tmp_path):
+    notes = tmp_path / "notes.txt"
+    notes.write_text("keep me")
+    leftover = tmp_path / "run_abc123.arrow.tmp"
+    leftover.write_bytes(b"half written")
+
+    store = PatientResultsStore(str(tmp_path))
+    patients = pd.DataFrame({"Department": ["ED", "SDEC"],
+                             **{col: np.nan for col in PATIENT_COLUMNS}},
+                            index=pd.Index([1, 2], name="Patient ID"))
+    store.write_run(0, patients)
+    store.write_run(1, patients)
+    assert store.runs() == [0, 1]
+
+    store.clear()
+    assert store.runs() == []
+    assert sorted(os.listdir(tmp_path)) == ["notes.txt"]
+    assert notes.read_text() == "keep me"
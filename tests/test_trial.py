@@ -0,0 +1,24 @@
+import pytest
+
+from app.des_classes1 import Scenario, SUMMARY_METRICS, Trial
+
+# A short scenario so the trials run quickly
+SCENARIO = Scenario(sim_duration=7 * 1440, warm_up_period=7 * 1440,
+                    number_of_runs=3, master_seed=42)
+
+CUSTOM_METRICS = {name: SUMMARY_METRICS[name]
+                  for name in ["ED Admissions", "Reneged"]}
+
+
+# A trial summarising metrics that leave out the precision metrics still runs
+# as long as it isn't sequential
+def test_custom_metrics_without_precision():
+    trial = Trial(SCENARIO, engine="fast", metrics=CUSTOM_METRICS)
+    _, _, trial_summary = trial.run_trial()
+    assert list(trial_summary.index) == list(CUSTOM_METRICS)
+    assert trial.precision_df is None
+
+
+def test_precision_metrics_must_be_summarised():
+    with pytest.raises(ValueError, match="Mean Q Time"):
+        Trial(SCENARIO, engine="fast", metrics=CUSTOM_METRICS, precision=0.05)